@@ -0,0 +1,17 @@
+"""Microbenchmarks of JSONRPCake's hot paths.
+
+Run them from the root of the repository, offline and with nothing but
+JSONRPCake's own dependencies installed::
+
+    $ python -m benchmarks                  # compare with baseline.json
+    $ python -m benchmarks --filter pygments
+    $ python -m benchmarks --huge           # include the 100 MB payload
+    $ python -m benchmarks --save           # record a new baseline
+
+Every benchmark is timed (the best of several rounds) and its peak memory
+use is measured with :mod:`tracemalloc`. The run fails if a benchmark got
+slower, or uses more memory, than the baseline by more than the
+threshold. Baselines are machine-specific; record one on the machine the
+comparisons are made on.
+
+"""
@@ -0,0 +1,123 @@
+"""The benchmarks.
+
+Each benchmark is a setup function that is passed the payload (if any)
+and returns the function to be timed, so that preparing the input isn't
+measured.
+
+"""
+import os
+from argparse import Namespace
+
+from jsonrpcake.input import (KeyValueArgType, SEP_GROUP_ALL_ITEMS,
+                              parse_items)
+from jsonrpcake.models import Environment
+from jsonrpcake.output import (JSONProcessor, CompactJSONProcessor,
+                               PygmentsProcessor, build_output_stream,
+                               write, DEFAULT_STYLE)
+
+from . import payloads
+
+
+# Colored terminal output, without the on-disk style cache so that the
+# results don't depend on its state.
+env = Environment(colors=256, cache_dir=None, stdout_isatty=True)
+
+# How many REQUEST_ITEMs the argument parsing benchmarks parse.
+ITEMS = 1000
+
+ITEM_TEMPLATES = (
+    'name{0}=John Smith',
+    'uid{0}:={0}',
+    'tags{0}:=["a", "b", {{"c": [1, 2, 3]}}]',
+    r'escaped\=key{0}=value\:with\=separators',
+)
+
+# The chunk size output is written in by the `write` benchmark.
+CHUNK_SIZE = 64 << 10
+
+
+class Benchmark(object):
+
+    def __init__(self, name, setup, payload=None):
+        self.name = name
+        self.setup = setup
+        self.payload = payload
+
+    @property
+    def huge(self):
+        return self.payload is not None and payloads.PAYLOADS[self.payload][1]
+
+    def prepare(self):
+        """Return the function to be timed."""
+        if self.payload is None:
+            return self.setup()
+        return self.setup(payloads.get(self.payload))
+
+
+BENCHMARKS = []
+
+
+def benchmark(name, on=(None,)):
+    """Register the decorated setup function as benchmark `name`, run
+    once for every payload in `on`.
+
+    """
+    def decorator(setup):
+        for payload in on:
+            BENCHMARKS.append(Benchmark(
+                name if payload is None else '%s[%s]' % (name, payload),
+                setup, payload))
+        return setup
+    return decorator
+
+
+def item_strings():
+    return [ITEM_TEMPLATES[i % len(ITEM_TEMPLATES)].format(i)
+            for i in range(ITEMS)]
+
+
+@benchmark('key_value_arg_type')
+def key_value_arg_type():
+    arg_type = KeyValueArgType(*SEP_GROUP_ALL_ITEMS)
+    strings = item_strings()
+    return lambda: [arg_type(string) for string in strings]
+
+
+@benchmark('parse_items')
+def parse_items_():
+    arg_type = KeyValueArgType(*SEP_GROUP_ALL_ITEMS)
+    items = [arg_type(string) for string in item_strings()]
+    return lambda: parse_items(items)
+
+
+@benchmark('json_processor', on=('small', '1mb', 'nested', '100mb'))
+def json_processor(value):
+    processor = JSONProcessor(env)
+    return lambda: processor.serialize(value)
+
+
+@benchmark('compact_processor', on=('small', '1mb', 'nested', '100mb'))
+def compact_processor(value):
+    processor = CompactJSONProcessor(env)
+    return lambda: processor.serialize(value)
+
+
+@benchmark('pygments_processor', on=('small', '1mb', 'nested'))
+def pygments_processor(value):
+    processor = PygmentsProcessor(env, pygments_style=DEFAULT_STYLE)
+    content = JSONProcessor(env).serialize(value)
+    return lambda: processor.process_body(content)
+
+
+@benchmark('build_output_stream', on=('small', '1mb', 'nested'))
+def build_output_stream_(value):
+    args = Namespace(prettify=['format', 'colors'], style=DEFAULT_STYLE)
+    return lambda: b''.join(build_output_stream(args, env, None, value))
+
+
+@benchmark('write', on=('1mb', '100mb'))
+def write_(value):
+    data = CompactJSONProcessor(env).serialize(value).encode('utf8')
+    chunks = [data[i:i + CHUNK_SIZE] for i in range(0, len(data), CHUNK_SIZE)]
+    outfile = open(os.devnull, 'wb')
+    return lambda: write(chunks, outfile, flush=False)
@@ -0,0 +1,69 @@
+"""Measures what processing --batch output in worker processes saves.
+
+Formats the same records in-process and in a pool of worker processes,
+as NDJSON and as colorized NDJSON. Sending a record to a worker and its
+output back only pays off when processing it costs more than that.
+
+    $ python -m benchmarks.parallel
+
+"""
+from __future__ import division
+import sys
+import time
+import multiprocessing
+from argparse import ArgumentParser
+
+from jsonrpcake.models import Environment
+from jsonrpcake.output import ParallelProcessor, DEFAULT_STYLE
+
+from .runner import format_seconds
+
+
+# How many records are formatted every way.
+RECORDS = 20000
+
+
+def record(i):
+    return {'id': i, 'result': {'name': 'user %d' % i,
+                                'tags': ['a', 'b', 'c'],
+                                'bio': 'x' * 300,
+                                'scores': list(range(20))}}
+
+
+def process(groups, workers, values):
+    processor = ParallelProcessor(
+        groups, env=Environment(colors=256), workers=workers, threshold=0,
+        pygments_style=DEFAULT_STYLE)
+    for value in values:
+        processor.submit(value)
+    processor.finish()
+
+
+def main(args=sys.argv[1:]):
+    parser = ArgumentParser(prog='python -m benchmarks.parallel')
+    parser.add_argument('--records', type=int, default=RECORDS,
+                        help='the records formatted (default %d)' % RECORDS)
+    parser.add_argument('--workers', type=int,
+                        default=max(2, multiprocessing.cpu_count()),
+                        help='the worker processes (default one per CPU, '
+                        'at least 2)')
+    args = parser.parse_args(args)
+
+    values = [record(i) for i in range(args.records)]
+    print('%d CPUs, %d workers' % (multiprocessing.cpu_count(),
+                                   args.workers))
+    for name, groups in (('ndjson', ['ndjson']),
+                         ('colorized ndjson', ['ndjson', 'colors'])):
+        timings = []
+        for workers in (0, args.workers):
+            started = time.perf_counter()
+            process(groups, workers, values)
+            timings.append((time.perf_counter() - started) / args.records)
+        print('%-18s %12s per record in-process, %12s in workers (x%.2f)'
+              % (name, format_seconds(timings[0]),
+                 format_seconds(timings[1]), timings[0] / timings[1]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""Deterministic, realistic JSON-RPC payloads of various sizes.
+
+"""
+import json
+import random
+
+
+# The seed every payload is generated from, so that runs are comparable.
+SEED = 2013
+
+WORDS = (
+    'alpha bravo charlie delta echo foxtrot golf hotel india juliett kilo '
+    'lima mike november oscar papa quebec romeo sierra tango uniform '
+    'victor whiskey x-ray yankee zulu été 日本'
+).split()
+
+
+def record(rng, index):
+    """Return a user-like object, about 400 bytes of JSON."""
+    return {
+        'id': index,
+        'name': ' '.join(rng.choice(WORDS) for _ in range(2)).title(),
+        'email': '%s%d@example.org' % (rng.choice(WORDS), index),
+        'active': rng.random() < 0.8,
+        'score': round(rng.uniform(0, 100), 3),
+        'tags': [rng.choice(WORDS) for _ in range(rng.randint(0, 5))],
+        'address': {
+            'street': '%d %s St' % (rng.randint(1, 9999),
+                                   rng.choice(WORDS).title()),
+            'city': rng.choice(WORDS).title(),
+            'zip': '%05d' % rng.randint(0, 99999),
+        },
+        'groups': [rng.randint(1, 50) for _ in range(rng.randint(0, 4))],
+        'manager': None if rng.random() < 0.3 else rng.randint(1, index + 1),
+        'bio': ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 20))),
+    }
+
+
+def sized(size):
+    """Return a ``{"users": [...], "total": N}`` result of about `size`
+    bytes of JSON.
+
+    """
+    rng = random.Random(SEED)
+    users = []
+    encoded = 0
+    while encoded < size:
+        user = record(rng, len(users))
+        encoded += len(json.dumps(user)) + 2
+        users.append(user)
+    return {'users': users, 'total': len(users)}
+
+
+def nested(depth=200, width=3):
+    """Return a deeply nested result: objects and arrays alternating
+    `depth` levels deep, with `width` scalar siblings on every level.
+
+    """
+    rng = random.Random(SEED)
+    value = {'leaf': True}
+    for level in range(depth):
+        siblings = [rng.choice(WORDS) for _ in range(width)]
+        if level % 2:
+            value = {'level': level, 'child': value, 'siblings': siblings}
+        else:
+            value = [level, value] + siblings
+    return value
+
+
+# ``name: (factory, huge)``; huge payloads only run with ``--huge``.
+PAYLOADS = {
+    'small': (lambda: record(random.Random(SEED), 1), False),
+    '1mb': (lambda: sized(1 << 20), False),
+    'nested': (nested, False),
+    '100mb': (lambda: sized(100 << 20), True),
+}
+
+_generated = {}
+
+
+def get(name):
+    """Return the (shared) payload `name`."""
+    if name not in _generated:
+        _generated[name] = PAYLOADS[name][0]()
+    return _generated[name]
+
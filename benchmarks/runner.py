@@ -0,0 +1,199 @@
+"""Runs the benchmarks and compares the results with a stored baseline.
+
+"""
+from __future__ import division
+import os
+import sys
+import gc
+import json
+import time
+import platform
+import tracemalloc
+from argparse import ArgumentParser
+
+from .cases import BENCHMARKS
+
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+# Each round of a benchmark runs for at least this many seconds.
+MIN_ROUND_TIME = 0.2
+
+# The best of this many rounds is taken.
+ROUNDS = 5
+
+# Default regression thresholds, relative to the baseline.
+TIME_THRESHOLD = 0.25
+MEMORY_THRESHOLD = 0.10
+
+# Smaller increases in peak memory are never regressions; they're noise.
+MEMORY_SLACK = 64 << 10
+
+
+def measure_time(func, rounds=ROUNDS, min_time=MIN_ROUND_TIME):
+    """Return the best time of one call of `func` out of `rounds`
+    rounds, each repeating it for at least `min_time` seconds.
+
+    """
+    number = 1
+    while True:
+        elapsed = _time(func, number)
+        if elapsed >= min_time:
+            break
+        number = max(number * 2, int(number * min_time / elapsed)
+                     if elapsed else number * 10)
+    best = elapsed
+    for _ in range(rounds - 1):
+        best = min(best, _time(func, number))
+    return best / number
+
+
+def _time(func, number):
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        return time.perf_counter() - started
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def measure_memory(func):
+    """Return the peak memory allocated during one call of `func`."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def machine():
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+    }
+
+
+def run(benchmarks, out=sys.stdout):
+    """Run `benchmarks`; return ``{name: {"seconds": ..., "peak_bytes":
+    ...}}``.
+
+    """
+    results = {}
+    for bench in benchmarks:
+        func = bench.prepare()
+        # Warm up caches (e.g., the formatter's style table).
+        func()
+        results[bench.name] = {
+            'seconds': measure_time(func),
+            'peak_bytes': measure_memory(func),
+        }
+        out.write('%-32s %12s %12s\n' % (
+            bench.name, format_seconds(results[bench.name]['seconds']),
+            format_bytes(results[bench.name]['peak_bytes'])))
+        out.flush()
+    return results
+
+
+def compare(results, baseline, time_threshold, memory_threshold):
+    """Return a list of regressions of `results` against `baseline`,
+    as text.
+
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            continue
+        for key, threshold, slack, fmt in (
+                ('seconds', time_threshold, 0, format_seconds),
+                ('peak_bytes', memory_threshold, MEMORY_SLACK, format_bytes)):
+            if (result[key] > base[key] * (1 + threshold)
+                    and result[key] - base[key] > slack):
+                regressions.append(
+                    '%s: %s %s -> %s (+%.0f%%, threshold %.0f%%)' % (
+                        name, key, fmt(base[key]), fmt(result[key]),
+                        (result[key] / base[key] - 1) * 100,
+                        threshold * 100))
+    return regressions
+
+
+def format_seconds(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '%.2f %s' % (seconds / scale, unit)
+    return '%.0f ns' % (seconds / 1e-9)
+
+
+def format_bytes(size):
+    for unit, scale in (('MiB', 1 << 20), ('KiB', 1 << 10)):
+        if size >= scale:
+            return '%.1f %s' % (size / scale, unit)
+    return '%d B' % size
+
+
+def main(args=sys.argv[1:]):
+    parser = ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--filter', metavar='TEXT',
+                        help='only run the benchmarks whose name contains '
+                             'TEXT')
+    parser.add_argument('--huge', action='store_true',
+                        help='also run the benchmarks on the 100 MB payload')
+    parser.add_argument('--baseline', default=BASELINE, metavar='FILE',
+                        help='the baseline to compare with or to save to')
+    parser.add_argument('--save', action='store_true',
+                        help='save the results as the baseline (merged '
+                             'with the benchmarks that were not run)')
+    parser.add_argument('--threshold', type=float, default=TIME_THRESHOLD,
+                        metavar='FRACTION',
+                        help='the allowed slowdown (default %.2f)'
+                             % TIME_THRESHOLD)
+    parser.add_argument('--memory-threshold', type=float,
+                        default=MEMORY_THRESHOLD, metavar='FRACTION',
+                        help='the allowed increase in peak memory '
+                             '(default %.2f)' % MEMORY_THRESHOLD)
+    args = parser.parse_args(args)
+
+    benchmarks = [bench for bench in BENCHMARKS
+                  if (args.huge or not bench.huge)
+                  and (not args.filter or args.filter in bench.name)]
+
+    try:
+        with open(args.baseline) as f:
+            stored = json.load(f)
+    except (IOError, OSError, ValueError):
+        stored = {'machine': None, 'results': {}}
+
+    results = run(benchmarks)
+
+    if args.save:
+        stored['results'].update(results)
+        stored['machine'] = machine()
+        with open(args.baseline, 'w') as f:
+            json.dump(stored, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Saved the baseline to %s' % args.baseline)
+        return 0
+
+    if not stored['results']:
+        print('No baseline to compare with; record one with --save')
+        return 0
+    if stored['machine'] != machine():
+        print('Warning: the baseline was recorded on a different machine '
+              '(%s)' % stored['machine'])
+    regressions = compare(results, stored['results'],
+                          args.threshold, args.memory_threshold)
+    if regressions:
+        print('\n%d regression(s):' % len(regressions))
+        for regression in regressions:
+            print('  ' + regression)
+        return 1
+    print('\nNo regressions')
+    return 0
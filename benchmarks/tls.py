@@ -0,0 +1,148 @@
+"""Measures what TLS session resumption and connection reuse save.
+
+Calls a local TLS echo server (with the self-signed certificate in
+``localhost.pem``) over a new connection per call with a full handshake,
+over a new connection per call that resumes the previous TLS session, and
+over one pooled connection, with plain TCP for reference.
+
+    $ python -m benchmarks.tls
+
+"""
+from __future__ import division
+import os
+import sys
+import ssl
+import json
+import time
+import socket
+import threading
+from argparse import ArgumentParser
+
+from jsonrpcake.client import Client
+from jsonrpcake.tls import TLSConfig
+from jsonrpcake.transport import Connection, ConnectionPool
+
+from .runner import format_seconds
+
+
+CERT = os.path.join(os.path.dirname(__file__), 'localhost.pem')
+
+# How many calls every way of calling makes.
+CALLS = 200
+
+
+def serve_connection(sock):
+    """Echo the params of every request on `sock` back as the result."""
+    rfile = sock.makefile('rb')
+    try:
+        while True:
+            digits = b''
+            while True:
+                c = rfile.read(1)
+                if not c:
+                    return
+                if c == b':':
+                    break
+                digits += c
+            request = json.loads(rfile.read(int(digits)).decode('utf8'))
+            rfile.read(1)
+            body = json.dumps({'jsonrpc': '2.0', 'id': request['id'],
+                               'result': request.get('params')})
+            body = body.encode('utf8')
+            sock.sendall(str(len(body)).encode('ascii') + b':' + body + b',')
+    except (socket.error, ValueError):
+        pass
+    finally:
+        sock.close()
+
+
+def start_server(context=None):
+    """Start an echo server in the background; return its port."""
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+
+    def accept():
+        while True:
+            sock, _ = listener.accept()
+            if context is not None:
+                try:
+                    sock = context.wrap_socket(sock, server_side=True)
+                except (socket.error, ssl.SSLError):
+                    sock.close()
+                    continue
+            threading.Thread(target=serve_connection, args=(sock,),
+                             daemon=True).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+
+def new_connection(addr, tls_factory, calls):
+    """Make every call over a new connection. Return the connections
+    that resumed a session.
+
+    """
+    resumed = 0
+    for _ in range(calls):
+        conn = Connection(addr, connect_timeout=5, tls=tls_factory())
+        try:
+            conn.request('echo', {'n': 1})
+        finally:
+            conn.close()
+        resumed += conn.resumed
+    return resumed
+
+
+def pooled(addr, tls, calls):
+    client = Client(addr, pool=ConnectionPool(tls=tls))
+    for _ in range(calls):
+        client.call('echo', {'n': 1})
+    client.close()
+    return 0
+
+
+def main(args=sys.argv[1:]):
+    parser = ArgumentParser(prog='python -m benchmarks.tls')
+    parser.add_argument('--calls', type=int, default=CALLS,
+                        help='the calls made every way (default %d)' % CALLS)
+    args = parser.parse_args(args)
+
+    server_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    server_context.load_cert_chain(CERT)
+    tls_addr = 'tls://localhost:%d' % start_server(server_context)
+    tcp_addr = 'localhost:%d' % start_server()
+    shared = TLSConfig(verify=CERT)
+    forgetful = TLSConfig(verify=CERT)
+
+    def without_sessions():
+        forgetful.sessions.clear()
+        return forgetful
+
+    cases = [
+        ('tcp, new connections', lambda: new_connection(
+            tcp_addr, lambda: None, args.calls)),
+        ('tls, full handshakes', lambda: new_connection(
+            tls_addr, without_sessions, args.calls)),
+        ('tls, resumed sessions', lambda: new_connection(
+            tls_addr, lambda: shared, args.calls)),
+        ('tls, pooled connection', lambda: pooled(
+            tls_addr, shared, args.calls)),
+    ]
+    timings = {}
+    for name, func in cases:
+        started = time.perf_counter()
+        resumed = func()
+        timings[name] = (time.perf_counter() - started) / args.calls
+        print('%-24s %12s per call  (%d resumed)'
+              % (name, format_seconds(timings[name]), resumed))
+
+    full = timings['tls, full handshakes']
+    for name in ('tls, resumed sessions', 'tls, pooled connection'):
+        print('%s saves %.0f%% of the time per call'
+              % (name, (1 - timings[name] / full) * 100))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,3 +12,12 @@ class ExitStatus:
     OK = 0
     ERROR = 1
     ERROR_TIMEOUT = 2
+
+
+def __getattr__(name):
+    # `Client` is imported lazily so that `setup.py` can import this
+    # package before the dependencies are installed.
+    if name == 'Client':
+        from .client import Client
+        return Client
+    raise AttributeError(name)
@@ -0,0 +1,203 @@
+"""Client-side load balancing across the replicas of a service.
+
+"""
+from __future__ import division
+import time
+import errno
+import random
+import socket
+import threading
+
+from .client import Client
+from .transport import Connection
+
+
+LEAST_OUTSTANDING = 'least-outstanding'
+POWER_OF_TWO = 'p2c'
+POLICIES = (LEAST_OUTSTANDING, POWER_OF_TWO)
+
+# Weight of the latest latency sample in the moving average.
+EWMA_ALPHA = 0.3
+
+# A replica is ejected for twice as long every time it fails again soon
+# after recovering, up to this many times the eject time.
+MAX_EJECT_FACTOR = 32
+
+
+class Replica(object):
+    """A replica and its statistics."""
+
+    def __init__(self, addr, client):
+        self.addr = addr
+        self.client = client
+        self.outstanding = 0
+        self.ewma = None
+        self.calls = 0
+        self.errors = 0
+        self.ejections = 0
+        self.ejected = False
+        self.eject_factor = 1
+        self.probe_at = 0
+        self.probing = False
+        self.total_latency = 0.0
+
+    @property
+    def score(self):
+        # Unknown latency counts as zero so that new replicas get tried.
+        return (self.ewma or 0.0) * (self.outstanding + 1)
+
+    def record(self, latency):
+        self.calls += 1
+        self.total_latency += latency
+        if self.ewma is None:
+            self.ewma = latency
+        else:
+            self.ewma += EWMA_ALPHA * (latency - self.ewma)
+
+
+def is_connect_error(error):
+    """Return `True` if `error` means the request never reached the
+    server, so it's safe to try another replica.
+
+    """
+    return (isinstance(error, socket.error)
+            and getattr(error, 'errno', None) == errno.ECONNREFUSED)
+
+
+def is_eject_error(error):
+    return isinstance(error, (socket.timeout, socket.error))
+
+
+class Balancer(object):
+    """Spread calls across replicas, duck-typing :class:`client.Client`.
+
+    Replicas that time out or refuse connections are ejected for
+    `eject_time` seconds (doubling if they fail again soon). After that
+    they are probed with a TCP connect in the background, and only take
+    calls again once a probe succeeds. Calls that were refused a
+    connection are retried on another replica.
+
+    With `coalesce`, a :class:`coalesce.SingleFlight`, calls identical
+    to one already in flight (to any replica) wait for its result.
+
+    """
+
+    def __init__(self, addrs, policy=LEAST_OUTSTANDING, eject_time=10,
+                 pool=None, coalesce=None, **client_kwargs):
+        self.replicas = [Replica(addr, Client(addr, pool=pool,
+                                              **client_kwargs))
+                         for addr in addrs]
+        self.policy = policy
+        self.eject_time = eject_time
+        self.lock = threading.Lock()
+        self.pool = pool
+        self.coalesce = coalesce
+        self.addr = ','.join(addrs)
+
+    def pick(self, exclude=()):
+        """Choose (and reserve) the replica for the next call."""
+        now = time.time()
+        with self.lock:
+            for replica in self.replicas:
+                if (replica.ejected and not replica.probing
+                        and replica.probe_at <= now):
+                    self._start_probe(replica)
+            candidates = [r for r in self.replicas
+                          if r not in exclude and not r.ejected]
+            if not candidates:
+                # Everything is ejected; the soonest to be probed is the
+                # least bad choice.
+                candidates = [min(
+                    [r for r in self.replicas if r not in exclude]
+                    or self.replicas,
+                    key=lambda r: r.probe_at)]
+            if self.policy == POWER_OF_TWO and len(candidates) > 2:
+                candidates = random.sample(candidates, 2)
+            if self.policy == POWER_OF_TWO:
+                replica = min(candidates, key=lambda r: r.score)
+            else:
+                replica = min(candidates,
+                              key=lambda r: (r.outstanding, r.ewma or 0.0))
+            replica.outstanding += 1
+            return replica
+
+    def _eject(self, replica):
+        replica.ejections += 1
+        replica.ejected = True
+        replica.probe_at = time.time() + (self.eject_time
+                                          * replica.eject_factor)
+        replica.eject_factor = min(MAX_EJECT_FACTOR,
+                                   replica.eject_factor * 2)
+
+    def _start_probe(self, replica):
+        replica.probing = True
+        thread = threading.Thread(target=self._probe, args=(replica,))
+        thread.daemon = True
+        thread.start()
+
+    def _probe(self, replica):
+        try:
+            Connection(replica.addr,
+                       connect_timeout=replica.client.connect_timeout,
+                       tls=self.pool.tls if self.pool else None).close()
+        except Exception:
+            healthy = False
+        else:
+            healthy = True
+        with self.lock:
+            replica.probing = False
+            if healthy:
+                replica.ejected = False
+            else:
+                self._eject(replica)
+
+    def call(self, method, params=None, deadline=None):
+        if self.coalesce is None:
+            return self._call(method, params, deadline)
+        return self.coalesce.call(
+            self.addr, method, params,
+            lambda: self._call(method, params, deadline),
+            timeout=deadline - time.time() if deadline is not None else None)
+
+    def _call(self, method, params, deadline):
+        tried = []
+        while True:
+            replica = self.pick(exclude=tried)
+            started = time.time()
+            try:
+                result = replica.client.call(method, params, deadline)
+            except Exception as e:
+                with self.lock:
+                    replica.outstanding -= 1
+                    replica.errors += 1
+                    if is_eject_error(e) and not replica.ejected:
+                        self._eject(replica)
+                tried.append(replica)
+                if is_connect_error(e) and len(tried) < len(self.replicas):
+                    continue
+                raise
+            with self.lock:
+                replica.outstanding -= 1
+                replica.record(time.time() - started)
+                if replica.eject_factor > 1 and replica.calls % 10 == 0:
+                    # Well again; forget about past ejections.
+                    replica.eject_factor = 1
+            return result
+
+    def stats(self):
+        """Return a table of per-replica statistics as text."""
+        rows = [('replica', 'calls', 'errors', 'ejected', 'avg ms',
+                 'ewma ms')]
+        for r in self.replicas:
+            rows.append((
+                r.addr, str(r.calls), str(r.errors), str(r.ejections),
+                '%.2f' % (r.total_latency / r.calls * 1000
+                          if r.calls else 0),
+                '%.2f' % ((r.ewma or 0) * 1000),
+            ))
+        widths = [max(len(row[i]) for row in rows)
+                  for i in range(len(rows[0]))]
+        return '\n'.join(
+            '  '.join(cell.ljust(w) if i == 0 else cell.rjust(w)
+                      for i, (cell, w) in enumerate(zip(row, widths)))
+            for row in rows) + '\n'
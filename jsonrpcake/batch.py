@@ -0,0 +1,483 @@
+"""Multi-call modes: ``--batch`` and ``--bench``.
+
+Both run their calls through a :class:`scheduler.Scheduler`, so they
+honour ``--rate``, ``--burst`` and ``--max-in-flight``.
+
+"""
+from __future__ import division
+import json
+import time
+import queue
+import socket
+import threading
+import multiprocessing
+from argparse import Namespace
+
+import jsonrpc_ns
+
+from .output import ParallelProcessor, write
+from .scheduler import Scheduler, Progress, PROGRESS_INTERVAL
+from .metrics import Metrics, Histogram, BENCH_BUCKETS
+from .sink import ResultSink, open_output
+from .client import (client_from_args, tls_from_args, coalesce_from_args,
+                     DeadlineExceeded)
+from .balancer import Balancer
+from .transport import ConnectionPool
+from . import ExitStatus
+
+
+def build_scheduler(args, env, total=None):
+    return Scheduler(
+        rate=args.rate,
+        burst=args.burst,
+        max_in_flight=args.max_in_flight,
+        backoff=args.backoff,
+        progress=Progress(env, total=total),
+        deadline=time.time() + args.deadline if args.deadline else None,
+    )
+
+
+def failure_status(exc):
+    """Return the exit status for a call that raised `exc`."""
+    if isinstance(exc, (socket.timeout, DeadlineExceeded)):
+        return ExitStatus.ERROR_TIMEOUT
+    return ExitStatus.ERROR
+
+
+def check_deadline(scheduler, error):
+    """Report calls skipped because of the deadline; return exit status.
+
+    """
+    if scheduler.skipped:
+        error('--deadline reached; the remaining calls were skipped',
+              level='warning')
+        return ExitStatus.ERROR_TIMEOUT
+    return ExitStatus.OK
+
+
+def read_batch(args):
+    """Yield the params of every call listed in ``args.batch``.
+
+    Each non-empty line is a JSON value. Request items given on the
+    command line are used as defaults for object params.
+
+    """
+    for lineno, line in enumerate(args.batch, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            params = json.loads(line)
+        except ValueError as e:
+            raise ValueError('%s:%d: %s' % (args.batch.name, lineno, e))
+        if args.data and isinstance(params, dict):
+            merged = type(args.data)(args.data)
+            merged.update(params)
+            params = merged
+        yield params
+
+
+def build_client(args):
+    """Return a client whose pool can keep a connection per call in flight.
+
+    When ``args.addr`` lists several replicas, the client is a
+    :class:`balancer.Balancer` spreading the calls across them.
+
+    """
+    pool = ConnectionPool(max_idle=args.max_in_flight,
+                          tls=tls_from_args(args))
+    coalesce = coalesce_from_args(args)
+    addrs = args.addr.split(',')
+    if len(addrs) > 1:
+        return Balancer(addrs, policy=args.balance,
+                        eject_time=args.eject_time, pool=pool,
+                        coalesce=coalesce,
+                        connect_timeout=args.connect_timeout,
+                        read_timeout=args.read_timeout,
+                        metrics=args.metrics,
+                        history=args.history)
+    return client_from_args(args, pool=pool, coalesce=coalesce)
+
+
+def finish_client(client, env):
+    """Close the client's connections and report per-replica and
+    coalescing stats.
+
+    """
+    client.pool.close()
+    if isinstance(client, Balancer):
+        env.stderr.write(client.stats())
+    if client.coalesce is not None:
+        env.stderr.write(client.coalesce.stats())
+
+
+def call(client, args, params, deadline=None):
+    """Make one call and return its result.
+
+    JSON-RPC error responses are still raised, with the error object
+    attached as ``response``.
+
+    """
+    try:
+        return client.call(args.method, params, deadline)
+    except jsonrpc_ns.JSONRPCResponseError as e:
+        e.response = e.value
+        raise
+
+
+def run_batch(args, env, error):
+    """Call ``args.method`` once for every line of ``args.batch`` and
+    stream the responses through a :class:`sink.ResultSink`.
+
+    """
+    exit_status = ExitStatus.OK
+    scheduler = build_scheduler(args, env)
+    processor = ParallelProcessor(
+        env=env, groups=args.prettify, pygments_style=args.style,
+        workers=args.format_workers)
+    sink = ResultSink(open_output(args, env),
+                      flush=env.stdout_isatty,
+                      ordered=args.ordered,
+                      window=args.reorder_window,
+                      processor=processor)
+
+    client = build_client(args)
+
+    def batch_call(job):
+        return call(client, args, job[1], scheduler.deadline)
+
+    try:
+        for (index, _), result, exc in scheduler.map(
+                batch_call, sink.gate(read_batch(args))):
+            if exc is None:
+                sink.add(index, result=result)
+            elif hasattr(exc, 'response'):
+                sink.add(index, error=exc.response)
+                if args.check_status:
+                    exit_status = ExitStatus.ERROR
+            else:
+                sink.skip(index)
+                error('call %d: %s: %s', index, type(exc).__name__, str(exc))
+                exit_status = max(exit_status, failure_status(exc))
+    finally:
+        sink.close()
+        finish_client(client, env)
+
+    return max(exit_status, check_deadline(scheduler, error))
+
+
+class BenchStats(object):
+    """The counters and latency histogram of ``--bench`` calls.
+
+    Stats of the calls made in several worker processes are combined
+    with :meth:`merge`.
+
+    """
+
+    def __init__(self):
+        self.latency = Histogram(BENCH_BUCKETS)
+        self.errors = {}
+        self.connects = 0
+        self.connect_time = 0.0
+        self.resumed = 0
+        # Calls of --coalesce methods, and how many of them waited for an
+        # identical one instead of being made.
+        self.coalesce_calls = 0
+        self.coalesced = 0
+        self.skipped = False
+        self.exit_status = ExitStatus.OK
+        # Per-replica statistics when calls are spread across replicas.
+        self.replicas = None
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        for name, count in other.errors.items():
+            self.errors[name] = self.errors.get(name, 0) + count
+        self.connects += other.connects
+        self.connect_time += other.connect_time
+        self.resumed += other.resumed
+        self.coalesce_calls += other.coalesce_calls
+        self.coalesced += other.coalesced
+        self.skipped = self.skipped or other.skipped
+        self.exit_status = max(self.exit_status, other.exit_status)
+
+    def report(self, elapsed):
+        """Return the summary of calls that took `elapsed` seconds."""
+        calls = self.latency.count
+        lines = [
+            'calls:       %d' % calls,
+            'errors:      %d' % sum(self.errors.values()),
+            'elapsed:     %.3f s' % elapsed,
+            'throughput:  %.1f calls/s' % (calls / elapsed
+                                           if elapsed else 0.0),
+        ]
+        for p in (50, 90, 99):
+            lines.append('latency p%d: %.2f ms'
+                         % (p, self.latency.quantile(p / 100) * 1000))
+        lines.append('connects:    %d (avg %.2f ms)' % (
+            self.connects,
+            self.connect_time / self.connects * 1000
+            if self.connects else 0.0))
+        if self.resumed:
+            lines.append('tls resumed: %d' % self.resumed)
+        if self.coalesce_calls:
+            lines.append('coalesced:   %d of %d' % (self.coalesced,
+                                                    self.coalesce_calls))
+        for name, count in sorted(self.errors.items()):
+            lines.append('  %s: %d' % (name, count))
+        return '\n'.join(lines) + '\n'
+
+
+def bench(args, scheduler, calls):
+    """Call ``args.method`` `calls` times through `scheduler`; return
+    :class:`BenchStats`.
+
+    """
+    stats = BenchStats()
+    client = build_client(args)
+    # Calls are timed in the scheduler's worker threads.
+    lock = threading.Lock()
+
+    def timed_call(_):
+        start = time.time()
+        try:
+            call(client, args, args.data, scheduler.deadline)
+        finally:
+            latency = time.time() - start
+            with lock:
+                stats.latency.observe(latency)
+
+    try:
+        for _, _, exc in scheduler.map(timed_call, range(calls)):
+            if exc is None:
+                continue
+            if hasattr(exc, 'response'):
+                name = 'JSONRPC %s' % exc.response.get('code')
+                if args.check_status:
+                    stats.exit_status = ExitStatus.ERROR
+            else:
+                name = type(exc).__name__
+                stats.exit_status = max(stats.exit_status,
+                                        failure_status(exc))
+            stats.errors[name] = stats.errors.get(name, 0) + 1
+    finally:
+        client.pool.close()
+    stats.connects = client.pool.connects
+    stats.connect_time = client.pool.connect_time
+    stats.resumed = client.pool.resumed
+    if client.coalesce is not None:
+        stats.coalesce_calls = client.coalesce.calls
+        stats.coalesced = client.coalesce.coalesced
+    stats.skipped = scheduler.skipped
+    if isinstance(client, Balancer):
+        stats.replicas = client.stats()
+    return stats
+
+
+def run_bench(args, env, error):
+    """Call ``args.method`` ``args.bench`` times and write a throughput and
+    latency summary.
+
+    With ``--bench-workers N``, the calls are shared out between `N`
+    worker processes (see :func:`run_bench_workers`).
+
+    """
+    if args.bench_workers > 1 and args.bench > 1:
+        return run_bench_workers(args, env, error)
+    scheduler = build_scheduler(args, env, total=args.bench)
+    started = time.time()
+    stats = bench(args, scheduler, args.bench)
+    elapsed = time.time() - started
+    if stats.replicas:
+        env.stderr.write(stats.replicas)
+    return write_bench_report(stats, elapsed, env, error)
+
+
+def write_bench_report(stats, elapsed, env, error):
+    write(stream=[stats.report(elapsed).encode('utf8')],
+          outfile=env.stdout, flush=env.stdout_isatty)
+    if stats.skipped:
+        error('--deadline reached; the remaining calls were skipped',
+              level='warning')
+        return max(stats.exit_status, ExitStatus.ERROR_TIMEOUT)
+    return stats.exit_status
+
+
+# Messages from bench workers to the parent process.
+PROGRESS, DONE, FAILED = 'progress', 'done', 'failed'
+
+# How long (in seconds) a bench worker that is done may take to exit
+# before it is terminated.
+WORKER_EXIT_TIMEOUT = 5
+
+
+class WorkerProgress(Progress):
+    """Sends the progress of a bench worker to the parent process every
+    ``PROGRESS_INTERVAL`` seconds, instead of drawing it.
+
+    """
+
+    def __init__(self, messages, worker):
+        super(WorkerProgress, self).__init__(env=None)
+        self.messages = messages
+        self.worker = worker
+
+    def update(self, force=False):
+        now = time.time()
+        if force or now - self.drawn >= PROGRESS_INTERVAL:
+            self.drawn = now
+            self.messages.put((PROGRESS, self.worker, (
+                self.done, self.errors, self.in_flight, self.factor)))
+
+    def finish(self):
+        self.update(force=True)
+
+
+def share(total, parts):
+    """Split `total` into `parts` nearly equal integers."""
+    return [total // parts + (i < total % parts) for i in range(parts)]
+
+
+def bench_worker(args, worker, calls, deadline, record_metrics, messages):
+    """Run the share of `calls` of one worker process and put its
+    :class:`BenchStats` (and its metrics, if any) on `messages`.
+
+    """
+    try:
+        args.metrics = Metrics() if record_metrics else None
+        scheduler = Scheduler(
+            rate=args.rate,
+            burst=args.burst,
+            max_in_flight=args.max_in_flight,
+            backoff=args.backoff,
+            progress=WorkerProgress(messages, worker),
+            deadline=deadline,
+        )
+        stats = bench(args, scheduler, calls)
+        metrics = args.metrics.snapshot() if record_metrics else None
+        messages.put((DONE, worker, (stats, metrics)))
+    except KeyboardInterrupt:
+        messages.put((FAILED, worker, 'interrupted'))
+    except Exception as e:
+        messages.put((FAILED, worker, '%s: %s' % (type(e).__name__, e)))
+
+
+def worker_args(args, workers, index):
+    """Return a picklable copy of `args` for bench worker `index`, with
+    its share of ``--rate`` and ``--burst``.
+
+    """
+    copy = Namespace(**vars(args))
+    # Open files and locks can't be sent to another process.
+    copy.output_file = copy.batch = copy.diff_against = None
+    copy.metrics = copy.history = None
+    if args.rate:
+        copy.rate = args.rate / workers
+    if args.burst:
+        copy.burst = max(1, share(args.burst, workers)[index])
+    return copy
+
+
+def run_bench_workers(args, env, error):
+    """Share the ``--bench`` calls out between ``--bench-workers``
+    processes, each with its own connections, and write one summary of
+    all of them.
+
+    Workers report their progress as they go, and their counters and
+    latency histograms when they are done; the parent merges them.
+
+    The workers are spawned rather than forked, since the metrics writer
+    thread may be running (and holding a lock) meanwhile.
+
+    """
+    workers = min(args.bench_workers, args.bench)
+    context = multiprocessing.get_context('spawn')
+    messages = context.Queue()
+    deadline = time.time() + args.deadline if args.deadline else None
+    processes = [
+        context.Process(
+            target=bench_worker,
+            args=(worker_args(args, workers, i), i, calls, deadline,
+                  args.metrics is not None, messages))
+        for i, calls in enumerate(share(args.bench, workers))
+    ]
+    progress = Progress(env, total=args.bench)
+    reported = [(0, 0, 0, 1.0)] * workers
+    stats = BenchStats()
+    running = set(range(workers))
+    # Workers already reported as failed.
+    failed = set()
+    exit_status = ExitStatus.OK
+
+    def handle(message, worker, value):
+        if message == PROGRESS:
+            reported[worker] = value
+            done, errors, in_flight, factors = zip(*reported)
+            progress.done = sum(done)
+            progress.errors = sum(errors)
+            progress.in_flight = sum(in_flight)
+            progress.factor = min(factors)
+            progress.update()
+            return ExitStatus.OK
+        running.discard(worker)
+        if message == FAILED:
+            failed.add(worker)
+            error('bench worker %d: %s', worker, value)
+            return ExitStatus.ERROR
+        worker_stats, metrics = value
+        stats.merge(worker_stats)
+        if metrics:
+            args.metrics.merge(metrics)
+        if worker_stats.replicas:
+            env.stderr.write('worker %d:\n%s'
+                             % (worker, worker_stats.replicas))
+        return ExitStatus.OK
+
+    started = time.time()
+    for process in processes:
+        process.daemon = True
+        process.start()
+    try:
+        while running:
+            try:
+                exit_status = max(exit_status, handle(*messages.get(
+                    timeout=PROGRESS_INTERVAL)))
+                continue
+            except queue.Empty:
+                pass
+            exited = [i for i in running
+                      if processes[i].exitcode is not None]
+            if not exited:
+                continue
+            # What they sent before exiting may still be on its way.
+            while True:
+                try:
+                    exit_status = max(exit_status, handle(*messages.get(
+                        timeout=PROGRESS_INTERVAL)))
+                except queue.Empty:
+                    break
+            for i in exited:
+                if i in running:
+                    running.discard(i)
+                    failed.add(i)
+                    error('bench worker %d exited with status %d without '
+                          'reporting', i, processes[i].exitcode)
+                    exit_status = ExitStatus.ERROR
+        elapsed = time.time() - started
+        progress.finish()
+    finally:
+        for i, process in enumerate(processes):
+            if i not in running:
+                # Done; give it time to exit on its own.
+                process.join(WORKER_EXIT_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+                failed.add(i)
+            process.join()
+
+    for i, process in enumerate(processes):
+        if process.exitcode and i not in failed:
+            error('bench worker %d exited with status %d',
+                  i, process.exitcode)
+            exit_status = ExitStatus.ERROR
+    return max(exit_status, write_bench_report(stats, elapsed, env, error))
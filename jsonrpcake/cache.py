@@ -0,0 +1,67 @@
+"""A small on-disk cache for data worth keeping across invocations.
+
+The cache is best effort: values are JSON, writes are atomic, and any
+problem reading or writing it is treated as a miss.
+
+"""
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+
+class FileCache(object):
+    """JSON values stored under ``DIRECTORY/NAMESPACE/``, one file per key.
+
+    Entries older than `ttl` seconds (if given) are treated as missing.
+    A `directory` of `None` disables the cache.
+
+    """
+
+    def __init__(self, directory, namespace, ttl=None):
+        self.path = (os.path.join(directory, namespace)
+                     if directory else None)
+        self.ttl = ttl
+
+    def _filename(self, key):
+        digest = hashlib.sha1(key.encode('utf8')).hexdigest()
+        return os.path.join(self.path, digest + '.json')
+
+    def get(self, key, default=None):
+        if not self.path:
+            return default
+        filename = self._filename(key)
+        try:
+            if self.ttl is not None and (
+                    time.time() - os.path.getmtime(filename) > self.ttl):
+                return default
+            with open(filename) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return default
+        # Guard against (very unlikely) digest collisions.
+        if not isinstance(entry, dict) or entry.get('key') != key:
+            return default
+        return entry.get('value', default)
+
+    def set(self, key, value):
+        if not self.path:
+            return
+        try:
+            if not os.path.isdir(self.path):
+                os.makedirs(self.path)
+            fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump({'key': key, 'value': value}, f)
+            os.replace(tmp, self._filename(key))
+        except (IOError, OSError):
+            pass
+
+    def delete(self, key):
+        if not self.path:
+            return
+        try:
+            os.remove(self._filename(key))
+        except (IOError, OSError):
+            pass
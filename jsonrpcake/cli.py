@@ -7,12 +7,14 @@ from . import __doc__
 from textwrap import dedent, wrap
 #noinspection PyCompatibility
 from argparse import (RawDescriptionHelpFormatter, FileType,
-                      ZERO_OR_MORE, SUPPRESS)
+                      OPTIONAL, ZERO_OR_MORE, SUPPRESS)
 
 from . import __version__
 from .output import AVAILABLE_STYLES, DEFAULT_STYLE
-from .input import (Parser, KeyValueArgType,
-                    SEP_GROUP_ALL_ITEMS,
+from .balancer import POLICIES, LEAST_OUTSTANDING
+from .metrics import FORMATS as METRICS_FORMATS
+from .input import (Parser, KeyValueArgType, RateArgType, SizeArgType,
+                    SEP_GROUP_ALL_ITEMS, OUTPUT_FORMATS,
                     PRETTY_MAP, PRETTY_STDOUT_TTY_ONLY)
 
 
@@ -59,17 +61,22 @@ positional = parser.add_argument_group(
 positional.add_argument(
     'addr',
     metavar='ADDR',
+    nargs=OPTIONAL,
     help="""
     You can also use a shorthand for localhost
 
         $ jsonrpc :3000 METHOD     # => jsonrpc localhost:3000 METHOD
 
+    With --batch and --bench, ADDR can be a comma-separated list of
+    replicas to spread the calls across (see --balance).
+
     """
 )
 
 positional.add_argument(
     'method',
     metavar='METHOD',
+    nargs=OPTIONAL,
     default=None,
     help="The JSONRPC method to be used for the request."
 )
@@ -100,6 +107,10 @@ positional.add_argument(
 
         field-name-with\:colon=value
 
+    Many items can be read from a file with @FILE, one item per line:
+
+        @items.txt
+
     """
 )
 
@@ -122,6 +133,18 @@ output_processing.add_argument(
 
     """
 )
+output_processing.add_argument(
+    '--output-format',
+    choices=sorted(OUTPUT_FORMATS.keys()),
+    help="""
+    How the response is serialized, regardless of --pretty: "pretty"
+    (indented, keys sorted), "compact" (no whitespace, keys in the order
+    the server sent them), or "ndjson" (compact, one response per line).
+    Colors are still applied if --pretty says so. --batch output is always
+    one record per line and defaults to "ndjson".
+
+    """
+)
 output_processing.add_argument(
     '--style', '-s',
     dest='style',
@@ -148,6 +171,18 @@ output_processing.add_argument(
     )
 )
 
+output_processing.add_argument(
+    '--format-workers',
+    type=int,
+    metavar='N',
+    help="""
+    With --batch, move output processing to N worker processes once the
+    output grows large. Off by default; it only pays off for colorized
+    output on several CPUs.
+
+    """
+)
+
 
 #######################################################################
 # Output options
@@ -171,12 +206,55 @@ output_options.add_argument(
     dest='output_file',
     metavar='FILE',
     help="""
-    Save output to FILE. If --download is set, then only the response body is
-    saved to the file. Other parts of the HTTP exchange are printed to stderr.
+    Save output to FILE instead of writing it to stdout.
 
     """
 
 )
+output_options.add_argument(
+    '--no-pager',
+    dest='pager',
+    default=True,
+    action='store_false',
+    help="""
+    By default, a formatted response that doesn't fit on the terminal is
+    shown in a built-in pager, which only formats the lines on screen.
+    This flag writes it out in full instead.
+
+    """
+)
+output_options.add_argument(
+    '--rotate-size',
+    type=SizeArgType(),
+    metavar='SIZE',
+    help="""
+    With --output and --batch, move on to FILE.1, FILE.2, etc. whenever
+    the current file would grow beyond SIZE (e.g., 512M or 1G).
+
+    """
+)
+output_options.add_argument(
+    '--ordered',
+    default=False,
+    action='store_true',
+    help="""
+    With --batch, write the results in the order of the input lines rather
+    than as they arrive. Calls are only allowed to run ahead of the oldest
+    unfinished one by --reorder-window lines.
+
+    """
+)
+output_options.add_argument(
+    '--reorder-window',
+    type=int,
+    default=1000,
+    metavar='N',
+    help="""
+    The maximum number of out-of-order results held in memory for
+    --ordered. The default is 1000.
+
+    """
+)
 
 
 #######################################################################
@@ -188,11 +266,58 @@ network = parser.add_argument_group(title='Network')
 network.add_argument(
     '--timeout',
     type=float,
-    default=4,
     metavar='SECONDS',
     help="""
-    The connection timeout of the request in seconds. The default value is
-    4 seconds.
+    The default for both --connect-timeout and --read-timeout. Without it,
+    --connect-timeout is 4 seconds and --read-timeout is learned from the
+    latencies of earlier calls of METHOD on ADDR (4 seconds until enough
+    calls have been seen). When a call times out, JSONRPCake exits with 2.
+
+    """
+)
+network.add_argument(
+    '--connect-timeout',
+    type=float,
+    metavar='SECONDS',
+    help="""
+    How long to wait for a connection to the server to be established.
+
+    """
+)
+network.add_argument(
+    '--read-timeout',
+    type=float,
+    metavar='SECONDS',
+    help="""
+    How long to wait for the server to accept the request and to respond.
+
+    """
+)
+network.add_argument(
+    '--verify',
+    default='yes',
+    metavar='VERIFY',
+    help="""
+    For tls://HOST:PORT addresses: set to "no" to skip checking the
+    server's certificate, or to the path of a CA bundle to check it
+    against instead of the system's CA certificates. The default is "yes".
+
+    """
+)
+network.add_argument(
+    '--cert',
+    metavar='FILE',
+    help="""
+    The client certificate for tls:// addresses, a PEM file that may also
+    contain the private key.
+
+    """
+)
+network.add_argument(
+    '--cert-key',
+    metavar='FILE',
+    help="""
+    The private key of --cert, if it isn't in the same file.
 
     """
 )
@@ -208,6 +333,278 @@ network.add_argument(
 )
 
 
+#######################################################################
+# Multi-call modes
+#######################################################################
+
+multi_call = parser.add_argument_group(
+    title='Multi-call modes',
+    description=dedent("""
+    Make many calls in one invocation. Calls are throttled by --rate,
+    --burst, and --max-in-flight.
+
+    """)
+)
+
+multi_call_modes = multi_call.add_mutually_exclusive_group()
+multi_call_modes.add_argument(
+    '--batch',
+    type=FileType('r'),
+    metavar='FILE',
+    help="""
+    Call METHOD once for every line of FILE ("-" for stdin). Each line is
+    a JSON value used as the params. REQUEST_ITEMs act as defaults for
+    object params. Responses are written as NDJSON records,
+    {"id": LINE, "result": ...} or {"id": LINE, "error": ...}, where LINE
+    counts the calls from 0.
+
+    """
+)
+multi_call_modes.add_argument(
+    '--bench',
+    type=int,
+    metavar='N',
+    help="""
+    Call METHOD N times with the same params and print a throughput and
+    latency summary instead of the responses.
+
+    """
+)
+multi_call_modes.add_argument(
+    '--watch',
+    type=float,
+    metavar='INTERVAL',
+    help="""
+    Call METHOD every INTERVAL seconds over one connection. The first
+    response is printed in full, after that only the paths that changed.
+
+    """
+)
+multi_call_modes.add_argument(
+    '--follow',
+    action='store_true',
+    default=False,
+    help="""
+    Call METHOD (e.g., a subscribe method) and keep the connection open,
+    writing every message the server pushes on it as it arrives, one per
+    line with --output-format ndjson. Connects and calls METHOD again when
+    the connection is lost. The message rate is shown on stderr.
+
+    """
+)
+multi_call_modes.add_argument(
+    '--diff',
+    metavar='ADDR2',
+    help="""
+    Call METHOD on both ADDR and ADDR2 at the same time and print the
+    differences between the two responses, one changed path per line.
+    Exits with 1 if the responses differ.
+
+    """
+)
+multi_call_modes.add_argument(
+    '--diff-against',
+    type=FileType('r'),
+    metavar='FILE',
+    help="""
+    Like --diff, but compare the response from ADDR against the one saved
+    in FILE (e.g., with --output).
+
+    """
+)
+multi_call.add_argument(
+    '--bench-workers',
+    type=int,
+    default=1,
+    metavar='N',
+    help="""
+    With --bench, share the calls out between N worker processes, each
+    with its own connections and --max-in-flight, so that the benchmark
+    isn't limited to one CPU. --rate and --burst are divided between them.
+
+    """
+)
+multi_call.add_argument(
+    '--rate',
+    type=RateArgType(),
+    metavar='N/s',
+    help="""
+    Do not make more than N calls per second (also accepts N/m and N/h).
+    Unlimited by default.
+
+    """
+)
+multi_call.add_argument(
+    '--burst',
+    type=int,
+    metavar='N',
+    help="""
+    How many calls may be made at once when under the --rate. Defaults to
+    the rate per second.
+
+    """
+)
+multi_call.add_argument(
+    '--max-in-flight',
+    type=int,
+    default=1,
+    metavar='N',
+    help="""
+    The maximum number of calls waiting for a response at any one time.
+    The default is 1.
+
+    """
+)
+multi_call.add_argument(
+    '--deadline',
+    type=float,
+    metavar='SECONDS',
+    help="""
+    Finish within SECONDS. Calls that aren't expected to finish in the time
+    left are skipped, and calls in flight are cut short at the deadline.
+    Exits with 2 if the deadline cut anything short.
+
+    """
+)
+multi_call.add_argument(
+    '--balance',
+    default=LEAST_OUTSTANDING,
+    choices=POLICIES,
+    help="""
+    How calls are spread across the replicas in ADDR: "least-outstanding"
+    (default) sends each call to the replica with the fewest calls in
+    flight, "p2c" picks the better of two random replicas by their
+    average latency and calls in flight.
+
+    """
+)
+multi_call.add_argument(
+    '--eject-time',
+    type=float,
+    default=10,
+    metavar='SECONDS',
+    help="""
+    How long a replica that timed out or refused a connection is left out
+    before it is probed again. The default is 10 seconds.
+
+    """
+)
+multi_call.add_argument(
+    '--coalesce',
+    metavar='METHOD,...',
+    help="""
+    Calls of these methods (names or shell-style patterns, e.g., "get_*")
+    that are identical to one in flight, params and all, wait for its
+    result instead of being made again. Only list read-only, idempotent
+    methods. The number of calls coalesced is reported at the end.
+
+    """
+)
+multi_call.add_argument(
+    '--no-backoff',
+    dest='backoff',
+    default=True,
+    action='store_false',
+    help="""
+    By default, calls are slowed down when the server starts timing out or
+    responding with server errors (-32603 and -32000 to -32099), and sped up
+    again as it recovers. This flag keeps the rate constant.
+
+    """
+)
+
+
+#######################################################################
+# Metrics
+#######################################################################
+
+metrics = parser.add_argument_group(
+    title='Metrics',
+    description=dedent("""
+    Record call counts, error codes, timeouts, bytes sent and received, and
+    latency histograms per method and host.
+
+    """)
+)
+
+metrics.add_argument(
+    '--metrics',
+    dest='metrics_file',
+    metavar='FILE',
+    help="""
+    Write the metrics to FILE when JSONRPCake exits. The file is replaced
+    atomically, so it can be read by the Prometheus node exporter's
+    textfile collector.
+
+    """
+)
+metrics.add_argument(
+    '--metrics-format',
+    choices=METRICS_FORMATS,
+    help="""
+    "prometheus" for the Prometheus text format, or "json" for a summary
+    with latency percentiles. The default is "json" if FILE ends with
+    .json, otherwise "prometheus".
+
+    """
+)
+metrics.add_argument(
+    '--metrics-interval',
+    type=float,
+    metavar='SECONDS',
+    help="""
+    Also write the metrics every SECONDS while the calls are running.
+
+    """
+)
+
+
+#######################################################################
+# Saved responses
+#######################################################################
+
+saved_responses = parser.add_argument_group(
+    title='Saved responses',
+    description=dedent("""
+    Query a response saved with --output without parsing all of it. The
+    first query indexes the file; the index is cached, so later ones only
+    read the parts of the file they need. ADDR and METHOD aren't given.
+
+    """)
+)
+
+saved_responses.add_argument(
+    '--open',
+    metavar='FILE',
+    help="""
+    Write the saved response in FILE, or the part of it at --path, as
+    if it had just been received.
+
+        $ jsonrpc --open users.json --path '$.users[1000].name'
+
+    """
+)
+saved_responses.add_argument(
+    '--path',
+    metavar='PATH',
+    help="""
+    With --open, the path of the value to write, e.g. $.users[3].name
+    (the whole response by default).
+
+    """
+)
+saved_responses.add_argument(
+    '--summary',
+    default=False,
+    action='store_true',
+    help="""
+    With --open, describe the value at --path and its members (type,
+    number of members, and size) instead of writing it.
+
+    """
+)
+
+
 #######################################################################
 # Troubleshooting
 #######################################################################
@@ -250,6 +647,36 @@ troubleshooting.add_argument(
 
     """
 )
+troubleshooting.add_argument(
+    '--profile',
+    action='store_true',
+    default=False,
+    help="""
+    Profile the whole invocation and print a summary of where the time went
+    to stderr: by phase (parse, network, decode, format, write), and by
+    function.
+
+    """
+)
+troubleshooting.add_argument(
+    '--profile-output',
+    metavar='FILE',
+    help="""
+    With --profile, also save the profile to FILE, in the speedscope format
+    if FILE ends with .json, otherwise as pstats data (e.g., for snakeviz).
+
+    """
+)
+troubleshooting.add_argument(
+    '--profile-memory',
+    action='store_true',
+    default=False,
+    help="""
+    With --profile, also trace memory allocations and report the peak memory
+    use. This slows JSONRPCake down considerably.
+
+    """
+)
 troubleshooting.add_argument(
     '--debug',
     action='store_true',
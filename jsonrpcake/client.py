@@ -0,0 +1,245 @@
+"""The Python API.
+
+    >>> from jsonrpcake import Client
+    >>> client = Client('localhost:3000')
+    >>> client.call('update', {'name': 'John', 'uid': 1234})
+
+Connections are pooled and reused across calls (and across clients
+sharing a pool). Results are returned decoded; nothing is formatted
+unless :meth:`Client.format` is used.
+
+"""
+import time
+import socket
+import asyncio
+from functools import partial
+
+import jsonrpc_ns
+
+from .transport import ConnectionPool, DeadlineExceeded, unwrap
+from .tls import TLSConfig
+from .coalesce import SingleFlight
+
+
+# The default timeout for calls, in seconds.
+DEFAULT_TIMEOUT = 4
+
+# The method name `Client.batch` calls are recorded under in metrics.
+BATCH_METHOD = '(batch)'
+
+default_pool = ConnectionPool()
+
+
+def tls_from_args(args):
+    """Return the :class:`tls.TLSConfig` for the TLS options given on the
+    command line, or `None` if they are the defaults.
+
+    """
+    if args.verify is True and not args.cert:
+        return None
+    return TLSConfig(verify=args.verify, cert=args.cert,
+                     cert_key=args.cert_key)
+
+
+def coalesce_from_args(args):
+    """Return the :class:`coalesce.SingleFlight` for ``--coalesce``, or
+    `None` if it wasn't given.
+
+    """
+    if not args.coalesce:
+        return None
+    return SingleFlight(args.coalesce)
+
+
+def client_from_args(args, addr=None, pool=None, coalesce=None):
+    """Return a :class:`Client` for `addr` (``args.addr`` by default)
+    with the timeouts and TLS options given on the command line.
+
+    """
+    if pool is None:
+        tls = tls_from_args(args)
+        if tls is not None:
+            pool = ConnectionPool(tls=tls)
+    return Client(addr or args.addr, pool=pool,
+                  connect_timeout=args.connect_timeout,
+                  read_timeout=args.read_timeout,
+                  metrics=args.metrics,
+                  coalesce=coalesce,
+                  history=args.history)
+
+
+class Client(object):
+    """A JSON-RPC client for the server at `addr` (``HOST:PORT``).
+
+    `timeout` is the default for both `connect_timeout` (making a new
+    connection) and `read_timeout` (waiting for the server to accept
+    the request or to respond).
+
+    Calls are recorded in `metrics`, a :class:`metrics.Metrics`, if
+    given, and their latencies in `history`, a
+    :class:`timeouts.LatencyHistory`. With `coalesce`, a
+    :class:`coalesce.SingleFlight`, calls identical to one already in
+    flight wait for its result instead.
+
+    """
+
+    def __init__(self, addr, timeout=DEFAULT_TIMEOUT, pool=None,
+                 connect_timeout=None, read_timeout=None, metrics=None,
+                 coalesce=None, history=None):
+        self.addr = addr
+        self.connect_timeout = (connect_timeout if connect_timeout
+                                is not None else timeout)
+        self.read_timeout = (read_timeout if read_timeout
+                             is not None else timeout)
+        self.pool = pool if pool is not None else default_pool
+        self.metrics = metrics
+        self.coalesce = coalesce
+        self.history = history
+
+    def _run(self, func, deadline=None):
+        """Run ``func(conn)`` on a pooled connection, giving up at the
+        `deadline` (a :func:`time.time` value) if given.
+
+        """
+        connect_timeout = self.connect_timeout
+        read_timeout = self.read_timeout
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise DeadlineExceeded('deadline passed before the call')
+            if connect_timeout is None or remaining < connect_timeout:
+                connect_timeout = remaining
+            if read_timeout is None or remaining < read_timeout:
+                read_timeout = remaining
+        try:
+            return self.pool.run(self.addr, func,
+                                 connect_timeout=connect_timeout,
+                                 read_timeout=read_timeout)
+        except socket.timeout:
+            if deadline is not None and time.time() >= deadline:
+                raise DeadlineExceeded('deadline passed during the call')
+            raise
+
+    def _measure(self, method, func, deadline=None, check=None):
+        """Return ``check(self._run(func, deadline))``, recording the
+        call as `method` in ``self.metrics`` and ``self.history`` if set.
+
+        """
+        if self.metrics is None and self.history is None:
+            response = self._run(func, deadline)
+            return check(response) if check else response
+
+        io = [0, 0]
+
+        def counted(conn):
+            sent, received = conn.bytes_sent, conn.bytes_received
+            try:
+                return func(conn)
+            finally:
+                io[0] += conn.bytes_sent - sent
+                io[1] += conn.bytes_received - received
+
+        started = time.time()
+        error = None
+        try:
+            response = self._run(counted, deadline)
+            return check(response) if check else response
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            latency = time.time() - started
+            if self.metrics is not None:
+                self.metrics.record(method, self.addr, latency, error, *io)
+            if self.history is not None:
+                self.history.observe(self.addr, method, latency, error)
+
+    def call(self, method, params=None, deadline=None):
+        """Call `method` and return its result.
+
+        Raise :class:`jsonrpc_ns.JSONRPCResponseError` if the server
+        responds with an error, and :class:`DeadlineExceeded` if the
+        result isn't in by the `deadline` (a :func:`time.time` value).
+
+        """
+        def call():
+            return self._measure(
+                method, lambda conn: conn.request(method, params), deadline,
+                check=unwrap)
+
+        if self.coalesce is None:
+            return call()
+        return self.coalesce.call(
+            self.addr, method, params, call,
+            timeout=deadline - time.time() if deadline is not None else None)
+
+    def batch(self, calls, deadline=None):
+        """Make all `calls` (``(method, params)`` pairs) over one connection
+        without waiting for each response before sending the next request.
+
+        Return their results in the same order. Error responses are
+        returned, not raised, as :class:`jsonrpc_ns.JSONRPCResponseError`
+        instances.
+
+        """
+        calls = list(calls)
+        responses = self._measure(
+            BATCH_METHOD, lambda conn: conn.pipeline(calls), deadline)
+        results = []
+        for (method, _), response in zip(calls, responses):
+            try:
+                results.append(unwrap(response))
+            except jsonrpc_ns.JSONRPCResponseError as e:
+                results.append(e)
+                if self.metrics is not None:
+                    self.metrics.record_error(method, self.addr, e)
+        return results
+
+    def stream(self, method, params=None, write=None, deadline=None):
+        """Call `method` and pass the JSON text of its result (as `bytes`,
+        without whitespace between tokens) to `write` in chunks as it is
+        received, rather than decoding it.
+
+        The result is never held in memory as a whole. Errors are raised
+        as with :meth:`call`.
+
+        """
+        self._measure(
+            method,
+            lambda conn: conn.request_stream(method, params, write),
+            deadline, check=unwrap)
+
+    def notify(self, method, params=None):
+        """Send a notification; no response is expected."""
+        self._measure(method, lambda conn: conn.notify(method, params))
+
+    def format(self, value, groups=('format', 'colors'), style=None):
+        """Return `value` as text formatted by an
+        :class:`output.OutputProcessor` with the given `groups`.
+
+        """
+        # Not imported at the top so that Pygments is only loaded
+        # when output is actually formatted.
+        from .output import get_output_processor, DEFAULT_STYLE
+        processor = get_output_processor(
+            groups=groups, pygments_style=style or DEFAULT_STYLE)
+        return processor.process_response(value)
+
+    def close(self):
+        """Close the idle pooled connections to ``self.addr``."""
+        self.pool.discard(self.addr)
+
+    # Async variants, run in the event loop's default executor.
+
+    async def acall(self, method, params=None, deadline=None):
+        return await self._run_async(self.call, method, params, deadline)
+
+    async def abatch(self, calls, deadline=None):
+        return await self._run_async(self.batch, list(calls), deadline)
+
+    async def anotify(self, method, params=None):
+        return await self._run_async(self.notify, method, params)
+
+    def _run_async(self, func, *args):
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(None, partial(func, *args))
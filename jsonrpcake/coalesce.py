@@ -0,0 +1,103 @@
+"""Single-flight coalescing of identical calls.
+
+While a call is in flight, identical calls (the same address, method and
+params) of the methods allowed wait for its result rather than making
+round trips of their own. Only idempotent, read-only methods should be
+allowed: the server sees one call where the callers made several.
+
+"""
+from __future__ import division
+import json
+import threading
+from fnmatch import fnmatchcase
+
+from .transport import DeadlineExceeded
+
+
+class Flight(object):
+    """A call in flight, and the callers waiting for its result."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """Coalesces identical concurrent calls of `methods` (names or
+    shell-style patterns, e.g., ``get_*``).
+
+    Callers that waited for another's call get the same result object
+    (or the same exception), so results should not be modified.
+
+    """
+
+    def __init__(self, methods):
+        self.methods = list(methods)
+        self.flights = {}
+        self.lock = threading.Lock()
+        # Calls of allowed methods, and how many of them were coalesced
+        # into another call rather than made.
+        self.calls = 0
+        self.coalesced = 0
+
+    def allows(self, method):
+        return any(fnmatchcase(method, pattern) for pattern in self.methods)
+
+    def key(self, addr, method, params):
+        """Return the key identical calls share, or `None` if `params`
+        can't be canonicalized.
+
+        """
+        try:
+            params = json.dumps(params, sort_keys=True,
+                                separators=(',', ':'))
+        except (TypeError, ValueError):
+            return None
+        return addr, method, params
+
+    def call(self, addr, method, params, func, timeout=None):
+        """Return ``func()``, or the result of an identical call already
+        in flight.
+
+        A caller that waits gives up after `timeout` seconds (if given),
+        raising :class:`transport.DeadlineExceeded`.
+
+        """
+        key = self.key(addr, method, params) if self.allows(method) else None
+        if key is None:
+            return func()
+        with self.lock:
+            self.calls += 1
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+            else:
+                flight.waiters += 1
+                self.coalesced += 1
+
+        if not leader:
+            if not flight.done.wait(timeout):
+                raise DeadlineExceeded('deadline passed during the call')
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result
+
+    def stats(self):
+        """Return a one-line summary of the calls coalesced."""
+        return 'coalesced: %d of %d calls (%.1f%%)\n' % (
+            self.coalesced, self.calls,
+            self.coalesced / self.calls * 100 if self.calls else 0.0)
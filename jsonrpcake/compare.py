@@ -0,0 +1,71 @@
+"""Diff mode: compare a method's response on two servers, or against
+a saved response.
+
+"""
+import json
+
+import jsonrpc_ns
+
+from .client import client_from_args
+from .diff import diff, format_change
+from .output import get_formatter, write
+from .scheduler import Scheduler
+from . import ExitStatus
+
+
+def fetch(args, addr):
+    """Return the response of ``args.method`` at `addr`: the result, or
+    the error object of an error response.
+
+    """
+    try:
+        return client_from_args(args, addr).call(args.method, args.data)
+    except jsonrpc_ns.JSONRPCResponseError as e:
+        return e.value
+
+
+def run_diff(args, env, error):
+    """Write the structural diff of the response at ``args.addr`` against
+    the one at ``args.diff`` or in ``args.diff_against``.
+
+    Return exit status 1 if they differ, like diff(1).
+
+    """
+    if args.diff_against:
+        old_label = args.diff_against.name
+        with args.diff_against as f:
+            old = json.load(f)
+        new = fetch(args, args.addr)
+    else:
+        old_label = args.addr
+        # Both calls are in flight at the same time. They complete in
+        # any order, and the addresses may be the same, so the responses
+        # are kept by position.
+        responses = [None, None]
+        for (i, addr), result, exc in Scheduler(max_in_flight=2).map(
+                lambda job: fetch(args, job[1]),
+                enumerate([args.addr, args.diff])):
+            if exc is not None:
+                raise exc
+            responses[i] = result
+        old, new = responses
+    new_label = args.diff or args.addr
+
+    formatter = None
+    if 'colors' in args.prettify and env.colors:
+        formatter = get_formatter(args.style, env.colors, env.cache_dir)
+
+    changes = 0
+    lines = ['--- %s' % old_label, '+++ %s' % new_label]
+    for change in diff(old, new):
+        changes += 1
+        lines.append(format_change(change, formatter).rstrip('\n'))
+        if len(lines) >= 1000:
+            write([('\n'.join(lines) + '\n').encode('utf8')],
+                  env.stdout, env.stdout_isatty)
+            lines = []
+    if changes:
+        write([('\n'.join(lines) + '\n').encode('utf8')],
+              env.stdout, env.stdout_isatty)
+        return ExitStatus.ERROR
+    return ExitStatus.OK
@@ -0,0 +1,266 @@
+"""Shell completion of options, addresses, methods and parameter names.
+
+Completion has to be instant, so the ``jsonrpc-complete`` entry point only
+reads the on-disk cache and imports neither Pygments nor the JSON-RPC
+client. Methods are fetched from the server (``rpc.discover``, or else
+``system.listMethods``) by a background process when they are missing
+from the cache, and are available from the next keystroke on.
+
+Enable it with::
+
+    $ eval "$(jsonrpc-complete --script bash)"    # or zsh
+
+"""
+import os
+import sys
+import shlex
+import subprocess
+
+from .cache import FileCache
+from .models import Environment
+from . import ExitStatus, __version__
+
+
+# How long (in seconds) the methods of a server are cached.
+METHODS_TTL = 24 * 60 * 60
+
+# How long a server that couldn't be asked for its methods (e.g., it was
+# down) isn't asked again.
+FAILED_DISCOVERY_TTL = 60
+
+# How long to wait for a background refresh before starting another one.
+REFRESH_TIMEOUT = 30
+
+# Separators of REQUEST_ITEMs; no parameter names are completed after one.
+ITEM_SEPARATORS = ('=', ':', '@')
+
+BASH_SCRIPT = r'''
+_jsonrpc() {
+    local IFS=$'\n'
+    COMPREPLY=($(COMP_LINE="$COMP_LINE" COMP_POINT="$COMP_POINT" \
+        jsonrpc-complete bash "${COMP_WORDS[COMP_CWORD]}" 2>/dev/null))
+    [[ $COMPREPLY == *= ]] && compopt -o nospace
+}
+complete -o default -F _jsonrpc jsonrpc
+'''
+
+ZSH_SCRIPT = r'''
+_jsonrpc() {
+    local -a candidates
+    candidates=(${(f)"$(jsonrpc-complete zsh "${(@)words[2,CURRENT]}" \
+        2>/dev/null)"})
+    compadd -S '' -- ${(M)candidates:#*=}
+    compadd -- ${candidates:#*=}
+    (( $#candidates )) || _files
+}
+compdef _jsonrpc jsonrpc
+'''
+
+SCRIPTS = {'bash': BASH_SCRIPT, 'zsh': ZSH_SCRIPT}
+
+
+def methods_cache(env):
+    return FileCache(env.cache_dir, 'methods', ttl=METHODS_TTL)
+
+
+def failed_discovery_cache(env):
+    return FileCache(env.cache_dir, 'methods-failed',
+                     ttl=FAILED_DISCOVERY_TTL)
+
+
+def completion_cache(env, ttl=None):
+    return FileCache(env.cache_dir, 'completion', ttl=ttl)
+
+
+def discover(client):
+    """Return ``{method: [param names]}`` for the server of `client`.
+
+    OpenRPC's ``rpc.discover`` is tried first; it describes parameters.
+    ``system.listMethods`` only lists the method names.
+
+    """
+    import jsonrpc_ns
+    try:
+        document = client.call('rpc.discover')
+        return dict(
+            (method['name'], [param['name']
+                              for param in method.get('params') or []
+                              if isinstance(param, dict) and 'name' in param])
+            for method in document['methods'])
+    except (jsonrpc_ns.JSONRPCResponseError, KeyError, TypeError):
+        pass
+    return dict((name, []) for name in client.call('system.listMethods'))
+
+
+def refresh(addr, env=Environment()):
+    """Fetch the methods of the server at `addr` into the cache.
+
+    A server that can't be asked is remembered for
+    `FAILED_DISCOVERY_TTL` seconds, so that it isn't asked again on every
+    keystroke meanwhile.
+
+    """
+    from .client import Client
+
+    client = Client(addr)
+    try:
+        methods = discover(client)
+    except Exception:
+        failed_discovery_cache(env).set(addr, True)
+        return
+    finally:
+        client.close()
+    methods_cache(env).set(addr, methods)
+    failed_discovery_cache(env).delete(addr)
+
+    cache = completion_cache(env)
+    addrs = [a for a in cache.get('addrs', []) if a != addr]
+    cache.set('addrs', [addr] + addrs)
+
+
+def refresh_options(env=Environment()):
+    """Cache the options the CLI accepts (no server is contacted)."""
+    from .cli import parser
+
+    completion_cache(env).set('options', {
+        'version': __version__,
+        'options': dict((option, action.nargs != 0)
+                        for action in parser._actions
+                        for option in action.option_strings),
+    })
+
+
+def start_refresh(args, env):
+    """Start ``jsonrpc-complete ARGS...`` (a refresh) in a detached
+    process, unless the same one was started recently.
+
+    """
+    pending = FileCache(env.cache_dir, 'refreshing', ttl=REFRESH_TIMEOUT)
+    key = ' '.join(args)
+    if pending.get(key):
+        return
+    pending.set(key, True)
+    with open(os.devnull, 'r+b') as devnull:
+        subprocess.Popen(
+            [sys.executable, '-m', 'jsonrpcake.completion'] + args,
+            stdin=devnull, stdout=devnull, stderr=devnull, close_fds=True)
+
+
+def get_options(cache, env):
+    """Return ``{option: takes a value}`` from `cache`, starting a
+    refresh if they are missing or from another version.
+
+    """
+    entry = cache.get('options')
+    if isinstance(entry, dict) and entry.get('version') == __version__:
+        return entry['options']
+    if env.cache_dir:
+        start_refresh(['--refresh-options'], env)
+    return {}
+
+
+def complete(words, env=Environment()):
+    """Return the completions of the last of `words` (which may be empty)
+    given the words typed before it, not including the program name.
+
+    """
+    cache = completion_cache(env)
+    options = get_options(cache, env)
+    current = words[-1] if words else ''
+
+    positional = []
+    takes_value = False
+    for word in words[:-1]:
+        if takes_value:
+            takes_value = False
+        elif word.startswith('-'):
+            takes_value = options.get(word, False)
+        else:
+            positional.append(word)
+
+    if takes_value:
+        # An option value; left to the shell (e.g., file names).
+        return []
+    if current.startswith('-'):
+        return sorted(option for option in options
+                      if option.startswith(current))
+    if not positional:
+        return [addr for addr in cache.get('addrs', [])
+                if addr.startswith(current)]
+
+    addr = positional[0]
+    methods = methods_cache(env).get(addr)
+    if methods is None:
+        if env.cache_dir and not failed_discovery_cache(env).get(addr):
+            start_refresh(['--refresh', addr], env)
+        return []
+    if len(positional) == 1:
+        return sorted(method for method in methods
+                      if method.startswith(current))
+
+    if any(sep in current for sep in ITEM_SEPARATORS):
+        return []
+    given = set(item.split('=', 1)[0].split(':', 1)[0]
+                for item in positional[2:])
+    return sorted(param + '=' for param in methods.get(positional[1], [])
+                  if param.startswith(current) and param not in given)
+
+
+def bash_words(word):
+    """Return the words of the command line being completed by bash,
+    and the prefix of the last one that bash doesn't consider part of
+    `word`, the word being completed (it splits at ``:`` and ``=``).
+
+    """
+    line = os.environ.get('COMP_LINE', '')
+    line = line[:int(os.environ.get('COMP_POINT', len(line)))]
+    try:
+        words = shlex.split(line)
+    except ValueError:
+        # An unterminated quote.
+        words = line.split()
+    if not line or line[-1].isspace():
+        words.append('')
+    words = words[1:] or ['']
+    current = words[-1]
+    prefix = current[:len(current) - len(word)] if (
+        word and current.endswith(word)) else current
+    return words, prefix
+
+
+def main(args=sys.argv[1:], env=Environment()):
+    """The ``jsonrpc-complete`` entry point.
+
+        jsonrpc-complete bash WORD      (reads COMP_LINE and COMP_POINT)
+        jsonrpc-complete zsh WORD...
+        jsonrpc-complete --script bash|zsh
+        jsonrpc-complete --refresh ADDR
+        jsonrpc-complete --refresh-options
+
+    """
+    if len(args) == 2 and args[0] == '--script' and args[1] in SCRIPTS:
+        env.stdout.write(SCRIPTS[args[1]].lstrip())
+        return ExitStatus.OK
+    if len(args) == 2 and args[0] == '--refresh':
+        refresh(args[1], env)
+        return ExitStatus.OK
+    if args == ['--refresh-options']:
+        refresh_options(env)
+        return ExitStatus.OK
+    if args[:1] == ['bash']:
+        words, prefix = bash_words(args[1] if len(args) > 1 else '')
+        candidates = [candidate[len(prefix):]
+                      for candidate in complete(words, env)
+                      if candidate.startswith(prefix)]
+    elif args[:1] == ['zsh']:
+        candidates = complete(args[1:], env)
+    else:
+        env.stderr.write(main.__doc__)
+        return ExitStatus.ERROR
+    for candidate in candidates:
+        env.stdout.write(candidate + '\n')
+    return ExitStatus.OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -12,21 +12,147 @@ Invocation flow:
 """
 import sys
 import errno
-import json
+import socket
 
 import jsonrpc_ns
 
 from .models import Environment
-from .output import build_output_stream, write
+from .metrics import Metrics, MetricsWriter
+from .client import client_from_args, DeadlineExceeded, DEFAULT_TIMEOUT
+from .timeouts import LatencyHistory
+from .output import build_output_stream, output_trailer, can_stream, write
 from . import ExitStatus
 
 
-def main(args=sys.argv[1:], env=Environment()):
+def single_call(args, env, error):
+    """Make a single call and write the response to ``env.stdout``.
+
+    Return exit status code.
+
+    """
+    exit_status = ExitStatus.OK
+    streamed = False
+
+    client = client_from_args(args)
+    try:
+        if can_stream(args):
+            # The result is written as it arrives; only the trailer is
+            # left to write once it's in.
+            client.stream(args.method, args.data, lambda chunk: write(
+                [chunk], env.stdout, flush=env.stdout_isatty))
+            streamed = True
+        else:
+            response = client.call(args.method, args.data)
+    except jsonrpc_ns.JSONRPCResponseError as e:
+        response = e.value
+        code = e.value['code']
+        message = e.value['message']
+
+        if args.check_status:
+            exit_status = ExitStatus.ERROR
+            error('JSONRPC %s %s', code, message, level='warning')
+
+    if not streamed and use_pager(args, env):
+        from .pager import page
+        if page(args, env, response):
+            client.close()
+            return exit_status
+
+    write_kwargs = {
+        'stream': output_trailer(args, env) if streamed else
+        build_output_stream(args, env, None, response),
+
+        'outfile': env.stdout,
+
+        'flush': env.stdout_isatty
+    }
+
+    write(**write_kwargs)
+    client.close()
+
+    return exit_status
+
+
+def use_pager(args, env):
+    """Whether a response may be shown in the built-in pager: formatted
+    for a terminal, unless ``--no-pager``.
+
+    """
+    return (args.pager and env.stdout_isatty
+            and 'format' in args.prettify)
+
+
+def start_metrics(args):
+    """Set ``args.metrics`` to the :class:`metrics.Metrics` the calls are
+    recorded in, if asked for with ``--metrics``.
+
+    Return the :class:`metrics.MetricsWriter` to be closed at the end of
+    the run, or `None`.
+
+    """
+    if not args.metrics_file:
+        args.metrics = None
+        return None
+    args.metrics = Metrics()
+    return MetricsWriter(args.metrics, args.metrics_file,
+                         fmt=args.metrics_format,
+                         interval=args.metrics_interval)
+
+
+def start_latency_history(args, env):
+    """Set ``args.history`` to the :class:`timeouts.LatencyHistory` the
+    latencies of the calls are recorded in, and ``args.read_timeout`` to
+    the timeout learned for ``args.method`` unless one was given.
+
+    With several addresses, the longest of their learned timeouts is
+    used, or the default if any hasn't been learned yet.
+
+    """
+    if not args.addr or not args.method:
+        args.history = None
+        return
+    args.history = LatencyHistory(env.cache_dir)
+    if args.read_timeout is not None:
+        return
+    addrs = args.addr.split(',') + ([args.diff] if args.diff else [])
+    learned = [args.history.timeout(addr, args.method) for addr in addrs]
+    args.read_timeout = (max(learned) if None not in learned
+                         else DEFAULT_TIMEOUT)
+    if args.debug:
+        for addr in addrs:
+            env.stderr.write('jsonrpc: read timeout for %s %s: %s\n' % (
+                addr, args.method, args.history.describe(addr, args.method)))
+        env.stderr.write('jsonrpc: read timeout: %.3f s\n'
+                         % args.read_timeout)
+
+
+def profile_main(args, env):
+    """Run :func:`main` under a :class:`profiling.Profiler` and write its
+    report to ``env.stderr``.
+
+    """
+    from .profiling import Profiler
+    profiler = Profiler(memory='--profile-memory' in args)
+    profiler.start()
+    try:
+        return main(args, env, profiler)
+    finally:
+        profiler.stop()
+        stats = profiler.stats()
+        env.stderr.write('\n' + profiler.report(stats))
+        if profiler.output:
+            profiler.dump(stats)
+
+
+def main(args=sys.argv[1:], env=Environment(), profiler=None):
     """Run the main program and write the output to ``env.stdout``.
 
     Return exit status code.
 
     """
+    if profiler is None and '--profile' in args:
+        return profile_main(args, env)
+
     from .cli import parser
 
     def error(msg, *args, **kwargs):
@@ -45,31 +171,30 @@ def main(args=sys.argv[1:], env=Environment()):
 
     try:
         args = parser.parse_args(args=args, env=env)
-        try:
-            response = jsonrpc_ns.request(
-                args.addr, args.method, args.data, timeout=args.timeout)
-        except jsonrpc_ns.JSONRPCResponseError as e:
-            response = e.value
-            code = e.value['code']
-            message = e.value['message']
-
-            if args.check_status:
-                exit_status = ExitStatus.ERROR
-                error('JSONRPC %s %s', code, message, level='warning')
-
-        response = json.dumps(response)
-
-        write_kwargs = {
-            'stream': build_output_stream(
-                args, env, None, response),
-
-            'outfile': env.stdout,
-
-            'flush': env.stdout_isatty or args.stream
-        }
+        if profiler:
+            profiler.output = args.profile_output
+        metrics_writer = start_metrics(args)
+        start_latency_history(args, env)
 
         try:
-            write(**write_kwargs)
+            if args.batch or args.bench:
+                from .batch import run_batch, run_bench
+                run = run_batch if args.batch else run_bench
+                exit_status = run(args, env, error)
+            elif args.open:
+                from .store import run_open
+                exit_status = run_open(args, env, error)
+            elif args.diff or args.diff_against:
+                from .compare import run_diff
+                exit_status = run_diff(args, env, error)
+            elif args.watch:
+                from .watch import run_watch
+                exit_status = run_watch(args, env, error)
+            elif args.follow:
+                from .follow import run_follow
+                exit_status = run_follow(args, env, error)
+            else:
+                exit_status = single_call(args, env, error)
 
         except IOError as e:
             if not traceback and e.errno == errno.EPIPE:
@@ -77,12 +202,23 @@ def main(args=sys.argv[1:], env=Environment()):
                 env.stderr.write('\n')
             else:
                 raise
+        finally:
+            if metrics_writer:
+                metrics_writer.close()
+            if args.history:
+                args.history.save()
     except (KeyboardInterrupt, SystemExit):
         if traceback:
             raise
         env.stderr.write('\n')
         exit_status = ExitStatus.ERROR
 
+    except (socket.timeout, DeadlineExceeded) as e:
+        if traceback:
+            raise
+        error('Request timed out: %s', str(e) or 'timed out')
+        exit_status = ExitStatus.ERROR_TIMEOUT
+
     except Exception as e:
         # TODO: Better distinction between expected and unexpected errors.
         #       Network errors vs. bugs, etc.
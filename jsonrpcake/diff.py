@@ -0,0 +1,265 @@
+"""Structural diff of decoded JSON values.
+
+Subtrees are compared by a hash of their canonical serialization (done
+by the C JSON encoder), so identical regions are skipped at once without
+walking them in Python. Arrays are matched by a key field when their
+elements are objects that have one, and by longest common subsequence
+otherwise.
+
+"""
+import re
+import json
+from difflib import SequenceMatcher
+
+import pygments
+from pygments.token import Generic, Name, Text
+
+from .output import _lexer
+
+
+# Change kinds.
+ADDED = '+'
+REMOVED = '-'
+CHANGED = '~'
+
+# Fields that identify the objects in an array, tried in this order.
+DEFAULT_ARRAY_KEYS = ('id', 'key', 'name', 'uuid')
+
+# The steps of a path: ``.key``, ``[index]``, or ``["quoted key"]``.
+_PATH_RE = re.compile(r'''
+    \.(?P<key>[^.\[\]]+)
+    | \[(?P<index>\d+)\]
+    | \[(?P<quoted>"(?:[^"\\]|\\.)*")\]
+''', re.VERBOSE)
+
+# Keys that are written quoted in paths: empty ones, ones with ``.``,
+# ``[`` or ``]``, and ones with whitespace at either end (which
+# `parse_path` would strip).
+_QUOTED_KEY_RE = re.compile(r'^$|[.\[\]]|^\s|\s$')
+
+KIND_TOKENS = {
+    ADDED: Generic.Inserted,
+    REMOVED: Generic.Deleted,
+    CHANGED: Generic.Subheading,
+}
+
+_encode = json.JSONEncoder(sort_keys=True, separators=(',', ':'),
+                           check_circular=False).encode
+
+
+def fingerprint(value):
+    """Return a hash of the whole JSON subtree `value`."""
+    return hash(_encode(value))
+
+
+def differ(a, b):
+    """Return `True` if the JSON values `a` and `b` differ."""
+    if type(a) is not type(b):
+        return True
+    if a != b:
+        return True
+    if isinstance(a, (dict, list)):
+        # Equal in Python isn't equal in JSON: `True == 1 == 1.0`.
+        return fingerprint(a) != fingerprint(b)
+    return False
+
+
+def format_path(path):
+    """Return `path` (a sequence of keys and indices) as a string.
+
+    >>> format_path(['users', 0, 'name', 'a.b'])
+    '$.users[0].name["a.b"]'
+
+    """
+    parts = ['$']
+    for key in path:
+        if isinstance(key, int):
+            parts.append('[%d]' % key)
+        elif _QUOTED_KEY_RE.search(key):
+            parts.append('[%s]' % json.dumps(key, ensure_ascii=False))
+        else:
+            parts.append('.' + key)
+    return ''.join(parts)
+
+
+def parse_path(text):
+    """Return the keys and indices of a path as written by
+    :func:`format_path` (the ``$`` is optional).
+
+    >>> parse_path('$.users[0].name')
+    ['users', 0, 'name']
+
+    Raise `ValueError` if `text` isn't a path.
+
+    """
+    original = text = text.strip()
+    if text.startswith('$'):
+        text = text[1:]
+    elif text and text[0] not in '.[':
+        text = '.' + text
+    path = []
+    end = 0
+    for match in _PATH_RE.finditer(text):
+        if match.start() != end:
+            break
+        end = match.end()
+        if match.group('key') is not None:
+            path.append(match.group('key'))
+        elif match.group('index') is not None:
+            path.append(int(match.group('index')))
+        else:
+            path.append(json.loads(match.group('quoted')))
+    if end != len(text):
+        raise ValueError('Invalid path: %s' % original)
+    return path
+
+
+def diff(old, new, array_keys=DEFAULT_ARRAY_KEYS):
+    """Yield ``(kind, path, old, new)`` for every difference between the
+    JSON values `old` and `new`.
+
+    Paths into arrays use the index in `new`, or in `old` for removed
+    elements.
+
+    """
+    if differ(old, new):
+        for change in _diff(old, new, (), array_keys):
+            yield change
+
+
+def _diff(old, new, path, array_keys):
+    # `old` and `new` are known to differ.
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, a in old.items():
+            if key not in new:
+                yield REMOVED, path + (key,), a, None
+            elif differ(a, new[key]):
+                for change in _diff(a, new[key], path + (key,), array_keys):
+                    yield change
+        for key, b in new.items():
+            if key not in old:
+                yield ADDED, path + (key,), None, b
+    elif isinstance(old, list) and isinstance(new, list):
+        key = _array_key(old, new, array_keys)
+        if key is not None:
+            changes = _diff_keyed(old, new, key, path, array_keys)
+        else:
+            changes = _diff_sequence(old, new, path, array_keys)
+        for change in changes:
+            yield change
+    else:
+        yield CHANGED, path, old, new
+
+
+def _array_key(old, new, array_keys):
+    """Return the field that uniquely identifies every element of both
+    arrays, if any.
+
+    """
+    if not old or not new:
+        return None
+    for key in array_keys:
+        if _is_unique_key(old, key) and _is_unique_key(new, key):
+            return key
+    return None
+
+
+def _is_unique_key(items, key):
+    seen = set()
+    for item in items:
+        if not isinstance(item, dict):
+            return False
+        value = item.get(key)
+        if (not isinstance(value, (int, str)) or isinstance(value, bool)
+                or value in seen):
+            return False
+        seen.add(value)
+    return True
+
+
+def _diff_keyed(old, new, key, path, array_keys):
+    by_key = dict((item[key], item) for item in old)
+    for j, b in enumerate(new):
+        a = by_key.pop(b[key], None)
+        if a is None:
+            yield ADDED, path + (j,), None, b
+        elif differ(a, b):
+            for change in _diff(a, b, path + (j,), array_keys):
+                yield change
+    for i, a in enumerate(old):
+        if a[key] in by_key:
+            yield REMOVED, path + (i,), a, None
+
+
+def _diff_sequence(old, new, path, array_keys):
+    # Most arrays share a long prefix and suffix; don't make the
+    # sequence matcher look at those.
+    start = 0
+    limit = min(len(old), len(new))
+    while start < limit and not differ(old[start], new[start]):
+        start += 1
+    old_end, new_end = len(old), len(new)
+    while (old_end > start and new_end > start
+           and not differ(old[old_end - 1], new[new_end - 1])):
+        old_end -= 1
+        new_end -= 1
+
+    matcher = SequenceMatcher(
+        None,
+        [fingerprint(a) for a in old[start:old_end]],
+        [fingerprint(b) for b in new[start:new_end]],
+        autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        i1, i2, j1, j2 = i1 + start, i2 + start, j1 + start, j2 + start
+        # Replaced elements are compared pairwise; the rest of the
+        # longer side is added or removed.
+        for i, j in zip(range(i1, i2), range(j1, j2)):
+            for change in _diff(old[i], new[j], path + (j,), array_keys):
+                yield change
+        paired = min(i2 - i1, j2 - j1)
+        for i in range(i1 + paired, i2):
+            yield REMOVED, path + (i,), old[i], None
+        for j in range(j1 + paired, j2):
+            yield ADDED, path + (j,), None, new[j]
+
+
+def dumps(value):
+    return json.dumps(value, ensure_ascii=False, sort_keys=True)
+
+
+def _value_tokens(value):
+    for token in _lexer.get_tokens(dumps(value)):
+        if token[1] != '\n':
+            yield token
+
+
+def change_tokens(change):
+    """Yield Pygments ``(token, text)`` pairs for one change."""
+    kind, path, old, new = change
+    yield KIND_TOKENS[kind], kind + ' '
+    yield Name.Tag, format_path(path)
+    yield Text, ': '
+    if kind == CHANGED:
+        for token in _value_tokens(old):
+            yield token
+        yield KIND_TOKENS[kind], ' -> '
+    for token in _value_tokens(old if kind == REMOVED else new):
+        yield token
+
+
+def format_change(change, formatter=None):
+    """Return a one-line description of a change yielded by :func:`diff`,
+    colorized with the Pygments `formatter` if given.
+
+    """
+    if formatter is not None:
+        return pygments.format(change_tokens(change), formatter)
+    kind, path, old, new = change
+    path = format_path(path)
+    if kind == ADDED:
+        return '%s %s: %s' % (kind, path, dumps(new))
+    if kind == REMOVED:
+        return '%s %s: %s' % (kind, path, dumps(old))
+    return '%s %s: %s -> %s' % (kind, path, dumps(old), dumps(new))
@@ -0,0 +1,179 @@
+"""Follow mode: subscribe and write the messages the server pushes.
+
+"""
+from __future__ import division
+import time
+import socket
+import threading
+
+import jsonrpc_ns
+
+from .client import tls_from_args
+from .output import get_output_processor, output_trailer, write
+from .scheduler import PROGRESS_INTERVAL
+from .transport import Connection, iter_message, unwrap
+from . import ExitStatus
+
+
+# How long to wait (in seconds) before the first attempt to reconnect,
+# doubled after every failed one up to `MAX_RECONNECT_DELAY`.
+RECONNECT_DELAY = 0.5
+MAX_RECONNECT_DELAY = 30
+
+
+class FollowProgress(object):
+    """The number and rate of messages received, written to
+    ``env.stderr``. The line is redrawn by a background thread so that
+    the rate drops when the server goes quiet.
+
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self.started = time.time()
+        self.messages = 0
+        self.reconnects = 0
+        # The messages and time at the previous redraw, for the rate
+        # since then.
+        self.last = (self.started, 0)
+        self.recent = 0.0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        if env.stderr_isatty:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        line = '%d messages  %.1f/s' % (
+            self.messages, self.messages / elapsed if elapsed else 0.0)
+        if self.thread is not None:
+            line += '  (%.1f/s now)' % self.recent
+        if self.reconnects:
+            line += '  %d reconnects' % self.reconnects
+        return line
+
+    def _run(self):
+        while not self.stopped.wait(PROGRESS_INTERVAL):
+            now = time.time()
+            then, messages = self.last
+            self.recent = (self.messages - messages) / (now - then)
+            self.last = (now, self.messages)
+            with self.lock:
+                self.env.stderr.write('\r\x1b[K' + self.summary())
+                self.env.stderr.flush()
+
+    def clear(self):
+        """Clear the line before something else is written to stderr."""
+        if self.thread is not None:
+            self.env.stderr.write('\r\x1b[K')
+            self.env.stderr.flush()
+
+    def finish(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.clear()
+        self.env.stderr.write(self.summary() + '\n')
+
+
+def subscribe(args, conn):
+    """Call ``args.method`` on `conn` and yield ``(message, pushed)``
+    for every message received afterwards, until the connection is lost.
+    `pushed` is false for the response to the call itself.
+
+    Messages pushed before the response to the call are yielded too.
+    An error response is raised.
+
+    """
+    rpcid = next(conn.ids)
+    conn.send_chunks(iter_message(args.method, args.data, rpcid))
+    while True:
+        message = conn.recv_response()
+        pushed = not (isinstance(message, dict)
+                      and message.get('id') == rpcid)
+        if not pushed:
+            unwrap(message)
+            # Subscribed; messages may be a long time apart.
+            conn.sock.settimeout(None)
+        yield message, pushed
+
+
+def follow(args, progress, report):
+    """Yield the ``(message, pushed)`` pairs of :func:`subscribe`,
+    connecting and calling ``args.method`` again whenever the connection
+    is lost. Connection errors are passed to `report`, each only once in
+    a row.
+
+    """
+    tls = tls_from_args(args)
+    delay = RECONNECT_DELAY
+    failed = None
+    while True:
+        conn = None
+        try:
+            conn = Connection(args.addr,
+                              connect_timeout=args.connect_timeout,
+                              tls=tls)
+            conn.sock.settimeout(args.read_timeout)
+            conn.sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            for message, pushed in subscribe(args, conn):
+                yield message, pushed
+        except jsonrpc_ns.JSONRPCResponseError:
+            raise
+        except (socket.error, jsonrpc_ns.JSONRPCError) as e:
+            # Keep following; the server may come back.
+            message = '%s: %s' % (type(e).__name__, str(e))
+            if message != failed:
+                report(message)
+                failed = message
+        finally:
+            if conn is not None:
+                if conn.bytes_received:
+                    # It got as far as receiving; start over.
+                    delay = RECONNECT_DELAY
+                    failed = None
+                conn.close()
+        time.sleep(delay)
+        delay = min(delay * 2, MAX_RECONNECT_DELAY)
+        progress.reconnects += 1
+
+
+def run_follow(args, env, error):
+    """Call ``args.method`` (e.g., a ``subscribe`` method) and keep the
+    connection open, writing every message the server sends on it as it
+    arrives. When the connection is lost, connect again and call
+    ``args.method`` again.
+
+    """
+    processor = get_output_processor(
+        env=env, groups=args.prettify, pygments_style=args.style)
+    # Messages must be told apart even when written without a trailer.
+    trailer = output_trailer(args, env) or [b'\n']
+    progress = FollowProgress(env)
+
+    def write_value(value):
+        chunks = [processor.process_response(value).encode('utf8')]
+        with progress.lock:
+            progress.clear()
+            write(chunks + trailer, env.stdout, flush=True)
+
+    def report(message):
+        with progress.lock:
+            progress.clear()
+            error('%s', message)
+
+    try:
+        for message, pushed in follow(args, progress, report):
+            write_value(message)
+            # The response to the call is written again on every
+            # reconnect, but only what the server pushed is counted.
+            if pushed:
+                progress.messages += 1
+    except jsonrpc_ns.JSONRPCResponseError as e:
+        write_value({'error': e.value})
+        return ExitStatus.ERROR
+    finally:
+        progress.finish()
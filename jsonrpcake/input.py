@@ -2,6 +2,7 @@
 
 """
 import os
+import re
 import sys
 import json
 import getpass
@@ -14,6 +15,8 @@ try:
 except ImportError:
     OrderedDict = dict
 
+from .client import DEFAULT_TIMEOUT
+
 # TODO: Use MultiDict for headers once added to `requests`.
 # https://github.com/jkbr/httpie/issues/130
 
@@ -71,6 +74,13 @@ PRETTY_MAP = {
 }
 PRETTY_STDOUT_TTY_ONLY = object()
 
+# --output-format to the processor group that serializes the output.
+OUTPUT_FORMATS = {
+    'pretty': 'format',
+    'compact': 'compact',
+    'ndjson': 'ndjson',
+}
+
 
 class Parser(ArgumentParser):
     """Adds additional logic to `argparse.ArgumentParser`.
@@ -82,8 +92,16 @@ class Parser(ArgumentParser):
 
     def __init__(self, *args, **kwargs):
         kwargs['add_help'] = False
+        kwargs['fromfile_prefix_chars'] = '@'
         super(Parser, self).__init__(*args, **kwargs)
 
+    def convert_arg_line_to_args(self, arg_line):
+        """Read one argument per line from ``@file`` arguments, so that
+        items don't need quoting. Blank lines are ignored.
+
+        """
+        return [arg_line] if arg_line.strip() else []
+
     #noinspection PyMethodOverriding
     def parse_args(self, env, args=None, namespace=None):
 
@@ -96,10 +114,18 @@ class Parser(ArgumentParser):
 
         # Arguments processing and environment setup.
         self._apply_no_options(no_options)
+        self._validate_positional_args()
+        self._setup_standard_streams()
         self._process_pretty_options()
+        self._process_timeout_options()
+        self._process_tls_options()
         self._parse_items()
-        if not self.args.ignore_stdin and not env.stdin_isatty:
+        if (not self.args.ignore_stdin and not env.stdin_isatty
+                and not self.args.batch and not self.args.open):
             self._body_from_file(self.env.stdin)
+        self._validate_multi_call_options()
+        self._process_metrics_options()
+        self._validate_profile_options()
 
         return self.args
 
@@ -119,27 +145,12 @@ class Parser(ArgumentParser):
         Modify `env.stdout` and `env.stdout_isatty` based on args, if needed.
 
         """
-        if not self.env.stdout_isatty and self.args.output_file:
-            self.error('Cannot use --output, -o with redirected output.')
-
-        # FIXME: Come up with a cleaner solution.
-        if self.args.download:
-
-            if not self.env.stdout_isatty:
-                # Use stdout as tge download output file.
-                self.args.output_file = self.env.stdout
-
-            # With `--download`, we write everything that would normally go to
-            # `stdout` to `stderr` instead. Let's replace the stream so that
-            # we don't have to use many `if`s throughout the codebase.
-            # The response body will be treated separately.
-            self.env.stdout = self.env.stderr
-            self.env.stdout_isatty = self.env.stderr_isatty
-
-        elif self.args.output_file:
-            # When not `--download`ing, then `--output` simply replaces
-            # `stdout`. The file is opened for appending, which isn't what
-            # we want in this case.
+        if self.args.rotate_size and not self.args.output_file:
+            self.error('--rotate-size requires --output to be specified')
+
+        if self.args.output_file:
+            # `--output` simply replaces `stdout`. The file is opened for
+            # appending, which isn't what we want in this case.
             self.args.output_file.seek(0)
             self.args.output_file.truncate()
 
@@ -211,6 +222,96 @@ class Parser(ArgumentParser):
             # noinspection PyTypeChecker
             self.args.prettify = PRETTY_MAP[self.args.prettify]
 
+        output_format = self.args.output_format
+        if output_format is None and self.args.batch:
+            # Batch results are always written one record per line.
+            output_format = 'ndjson'
+        if output_format:
+            if self.args.batch and output_format == 'pretty':
+                self.error('--batch output is NDJSON; use --output-format '
+                           'compact or ndjson')
+            self.args.prettify = [OUTPUT_FORMATS[output_format]] + [
+                group for group in self.args.prettify if group != 'format']
+
+    def _process_timeout_options(self):
+        # Without --timeout or --read-timeout, the read timeout is
+        # learned from earlier calls (see `timeouts`).
+        if self.args.connect_timeout is None:
+            self.args.connect_timeout = (self.args.timeout
+                                         if self.args.timeout is not None
+                                         else DEFAULT_TIMEOUT)
+        if self.args.read_timeout is None:
+            self.args.read_timeout = self.args.timeout
+
+    def _process_tls_options(self):
+        verify = self.args.verify
+        if verify.lower() in ('yes', 'true'):
+            self.args.verify = True
+        elif verify.lower() in ('no', 'false'):
+            self.args.verify = False
+        elif not os.path.isfile(verify):
+            self.error('--verify must be yes, no, or a CA bundle file; '
+                       'no such file: %s' % verify)
+        if self.args.cert_key and not self.args.cert:
+            self.error('--cert-key requires --cert')
+
+    def _validate_positional_args(self):
+        if self.args.open:
+            if self.args.addr or self.args.method or self.args.items:
+                self.error('--open takes no ADDR, METHOD or REQUEST_ITEM')
+            return
+        if self.args.path or self.args.summary:
+            self.error('--path and --summary require --open')
+        missing = [name for name, value in (('ADDR', self.args.addr),
+                                            ('METHOD', self.args.method))
+                   if value is None]
+        if missing:
+            self.error('the following arguments are required: %s'
+                       % ', '.join(missing))
+
+    def _validate_multi_call_options(self):
+        if self.args.addr and ',' in self.args.addr and not (
+                self.args.batch or self.args.bench):
+            self.error('Several replicas in ADDR only work with --batch '
+                       'and --bench')
+        if self.args.max_in_flight < 1:
+            self.error('--max-in-flight must be at least 1')
+        if self.args.bench is not None and self.args.bench < 1:
+            self.error('--bench must be at least 1')
+        if self.args.bench_workers < 1:
+            self.error('--bench-workers must be at least 1')
+        if self.args.watch is not None and self.args.watch <= 0:
+            self.error('--watch INTERVAL must be positive')
+        if self.args.reorder_window < 1:
+            self.error('--reorder-window must be at least 1')
+        if self.args.coalesce is not None:
+            if not (self.args.batch or self.args.bench):
+                self.error('--coalesce only works with --batch and --bench')
+            self.args.coalesce = [method for method
+                                  in self.args.coalesce.split(',') if method]
+            if not self.args.coalesce:
+                self.error('--coalesce needs at least one METHOD')
+
+    def _process_metrics_options(self):
+        if not self.args.metrics_file:
+            if self.args.metrics_format or self.args.metrics_interval:
+                self.error('--metrics-format and --metrics-interval '
+                           'require --metrics')
+            return
+        if self.args.metrics_interval is not None and (
+                self.args.metrics_interval <= 0):
+            self.error('--metrics-interval must be positive')
+        if not self.args.metrics_format:
+            self.args.metrics_format = (
+                'json' if self.args.metrics_file.endswith('.json')
+                else 'prometheus')
+
+    def _validate_profile_options(self):
+        if not self.args.profile and (self.args.profile_output
+                                      or self.args.profile_memory):
+            self.error('--profile-output and --profile-memory require '
+                       '--profile')
+
     def _validate_download_options(self):
         if not self.args.download:
             if self.args.download_resume:
@@ -224,6 +325,16 @@ class ParseError(Exception):
     pass
 
 
+def unescape(string, _sub=re.compile(r'\\(.?)', re.DOTALL).sub):
+    r"""Replace every backslash-escaped character with the character itself.
+
+    >>> unescape(r'foo\=bar\\baz')
+    'foo=bar\\baz'
+
+    """
+    return _sub(r'\1', string)
+
+
 class KeyValue(object):
     """Base key-value pair parsed from CLI."""
 
@@ -249,6 +360,12 @@ class KeyValueArgType(object):
 
     def __init__(self, *separators):
         self.separators = separators
+        # Longest first, so that at any position the longest separator
+        # wins, e.g., ':=' over ':'.
+        self.pattern = re.compile(r'\\(.?)|(%s)' % '|'.join(
+            re.escape(sep)
+            for sep in sorted(separators, key=len, reverse=True)
+        ), re.DOTALL)
 
     def __call__(self, string):
         """Parse `string` and return `self.key_value_class()` instance.
@@ -259,69 +376,69 @@ class KeyValueArgType(object):
         as well (r'\\').
 
         """
+        # A single scan finds the first separator that isn't escaped;
+        # escapes are skipped over as a whole.
+        for match in self.pattern.finditer(string):
+            sep = match.group(2)
+            if sep:
+                break
+        else:
+            raise ArgumentTypeError(
+                '"%s" is not a valid value' % string)
 
-        class Escaped(str):
-            """Represents an escaped character."""
-
-        def tokenize(s):
-            """Tokenize `s`. There are only two token types - strings
-            and escaped characters:
+        key = string[:match.start()]
+        value = string[match.end():]
+        if '\\' in key:
+            key = unescape(key)
+        if '\\' in value:
+            value = unescape(value)
 
-            tokenize(r'foo\=bar\\baz')
-            => ['foo', Escaped('='), 'bar', Escaped('\\'), 'baz']
+        return self.key_value_class(
+            key=key, value=value, sep=sep, orig=string)
 
-            """
-            tokens = ['']
-            esc = False
-            for c in s:
-                if esc:
-                    tokens.extend([Escaped(c), ''])
-                    esc = False
-                else:
-                    if c == '\\':
-                        esc = True
-                    else:
-                        tokens[-1] += c
-            return tokens
 
-        tokens = tokenize(string)
+class RateArgType(object):
+    """A call rate argument type used with `argparse`.
 
-        # Sorting by length ensures that the longest one will be
-        # chosen as it will overwrite any shorter ones starting
-        # at the same position in the `found` dictionary.
-        separators = sorted(self.separators, key=len)
+    Parses ``N``, ``N/s``, ``N/m``, or ``N/h`` into calls per second.
 
-        for i, token in enumerate(tokens):
+    """
 
-            if isinstance(token, Escaped):
-                continue
+    units = {'s': 1, 'm': 60, 'h': 3600}
 
-            found = {}
-            for sep in separators:
-                pos = token.find(sep)
-                if pos != -1:
-                    found[pos] = sep
+    def __call__(self, string):
+        value, _, unit = string.partition('/')
+        try:
+            rate = float(value) / self.units[unit or 's']
+        except (KeyError, ValueError):
+            rate = 0
+        if rate <= 0:
+            raise ArgumentTypeError(
+                '"%s" is not a valid rate' % string)
+        return rate
 
-            if found:
-                # Starting first, longest separator found.
-                sep = found[min(found.keys())]
 
-                key, value = token.split(sep, 1)
+class SizeArgType(object):
+    """A size argument type used with `argparse`.
 
-                # Any preceding tokens are part of the key.
-                key = ''.join(tokens[:i]) + key
+    Parses ``N``, ``Nk``, ``NM``, or ``NG`` into a number of bytes.
 
-                # Any following tokens are part of the value.
-                value += ''.join(tokens[i + 1:])
+    """
 
-                break
+    units = {'': 1, 'k': 1 << 10, 'm': 1 << 20, 'g': 1 << 30}
 
-        else:
+    def __call__(self, string):
+        value = string.strip().lower()
+        unit = value[-1:] if value[-1:] in self.units else ''
+        try:
+            size = int(float(value[:len(value) - len(unit)])
+                       * self.units[unit])
+        except ValueError:
+            size = 0
+        if size <= 0:
             raise ArgumentTypeError(
-                '"%s" is not a valid value' % string)
-
-        return self.key_value_class(
-            key=key, value=value, sep=sep, orig=string)
+                '"%s" is not a valid size' % string)
+        return size
 
 
 class AuthCredentials(KeyValue):
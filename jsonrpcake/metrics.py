@@ -0,0 +1,328 @@
+"""Call metrics, exported as Prometheus text or a JSON summary.
+
+Every call made by a :class:`client.Client` with ``metrics`` set is
+recorded per method and per host: the number of calls, JSON-RPC error
+codes, timeouts and other failures, bytes sent and received, and a
+latency histogram. Recording a call takes one lock and a few additions.
+
+"""
+from __future__ import division
+import os
+import copy
+import json
+import socket
+import bisect
+import threading
+
+import jsonrpc_ns
+
+from .transport import DeadlineExceeded
+
+
+PROMETHEUS = 'prometheus'
+JSON = 'json'
+FORMATS = (PROMETHEUS, JSON)
+
+# Upper bounds (in seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def log_buckets(low, high, growth):
+    """Return bucket bounds from `low` up to `high`, each `growth` times
+    the one before.
+
+    """
+    bounds = []
+    bound = low
+    while bound < high:
+        bounds.append(bound)
+        bound *= growth
+    return tuple(bounds)
+
+
+# The finer buckets ``--bench`` estimates latency percentiles from: 1%
+# apart from 0.01 ms to 100 s, so that the estimates are within 1%.
+BENCH_BUCKETS = log_buckets(0.00001, 100.0, 1.01)
+
+# The exported metric families: ``(name, type, help)``.
+PROMETHEUS_FAMILIES = (
+    ('jsonrpc_calls_total', 'counter', 'Calls made.'),
+    ('jsonrpc_response_errors_total', 'counter',
+     'JSON-RPC error responses, by error code.'),
+    ('jsonrpc_timeouts_total', 'counter', 'Calls that timed out.'),
+    ('jsonrpc_failures_total', 'counter',
+     'Calls that failed without an error response or a timeout.'),
+    ('jsonrpc_sent_bytes_total', 'counter', 'Bytes sent.'),
+    ('jsonrpc_received_bytes_total', 'counter', 'Bytes received.'),
+    ('jsonrpc_call_duration_seconds', 'histogram',
+     'Call latency in seconds.'),
+)
+
+
+def is_timeout(error):
+    return isinstance(error, (socket.timeout, DeadlineExceeded))
+
+
+class Histogram(object):
+    """Counts of observations per bucket of `bounds`, plus an overflow
+    bucket.
+
+    """
+
+    def __init__(self, bounds=LATENCY_BUCKETS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other):
+        """Add the observations of `other`, which has the same bounds."""
+        if other.bounds != self.bounds:
+            raise ValueError('cannot merge histograms with different bounds')
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def cumulative(self):
+        """Yield ``(bound, count)`` with the number of observations up to
+        each bound, ending with ``(float('inf'), self.count)``.
+
+        """
+        total = 0
+        for bound, count in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+    def quantile(self, q):
+        """Estimate the `q`-quantile by interpolating within its bucket."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        lower = previous = 0
+        for bound, total in self.cumulative():
+            if total >= rank:
+                if bound == float('inf'):
+                    return lower
+                in_bucket = total - previous
+                return lower + (bound - lower) * (
+                    (rank - previous) / in_bucket if in_bucket else 0)
+            lower, previous = bound, total
+        return lower
+
+
+class Series(object):
+    """The metrics of the calls of one method to one host."""
+
+    def __init__(self):
+        self.calls = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.error_codes = {}
+        self.sent = 0
+        self.received = 0
+        self.latency = Histogram()
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.timeouts += other.timeouts
+        self.failures += other.failures
+        for code, count in other.error_codes.items():
+            self.error_codes[code] = self.error_codes.get(code, 0) + count
+        self.sent += other.sent
+        self.received += other.received
+        self.latency.merge(other.latency)
+
+
+class Metrics(object):
+    """A thread-safe registry of call metrics."""
+
+    def __init__(self):
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def _get(self, method, host):
+        key = (method, host)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = Series()
+        return series
+
+    def record(self, method, host, latency, error=None, sent=0, received=0):
+        """Record a call of `method` to `host` that took `latency`
+        seconds and raised `error`, if anything.
+
+        """
+        with self.lock:
+            series = self._get(method, host)
+            series.calls += 1
+            series.sent += sent
+            series.received += received
+            series.latency.observe(latency)
+            if error is not None:
+                self._record_error(series, error)
+
+    def record_error(self, method, host, error):
+        """Record an `error` that came back without being raised, e.g.,
+        an error response in a batch.
+
+        """
+        with self.lock:
+            self._record_error(self._get(method, host), error)
+
+    def _record_error(self, series, error):
+        if isinstance(error, jsonrpc_ns.JSONRPCResponseError):
+            code = error.value.get('code')
+            series.error_codes[code] = series.error_codes.get(code, 0) + 1
+        elif is_timeout(error):
+            series.timeouts += 1
+        else:
+            series.failures += 1
+
+    def merge(self, snapshot):
+        """Add the series of a :meth:`snapshot` of other metrics, e.g.,
+        those recorded in another process.
+
+        """
+        with self.lock:
+            for method, host, series in snapshot:
+                self._get(method, host).merge(series)
+
+    def snapshot(self):
+        """Return a sorted list of ``(method, host, series)`` with copies
+        of the current series.
+
+        """
+        with self.lock:
+            return sorted(
+                (method, host, copy.deepcopy(series))
+                for (method, host), series in self.series.items())
+
+    def to_json(self):
+        """Return a summary of the metrics as a JSON-serializable `list`,
+        one entry per method and host.
+
+        """
+        summary = []
+        for method, host, series in self.snapshot():
+            latency = series.latency
+            summary.append({
+                'method': method,
+                'host': host,
+                'calls': series.calls,
+                'timeouts': series.timeouts,
+                'failures': series.failures,
+                'error_codes': dict(
+                    (str(code), count)
+                    for code, count in series.error_codes.items()),
+                'bytes_sent': series.sent,
+                'bytes_received': series.received,
+                'latency': {
+                    'sum': latency.sum,
+                    'mean': latency.sum / latency.count
+                    if latency.count else 0.0,
+                    'p50': latency.quantile(0.5),
+                    'p90': latency.quantile(0.9),
+                    'p99': latency.quantile(0.99),
+                },
+            })
+        return summary
+
+    def to_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format."""
+        samples = dict((name, []) for name, _, _ in PROMETHEUS_FAMILIES)
+        for method, host, series in self.snapshot():
+            labels = 'method=%s,host=%s' % (quote(method), quote(host))
+            samples['jsonrpc_calls_total'].append(
+                ('', labels, series.calls))
+            for code, count in sorted(series.error_codes.items(),
+                                      key=lambda item: str(item[0])):
+                samples['jsonrpc_response_errors_total'].append(
+                    ('', '%s,code=%s' % (labels, quote(code)), count))
+            samples['jsonrpc_timeouts_total'].append(
+                ('', labels, series.timeouts))
+            samples['jsonrpc_failures_total'].append(
+                ('', labels, series.failures))
+            samples['jsonrpc_sent_bytes_total'].append(
+                ('', labels, series.sent))
+            samples['jsonrpc_received_bytes_total'].append(
+                ('', labels, series.received))
+            histogram = samples['jsonrpc_call_duration_seconds']
+            for bound, count in series.latency.cumulative():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                histogram.append(
+                    ('_bucket', '%s,le="%s"' % (labels, le), count))
+            histogram.append(('_sum', labels, series.latency.sum))
+            histogram.append(('_count', labels, series.latency.count))
+
+        lines = []
+        for name, kind, description in PROMETHEUS_FAMILIES:
+            lines.append('# HELP %s %s' % (name, description))
+            lines.append('# TYPE %s %s' % (name, kind))
+            for suffix, labels, value in samples[name]:
+                lines.append('%s%s{%s} %s' % (name, suffix, labels,
+                                              format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, fmt=PROMETHEUS):
+        """Return the metrics serialized in `fmt` as `str`."""
+        if fmt == JSON:
+            return json.dumps(self.to_json(), indent=2) + '\n'
+        return self.to_prometheus()
+
+
+def quote(value):
+    """Return `value` as a quoted Prometheus label value."""
+    return '"%s"' % (str(value).replace('\\', r'\\')
+                     .replace('"', r'\"').replace('\n', r'\n'))
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class MetricsWriter(object):
+    """Write `metrics` to `path` right away (so that a bad path is caught
+    before any calls are made), every `interval` seconds if given, and
+    once more on :meth:`close`.
+
+    The file is replaced atomically, so that readers such as the node
+    exporter's textfile collector never see a partial file.
+
+    """
+
+    def __init__(self, metrics, path, fmt=PROMETHEUS, interval=None):
+        self.metrics = metrics
+        self.path = path
+        self.fmt = fmt
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+        self.write()
+        if interval:
+            self.thread = threading.Thread(target=self._run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            self.write()
+
+    def write(self):
+        tmp = '%s.tmp%d' % (self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(self.metrics.dump(self.fmt))
+        os.replace(tmp, self.path)
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.write()
@@ -17,6 +17,12 @@ class Environment(object):
     # Can be set to 0 to disable colors completely.
     colors = 256 if '256color' in os.environ.get('TERM', '') else 88
 
+    # Where data worth keeping across invocations is cached.
+    # Can be set to `None` to disable the on-disk cache.
+    cache_dir = os.environ.get('JSONRPCAKE_CACHE_DIR') or os.path.join(
+        os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'),
+        'jsonrpcake')
+
     stdin = sys.stdin
     stdin_isatty = sys.stdin.isatty()
 
@@ -2,6 +2,8 @@
 
 """
 import json
+import multiprocessing
+from collections import deque
 from itertools import chain
 
 import pygments
@@ -13,11 +15,19 @@ from pygments.util import ClassNotFound
 
 from .solarized import Solarized256Style
 from .models import Environment
+from .cache import FileCache
 
 
 # The default number of spaces to indent when pretty printing
 DEFAULT_INDENT = 4
 
+# The most compact separators, for --output-format compact and ndjson.
+COMPACT_SEPARATORS = (',', ':')
+
+# Multi-call output is processed in worker processes once this many bytes
+# of it have been processed in-process (see `ParallelProcessor`).
+PARALLEL_THRESHOLD = 4 << 20
+
 # Colors on Windows via colorama don't look that
 # great and fruity seems to give the best result there.
 AVAILABLE_STYLES = set(STYLE_MAP.keys())
@@ -80,13 +90,16 @@ def build_output_stream(args, env, request, response):
     """Build and return a chain of iterators over the `request`-`response`
     exchange each of which yields `bytes` chunks.
 
+    `response` is the decoded response, serialized once by the output
+    processor.
+
     """
 
     req = False
     resp = True
 
     output = []
-    processor = OutputProcessor(
+    processor = get_output_processor(
         env=env, groups=args.prettify, pygments_style=args.style)
 
     if req:
@@ -96,14 +109,33 @@ def build_output_stream(args, env, request, response):
         output.append([b'\n\n'])
 
     if resp:
-        output.append(processor.process_body(response))
+        output.append([processor.process_response(response).encode('utf8')])
 
-    if env.stdout_isatty and resp:
+    if resp:
+        output.append(output_trailer(args, env))
+
+    return chain(*output)
+
+
+def output_trailer(args, env):
+    """Return the chunks written after a response body."""
+    if 'ndjson' in args.prettify:
+        # One record per line, whatever the output is.
+        return [b'\n']
+    if env.stdout_isatty:
         # Ensure a blank line after the response body.
         # For terminal output only.
-        output.append([b'\n\n'])
+        return [b'\n\n']
+    return []
 
-    return chain(*output)
+
+def can_stream(args):
+    """Whether results can be written as they are received: when they
+    are written compact and uncolored, the server's JSON text can be
+    rewritten as it arrives (see :mod:`stream`) rather than decoded.
+
+    """
+    return args.prettify in (['compact'], ['ndjson'])
 
 
 ###############################################################################
@@ -146,22 +178,119 @@ class BaseProcessor(object):
 
 
 class JSONProcessor(BaseProcessor):
-    """JSON body processor."""
+    """JSON body processor.
+
+    Processors that define :meth:`serialize` turn decoded responses into
+    text directly (see :meth:`OutputProcessor.process_response`).
+
+    """
+
+    def serialize(self, value):
+        # Indent the JSON data, sort keys by name, and
+        # avoid unicode escapes to improve readability.
+        return json.dumps(value,
+                          sort_keys=True,
+                          ensure_ascii=False,
+                          indent=DEFAULT_INDENT)
 
     def process_body(self, content):
         try:
-            # Indent the JSON data, sort keys by name, and
-            # avoid unicode escapes to improve readability.
-            content = json.dumps(json.loads(content),
-                                 sort_keys=True,
-                                 ensure_ascii=False,
-                                 indent=DEFAULT_INDENT)
+            content = self.serialize(json.loads(content))
         except ValueError:
             # Invalid JSON but we don't care.
             pass
         return content
 
 
+class CompactJSONProcessor(JSONProcessor):
+    """Serializes JSON without whitespace, keeping the key order."""
+
+    def serialize(self, value):
+        return json.dumps(value,
+                          ensure_ascii=False,
+                          separators=COMPACT_SEPARATORS)
+
+
+class NDJSONProcessor(CompactJSONProcessor):
+    """Like :class:`CompactJSONProcessor`; the output stream then ends
+    every value with a newline, so there is one value per line.
+
+    """
+
+
+class CachedTerminal256Formatter(Terminal256Formatter):
+    """A `Terminal256Formatter` that reads its style to escape code table
+    from the on-disk cache instead of computing it when it can.
+
+    Mapping every color of a style to the closest one of the 256
+    terminal colors is what makes creating the formatter slow.
+
+    """
+
+    def __init__(self, cache_dir=None, **options):
+        self.cache = FileCache(cache_dir, 'styles')
+        super(CachedTerminal256Formatter, self).__init__(**options)
+
+    def _build_color_table(self):
+        # Deferred to `_setup_styles()`, only needed on a cache miss.
+        pass
+
+    def _setup_styles(self):
+        key = '{0}.{1}:256:{2}:{3:d}{4:d}{5:d}'.format(
+            self.style.__module__, self.style.__name__, pygments.__version__,
+            self.usebold, self.useunderline, self.useitalic)
+        style_string = self.cache.get(key)
+        if style_string:
+            self.style_string = dict(
+                (ttype, tuple(codes))
+                for ttype, codes in style_string.items())
+            return
+        super(CachedTerminal256Formatter, self)._build_color_table()
+        super(CachedTerminal256Formatter, self)._setup_styles()
+        self.cache.set(key, self.style_string)
+
+
+# Formatters are expensive to create, and lexers and formatters
+# can be reused, so there is only ever one of each per process.
+_lexer = JsonLexer()
+_formatters = {}
+_output_processors = {}
+
+
+def get_formatter(style_name, colors, cache_dir=None):
+    """Return the (shared) Pygments formatter for `style_name` with
+    `colors` terminal colors.
+
+    """
+    key = (style_name, colors)
+    if key not in _formatters:
+        try:
+            style = get_style_by_name(style_name)
+        except ClassNotFound:
+            style = Solarized256Style
+
+        if colors == 256:
+            formatter = CachedTerminal256Formatter(
+                style=style, cache_dir=cache_dir)
+        else:
+            formatter = TerminalFormatter(style=style)
+        _formatters[key] = formatter
+    return _formatters[key]
+
+
+def get_output_processor(groups, env=Environment(), **kwargs):
+    """Return a shared :class:`OutputProcessor` for the given arguments.
+
+    Processors hold no per-response state, so one can format any
+    number of responses.
+
+    """
+    key = (env, tuple(groups), tuple(sorted(kwargs.items())))
+    if key not in _output_processors:
+        _output_processors[key] = OutputProcessor(groups, env, **kwargs)
+    return _output_processors[key]
+
+
 class PygmentsProcessor(BaseProcessor):
     """A processor that applies syntax-highlighting using Pygments
     to the headers, and to the body as well if its content type is recognized.
@@ -170,29 +299,21 @@ class PygmentsProcessor(BaseProcessor):
     def __init__(self, *args, **kwargs):
         super(PygmentsProcessor, self).__init__(*args, **kwargs)
 
-        # Cache that speeds up when we process streamed body by line.
         if not self.env.colors:
             self.enabled = False
             return
 
-        try:
-            style = get_style_by_name(
-                self.kwargs.get('pygments_style', DEFAULT_STYLE))
-        except ClassNotFound:
-            style = Solarized256Style
-
-        if self.env.colors == 256:
-            fmt_class = Terminal256Formatter
-        else:
-            fmt_class = TerminalFormatter
-        self.formatter = fmt_class(style=style)
+        self.formatter = get_formatter(
+            self.kwargs.get('pygments_style', DEFAULT_STYLE),
+            self.env.colors,
+            cache_dir=self.env.cache_dir)
 
     #def process_headers(self, headers):
     #    return pygments.highlight(
     #        headers, JSONRPCLexer(), self.formatter).strip()
 
     def process_body(self, content):
-        return pygments.highlight(content, JsonLexer(), self.formatter).strip()
+        return pygments.highlight(content, _lexer, self.formatter).strip()
 
 
 class OutputProcessor(object):
@@ -202,6 +323,12 @@ class OutputProcessor(object):
         'format': [
             JSONProcessor
         ],
+        'compact': [
+            CompactJSONProcessor
+        ],
+        'ndjson': [
+            NDJSONProcessor
+        ],
         'colors': [
             PygmentsProcessor
         ]
@@ -226,3 +353,104 @@ class OutputProcessor(object):
             content = processor.process_body(content)
 
         return content
+
+    def process_response(self, value):
+        """Serialize the decoded `value` and process the resulting text.
+
+        The value is serialized just once, by the first processor that
+        knows how to, rather than dumped and then parsed and dumped again.
+
+        """
+        serializer = None
+        for processor in self.processors:
+            if hasattr(processor, 'serialize'):
+                serializer = processor
+                break
+
+        if serializer is None:
+            content = json.dumps(value)
+        else:
+            content = serializer.serialize(value)
+
+        for processor in self.processors:
+            if processor is not serializer:
+                content = processor.process_body(content)
+
+        return content
+
+
+###############################################################################
+# Parallel processing
+###############################################################################
+
+_worker_processor = None
+
+
+def _init_worker(groups, colors, cache_dir, kwargs):
+    global _worker_processor
+    env = Environment(colors=colors, cache_dir=cache_dir)
+    _worker_processor = get_output_processor(groups, env, **kwargs)
+
+
+def _process_in_worker(value):
+    return _worker_processor.process_response(value).encode('utf8')
+
+
+class ParallelProcessor(object):
+    """Serializes and processes many values with an
+    :class:`OutputProcessor`, yielding the results as `bytes` in the
+    order the values were submitted.
+
+    Processing starts in-process. With more than one of `workers`, once
+    `threshold` bytes of output have been produced, the rest of the
+    values are processed by a pool of worker processes instead, with at
+    most `max_pending` values in flight. That is off by default: sending
+    a value to a worker and the output back costs more than serializing
+    it, and pays off only for colorized output on several CPUs (see
+    ``benchmarks/parallel.py``).
+
+    The workers are spawned rather than forked, since the calls are
+    being made by other threads meanwhile.
+
+    """
+
+    def __init__(self, groups, env=Environment(), workers=None,
+                 threshold=PARALLEL_THRESHOLD, **kwargs):
+        self.processor = get_output_processor(groups, env, **kwargs)
+        self.init_args = (groups, env.colors, env.cache_dir, kwargs)
+        self.workers = workers or 0
+        self.threshold = threshold
+        self.max_pending = 16 * max(1, self.workers)
+        self.processed = 0
+        self.pending = deque()
+        self.pool = None
+
+    def submit(self, value):
+        """Queue `value`; return a list of the results ready to be written.
+
+        """
+        if self.pool is None:
+            data = self.processor.process_response(value).encode('utf8')
+            self.processed += len(data)
+            if self.processed >= self.threshold and self.workers > 1:
+                self.pool = multiprocessing.get_context('spawn').Pool(
+                    self.workers, _init_worker, self.init_args)
+            return [data]
+
+        self.pending.append(
+            self.pool.apply_async(_process_in_worker, (value,)))
+        ready = []
+        while self.pending and (self.pending[0].ready()
+                                or len(self.pending) > self.max_pending):
+            ready.append(self.pending.popleft().get())
+        return ready
+
+    def finish(self):
+        """Wait for and return the remaining results; stop the workers."""
+        ready = [result.get() for result in self.pending]
+        self.pending.clear()
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        return ready
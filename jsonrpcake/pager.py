@@ -0,0 +1,545 @@
+"""A built-in pager for browsing large responses on a terminal.
+
+Lines are generated from the decoded response on demand, by walking it,
+and only the lines on screen are ever formatted and colored. The first
+screen appears at once however large the response is, and moving around
+costs what is passed over rather than what the whole response would
+take to format. Subtrees can be collapsed, searched, and jumped to by
+their path.
+
+"""
+import os
+import json
+from io import StringIO
+
+from pygments.token import Comment, Keyword, Name, Number, Punctuation, \
+    String, Text
+
+from .diff import format_path, parse_path
+from .output import DEFAULT_INDENT, get_formatter, write
+
+
+# The width of the cursor column at the left of every line.
+GUTTER = 2
+
+# How many columns the left and right keys scroll by.
+HORIZONTAL_STEP = 20
+
+HELP = 'q quit  / ? search  n N next  : path  c collapse  g G ends'
+
+KEYS = {
+    b'\x1b[A': 'up', b'\x1bOA': 'up', b'k': 'up',
+    b'\x1b[B': 'down', b'\x1bOB': 'down', b'j': 'down', b'\r': 'down',
+    b'\n': 'down',
+    b'\x1b[C': 'right', b'\x1bOC': 'right',
+    b'\x1b[D': 'left', b'\x1bOD': 'left',
+    b'\x1b[5~': 'page_up', b'b': 'page_up',
+    b'\x1b[6~': 'page_down', b' ': 'page_down', b'f': 'page_down',
+    b'\x1b[H': 'first', b'\x1b[1~': 'first', b'g': 'first',
+    b'\x1b[F': 'last', b'\x1b[4~': 'last', b'G': 'last',
+    b'c': 'toggle', b'\t': 'toggle',
+    b'/': 'search', b'?': 'search_back', b'n': 'next', b'N': 'previous',
+    b':': 'jump', b'q': 'quit', b'Q': 'quit',
+}
+
+
+class Node(object):
+    """A value in the document, at `index` among its `parent`'s."""
+
+    __slots__ = ('value', 'key', 'parent', 'index', 'path')
+
+    def __init__(self, value, key=None, parent=None, index=0):
+        self.value = value
+        self.key = key
+        self.parent = parent
+        self.index = index
+        self.path = parent.path + (key,) if parent is not None else ()
+
+    @property
+    def is_container(self):
+        return isinstance(self.value, (dict, list)) and bool(self.value)
+
+
+class Document(object):
+    """A decoded JSON `value`, as the lines it would be pretty-printed as,
+    with some of its subtrees collapsed.
+
+    A line is a ``(node, closing)`` pair; `closing` is true for the line
+    that closes an expanded container. Lines are made as they are asked
+    for, and only ever walked from line to line.
+
+    """
+
+    def __init__(self, value, sort_keys=True):
+        self.root = Node(value)
+        self.sort_keys = sort_keys
+        self.collapsed = set()
+        self._keys = {}
+
+    def keys(self, obj):
+        """Return the keys of `obj` in the order they are shown."""
+        keys = self._keys.get(id(obj))
+        if keys is None:
+            keys = self._keys[id(obj)] = (
+                sorted(obj) if self.sort_keys else list(obj))
+        return keys
+
+    def child(self, node, index):
+        if isinstance(node.value, dict):
+            key = self.keys(node.value)[index]
+        else:
+            key = index
+        return Node(node.value[key], key, node, index)
+
+    def expanded(self, node, everything=False):
+        return node.is_container and (
+            everything or node.path not in self.collapsed)
+
+    def first(self):
+        return self.root, False
+
+    def last(self, node=None, everything=False):
+        """Return the last line of `node` (of the document by default)."""
+        node = node or self.root
+        return node, self.expanded(node, everything)
+
+    def next(self, line, everything=False):
+        """Return the line after `line`, or `None` at the end.
+
+        Collapsed subtrees are skipped unless `everything` is true.
+
+        """
+        node, closing = line
+        if not closing and self.expanded(node, everything):
+            return self.child(node, 0), False
+        parent = node.parent
+        if parent is None:
+            return None
+        if node.index + 1 < len(parent.value):
+            return self.child(parent, node.index + 1), False
+        return parent, True
+
+    def previous(self, line, everything=False):
+        """Return the line before `line`, or `None` at the start."""
+        node, closing = line
+        if closing:
+            return self.last(self.child(node, len(node.value) - 1),
+                             everything)
+        parent = node.parent
+        if parent is None:
+            return None
+        if node.index:
+            return self.last(self.child(parent, node.index - 1), everything)
+        return parent, False
+
+    def find(self, path):
+        """Return the opening line of the value at `path`, expanding the
+        subtrees it is in. Raise `ValueError` if there is none.
+
+        """
+        node = self.root
+        for key in path:
+            value = node.value
+            try:
+                if isinstance(value, dict):
+                    index = self.keys(value).index(key)
+                elif isinstance(value, list) and isinstance(key, int):
+                    index = key
+                    value[index]
+                else:
+                    raise ValueError
+            except (ValueError, IndexError):
+                raise ValueError('No such path: %s' % format_path(path))
+            self.collapsed.discard(node.path)
+            node = self.child(node, index)
+        return node, False
+
+    def toggle(self, line):
+        """Collapse or expand the container on `line`; return the line
+        that takes its place.
+
+        """
+        node, closing = line
+        if not node.is_container:
+            node = node.parent
+            if node is None:
+                return line
+        if node.path in self.collapsed:
+            self.collapsed.discard(node.path)
+        else:
+            self.collapsed.add(node.path)
+        return node, False
+
+    def count(self, limit):
+        """Return the number of lines, counting no further than `limit`."""
+        count = 0
+        line = self.first()
+        while line is not None and count < limit:
+            count += 1
+            line = self.next(line)
+        return count
+
+    def tokens(self, line, limit=None):
+        """Return the ``(token type, text)`` pieces of `line`.
+
+        Strings are cut short after about `limit` characters, if given.
+
+        """
+        node, closing = line
+        value = node.value
+        parent = node.parent
+        tokens = [(Text, ' ' * (DEFAULT_INDENT * len(node.path)))]
+        last = parent is None or node.index == len(parent.value) - 1
+
+        if closing:
+            tokens.append((Punctuation, '}' if isinstance(value, dict)
+                           else ']'))
+        else:
+            if parent is not None and isinstance(parent.value, dict):
+                tokens.append((Name.Tag, dumps(node.key, limit)))
+                tokens.append((Punctuation, ': '))
+            if isinstance(value, (dict, list)):
+                brackets = '{}' if isinstance(value, dict) else '[]'
+                if not value:
+                    tokens.append((Punctuation, brackets))
+                elif node.path in self.collapsed:
+                    tokens.append((Punctuation, brackets[0]))
+                    tokens.append((Comment, ' ... %d %s ' % (
+                        len(value), 'keys' if isinstance(value, dict)
+                        else 'items')))
+                    tokens.append((Punctuation, brackets[1]))
+                else:
+                    tokens.append((Punctuation, brackets[0]))
+                    last = True
+            elif isinstance(value, str):
+                tokens.append((String.Double, dumps(value, limit)))
+            elif value is None or isinstance(value, bool):
+                tokens.append((Keyword.Constant, dumps(value)))
+            elif isinstance(value, float):
+                tokens.append((Number.Float, dumps(value)))
+            else:
+                tokens.append((Number.Integer, dumps(value)))
+
+        if not last:
+            tokens.append((Punctuation, ','))
+        return tokens
+
+    def text(self, line):
+        return ''.join(text for _, text in self.tokens(line))
+
+
+def dumps(value, limit=None):
+    """Serialize a scalar like :class:`output.JSONProcessor` does; strings
+    longer than `limit` are cut short (and left unterminated).
+
+    """
+    if limit is not None and isinstance(value, str) and len(value) > limit:
+        return json.dumps(value[:limit], ensure_ascii=False)[:-1]
+    return json.dumps(value, ensure_ascii=False)
+
+
+def clip(tokens, start, width):
+    """Return the part of `tokens` from column `start`, `width` columns
+    wide.
+
+    """
+    clipped = []
+    column = 0
+    end = start + width
+    for ttype, text in tokens:
+        if column >= end:
+            break
+        following = column + len(text)
+        if following > start:
+            clipped.append((ttype, text[max(start - column, 0):end - column]))
+        column = following
+    return clipped
+
+
+class Terminal(object):
+    """The controlling terminal; keys are read from it, and the screen is
+    written to `outfile`.
+
+    Within a ``with`` block it is in cbreak mode, on the alternate screen.
+
+    """
+
+    def __init__(self, outfile):
+        import termios
+        self.termios = termios
+        self.outfile = outfile
+        self.fd = os.open('/dev/tty', os.O_RDWR)
+        self.saved = None
+        self.pending = b''
+
+    def __enter__(self):
+        import tty
+        self.saved = self.termios.tcgetattr(self.fd)
+        tty.setcbreak(self.fd)
+        # The alternate screen, with the cursor hidden.
+        self.write('\x1b[?1049h\x1b[?25l')
+        return self
+
+    def __exit__(self, *exc_info):
+        self.write('\x1b[?25h\x1b[?1049l')
+        self.termios.tcsetattr(self.fd, self.termios.TCSADRAIN, self.saved)
+
+    def close(self):
+        os.close(self.fd)
+
+    def size(self):
+        """Return the columns and lines of the terminal; zeros if it
+        doesn't know.
+
+        """
+        try:
+            return tuple(os.get_terminal_size(self.fd))
+        except OSError:
+            return 0, 0
+
+    def write(self, text):
+        write([text.encode('utf8')], self.outfile, flush=True)
+
+    def read_key(self):
+        """Return the next key pressed, as the bytes it sent."""
+        if not self.pending:
+            self.pending = os.read(self.fd, 1024)
+        data = self.pending
+        length = 1
+        if data[:1] == b'\x1b':
+            for length in (4, 3, len(data)):
+                # Unknown sequences are skipped whole.
+                if data[:length] in KEYS:
+                    break
+        elif data[0] >= 0xc0:
+            # A multibyte UTF-8 character.
+            length = 2 if data[0] < 0xe0 else 3 if data[0] < 0xf0 else 4
+        self.pending = data[length:]
+        return data[:length]
+
+    def prompt(self, prefix, row):
+        """Read a line typed at the bottom `row`; `None` if cancelled."""
+        typed = ''
+        while True:
+            self.write('\x1b[%d;1H\x1b[K%s%s\x1b[?25h' % (row, prefix, typed))
+            key = self.read_key().decode('utf8', 'replace')
+            self.write('\x1b[?25l')
+            if key in ('\r', '\n'):
+                return typed
+            if key.startswith('\x1b') or key == '\x03':
+                return None
+            if key in ('\x7f', '\x08'):
+                if not typed:
+                    return None
+                typed = typed[:-1]
+            elif key.isprintable():
+                typed += key
+
+
+class Pager(object):
+    """Shows a :class:`Document` on a :class:`Terminal`, and moves around
+    it as keys are pressed.
+
+    """
+
+    def __init__(self, document, terminal, formatter=None):
+        self.document = document
+        self.terminal = terminal
+        self.formatter = formatter
+        self.top = self.cursor = document.first()
+        self.column = 0
+        self.pattern = None
+        self.message = ''
+
+    def run(self):
+        while True:
+            self.render()
+            action = KEYS.get(self.terminal.read_key())
+            self.message = ''
+            if action == 'quit':
+                return
+            if action:
+                getattr(self, action)()
+
+    def height(self):
+        return self.terminal.size()[1] - 1
+
+    def render(self):
+        columns, rows = self.terminal.size()
+        width = columns - GUTTER
+        limit = self.column + width
+        document = self.document
+        out = ['\x1b[H']
+        line = self.top
+        for _ in range(rows - 1):
+            if line is not None:
+                out.append('> ' if same(line, self.cursor) else '  ')
+                out.append(self.highlight(
+                    clip(document.tokens(line, limit), self.column, width)))
+                line = document.next(line)
+            out.append('\x1b[K\r\n')
+        status = self.message or '%s    %s' % (
+            format_path(self.cursor[0].path), HELP)
+        out.append('\x1b[7m%s\x1b[K\x1b[0m' % status[:columns - 1])
+        self.terminal.write(''.join(out))
+
+    def highlight(self, tokens):
+        if self.formatter is None:
+            return ''.join(text for _, text in tokens)
+        buf = StringIO()
+        self.formatter.format(tokens, buf)
+        return buf.getvalue()
+
+    def show(self, line):
+        """Move the cursor to `line`, scrolling it into view."""
+        self.cursor = line
+        document = self.document
+        # Is it on screen already?
+        visible = self.top
+        for _ in range(self.height()):
+            if visible is None:
+                break
+            if same(visible, line):
+                return
+            visible = document.next(visible)
+        # Put it a third of the way down the screen.
+        self.top = line
+        for _ in range(self.height() // 3):
+            previous = document.previous(self.top)
+            if previous is None:
+                break
+            self.top = previous
+
+    def move(self, lines):
+        document = self.document
+        step = document.next if lines > 0 else document.previous
+        line = self.cursor
+        for _ in range(abs(lines)):
+            following = step(line)
+            if following is None:
+                break
+            line = following
+        self.show(line)
+
+    def up(self):
+        if same(self.cursor, self.top):
+            self.top = self.document.previous(self.top) or self.top
+        self.move(-1)
+
+    def down(self):
+        self.move(1)
+
+    def page_up(self):
+        for _ in range(self.height()):
+            self.top = self.document.previous(self.top) or self.top
+        self.move(-self.height())
+
+    def page_down(self):
+        document = self.document
+        line = self.top
+        for _ in range(self.height()):
+            following = document.next(line)
+            if following is None:
+                break
+            line = following
+        self.top = self.cursor = line
+
+    def left(self):
+        self.column = max(self.column - HORIZONTAL_STEP, 0)
+
+    def right(self):
+        self.column += HORIZONTAL_STEP
+
+    def first(self):
+        self.top = self.cursor = self.document.first()
+
+    def last(self):
+        self.top = self.cursor = self.document.last()
+        for _ in range(self.height() - 1):
+            self.top = self.document.previous(self.top) or self.top
+
+    def toggle(self):
+        self.cursor = self.document.toggle(self.cursor)
+        self.show(self.cursor)
+
+    def jump(self):
+        typed = self.terminal.prompt(':', self.height() + 1)
+        if not typed:
+            return
+        try:
+            self.show(self.document.find(parse_path(typed)))
+        except ValueError as e:
+            self.message = str(e)
+
+    def search(self, backwards=False):
+        typed = self.terminal.prompt('?' if backwards else '/',
+                                     self.height() + 1)
+        if typed:
+            self.pattern = typed
+        if self.pattern:
+            self.find(backwards)
+
+    def search_back(self):
+        self.search(backwards=True)
+
+    def next(self):
+        if self.pattern:
+            self.find()
+
+    def previous(self):
+        if self.pattern:
+            self.find(backwards=True)
+
+    def find(self, backwards=False):
+        """Move to the next line matching the search pattern, looking in
+        collapsed subtrees too. Case is ignored unless the pattern has
+        capitals.
+
+        """
+        pattern = self.pattern
+        ignore_case = pattern == pattern.lower()
+        document = self.document
+        step = document.previous if backwards else document.next
+        line = step(self.cursor, everything=True)
+        while line is not None:
+            text = document.text(line)
+            if pattern in (text.lower() if ignore_case else text):
+                node, closing = line
+                document.find(node.path)
+                if closing:
+                    document.collapsed.discard(node.path)
+                self.show(line)
+                return
+            line = step(line, everything=True)
+        self.message = 'Pattern not found: %s' % pattern
+
+
+def same(a, b):
+    return a[1] == b[1] and a[0].path == b[0].path
+
+
+def page(args, env, response):
+    """Show `response` in the pager, if it doesn't fit on the terminal.
+
+    Return `False` if it wasn't shown (it fits, or there is no terminal
+    to read keys from).
+
+    """
+    try:
+        terminal = Terminal(env.stdout)
+    except (ImportError, OSError):
+        return False
+    try:
+        document = Document(response)
+        columns, rows = terminal.size()
+        if columns <= GUTTER or rows < 2 or document.count(rows) < rows:
+            return False
+        formatter = None
+        if 'colors' in args.prettify and env.colors:
+            formatter = get_formatter(args.style, env.colors,
+                                      env.cache_dir)
+        with terminal:
+            Pager(document, terminal, formatter).run()
+    finally:
+        terminal.close()
+    return True
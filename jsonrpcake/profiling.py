@@ -0,0 +1,277 @@
+"""Profiling of a whole invocation: ``--profile``.
+
+The invocation runs under :mod:`cProfile` (and :mod:`tracemalloc` with
+``--profile-memory``). The time spent is then summarized by phase.
+
+"""
+from __future__ import division
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+
+
+PHASES = ('parse', 'network', 'decode', 'format', 'write', 'import',
+          'other')
+
+# ``(phase, path fragment, function name or None)``, first match wins.
+# A path of ``~`` matches built-in functions by name prefix.
+# Functions that don't match are attributed to the phases of their
+# callers.
+PHASE_RULES = (
+    ('write', 'jsonrpcake/output.py', 'write'),
+    ('write', 'jsonrpcake/sink.py', '_write_lines'),
+    # Writes to files, not to in-memory buffers.
+    ('write', '~', "<method 'write' of '_io.Buffered"),
+    ('write', '~', "<method 'write' of '_io.TextIOWrapper'"),
+    ('write', '~', "<method 'write' of '_io.FileIO'"),
+    ('write', '~', "<method 'flush' of '_io.Buffered"),
+    ('write', '~', "<method 'flush' of '_io.TextIOWrapper'"),
+    ('decode', 'json/decoder.py', None),
+    ('decode', 'json/__init__.py', 'loads'),
+    ('parse', 'jsonrpcake/input.py', None),
+    ('parse', 'jsonrpcake/cli.py', None),
+    ('parse', 'argparse.py', None),
+    ('network', 'jsonrpcake/transport.py', None),
+    ('network', 'jsonrpcake/client.py', None),
+    ('network', 'jsonrpcake/balancer.py', None),
+    ('format', 'jsonrpcake/output.py', None),
+    ('format', 'jsonrpcake/diff.py', None),
+    ('format', 'pygments', None),
+    ('import', '<frozen importlib', None),
+)
+
+# How many functions are listed in the summary.
+TOP_FUNCTIONS = 15
+
+# How many allocation sites are listed with ``--profile-memory``.
+TOP_ALLOCATIONS = 5
+
+
+def match_phase(func):
+    """Return the phase a pstats `func` key belongs to on its own, or
+    `None`.
+
+    """
+    filename, _, name = func
+    filename = filename.replace('\\', '/')
+    for phase, path, function in PHASE_RULES:
+        if path == '~':
+            # Built-in functions, e.g., "<method 'write' of ...>".
+            if filename == '~' and name.startswith(function):
+                return phase
+        elif path in filename and function in (None, name):
+            return phase
+    return None
+
+
+def attribute_phases(stats):
+    """Return a `dict` with the self time spent in each phase.
+
+    Functions that don't belong to a phase on their own are attributed
+    to the phases of their callers, in proportion to the time spent
+    under each caller.
+
+    """
+    shares = {}
+
+    def share(func, visiting):
+        # Returns an empty `dict` if all callers are cut off as cycles.
+        if func in shares:
+            return shares[func]
+        phase = match_phase(func)
+        if phase is not None:
+            shares[func] = {phase: 1.0}
+            return shares[func]
+        callers = [(caller, edge[3])
+                   for caller, edge in stats.stats[func][4].items()
+                   if caller in stats.stats]
+        if not callers:
+            shares[func] = {'other': 1.0}
+            return shares[func]
+        result = {}
+        total = 0.0
+        visiting.add(func)
+        for caller, weight in callers:
+            caller_share = share(caller, visiting) if (
+                caller not in visiting) else None
+            if caller_share:
+                # Calls too short to be timed still count a little.
+                weight = max(weight, 1e-9)
+                total += weight
+                for phase, fraction in caller_share.items():
+                    result[phase] = result.get(phase, 0.0) + fraction * weight
+        visiting.discard(func)
+        if result:
+            shares[func] = result = dict(
+                (phase, value / total) for phase, value in result.items())
+        return result
+
+    phases = dict.fromkeys(PHASES, 0.0)
+    for func, (_, _, tottime, _, _) in stats.stats.items():
+        for phase, fraction in (share(func, set())
+                                or {'other': 1.0}).items():
+            phases[phase] += tottime * fraction
+    return phases
+
+
+def func_label(func):
+    filename, lineno, name = func
+    if filename == '~':
+        return name
+    return '%s:%d(%s)' % (filename, lineno, name)
+
+
+def to_speedscope(stats, name='jsonrpc'):
+    """Return `stats` as a speedscope profile (a `dict`).
+
+    cProfile doesn't record whole stacks, so every function gets one
+    sample, weighted by its self time, whose stack follows the callers
+    that took the most time.
+
+    """
+    frames = []
+    index = {}
+
+    def frame(func):
+        if func not in index:
+            index[func] = len(frames)
+            frames.append({'name': func[2], 'file': func[0],
+                           'line': func[1]})
+        return index[func]
+
+    samples = []
+    weights = []
+    for func, (_, _, tottime, _, _) in stats.stats.items():
+        if not tottime:
+            continue
+        stack = [func]
+        while True:
+            callers = [(edge[3], caller) for caller, edge
+                       in stats.stats[stack[-1]][4].items()
+                       if caller in stats.stats and caller not in stack]
+            if not callers:
+                break
+            stack.append(max(callers)[1])
+        samples.append([frame(f) for f in reversed(stack)])
+        weights.append(tottime)
+
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'seconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights,
+        }],
+    }
+
+
+class Profiler(object):
+    """Profile everything between :meth:`start` and :meth:`stop`,
+    including threads started in between.
+
+    With `memory`, allocations are traced as well, to report the peak
+    memory use. The profile is saved to `output` by :meth:`dump`, if set.
+
+    """
+
+    def __init__(self, memory=False, output=None):
+        self.memory = memory
+        self.output = output
+        self.profile = cProfile.Profile()
+        self.thread_profiles = []
+        self.lock = threading.Lock()
+        self.started = None
+        self.elapsed = None
+        self.peak_memory = None
+        self.allocations = None
+
+    def _profile_thread(self, frame, event, arg):
+        # Called once in every new thread; enabling a profiler there
+        # replaces this hook.
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+: the main profiler already covers all threads.
+            return
+        with self.lock:
+            self.thread_profiles.append(profile)
+
+    def start(self):
+        if self.memory:
+            tracemalloc.start()
+        self.started = time.time()
+        threading.setprofile(self._profile_thread)
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+        threading.setprofile(None)
+        self.elapsed = time.time() - self.started
+        if self.memory:
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            self.allocations = tracemalloc.take_snapshot().statistics(
+                'lineno')[:TOP_ALLOCATIONS]
+            tracemalloc.stop()
+
+    def stats(self):
+        stats = pstats.Stats(self.profile)
+        with self.lock:
+            for profile in self.thread_profiles:
+                stats.add(profile)
+        return stats
+
+    def report(self, stats=None):
+        """Return a summary of the time spent by phase, the functions
+        with the most self time and, with `memory`, the peak memory use.
+
+        """
+        stats = stats or self.stats()
+        phases = attribute_phases(stats)
+        profiled = sum(phases.values())
+        lines = ['profile: %.3f s wall, %.3f s profiled'
+                 % (self.elapsed, profiled)]
+        for phase in PHASES:
+            lines.append('  %-8s %9.3f s %6.1f%%' % (
+                phase, phases[phase],
+                phases[phase] / profiled * 100 if profiled else 0))
+
+        lines.append('top functions by self time:')
+        top = sorted(stats.stats.items(), key=lambda item: item[1][2],
+                     reverse=True)[:TOP_FUNCTIONS]
+        for func, (_, calls, tottime, cumtime, _) in top:
+            lines.append('  %9.3f s %9.3f s cum %8d calls  %s' % (
+                tottime, cumtime, calls, func_label(func)))
+
+        if self.peak_memory is not None:
+            lines.append('peak memory: %.1f MiB'
+                         % (self.peak_memory / (1 << 20)))
+            lines.append('largest allocations still live at exit:')
+            for stat in self.allocations:
+                frame = stat.traceback[0]
+                lines.append('  %9.1f KiB %8d blocks  %s:%d' % (
+                    stat.size / 1024, stat.count,
+                    frame.filename, frame.lineno))
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, stats=None):
+        """Write the profile to ``self.output``: in the speedscope format
+        if it ends with ``.json``, otherwise as :mod:`pstats` data.
+
+        """
+        path = self.output
+        stats = stats or self.stats()
+        if path.endswith('.json'):
+            with open(path, 'w') as f:
+                json.dump(to_speedscope(stats), f)
+        else:
+            stats.dump_stats(path)
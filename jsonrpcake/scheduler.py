@@ -0,0 +1,270 @@
+"""Throttling and concurrency control for multi-call modes.
+
+"""
+from __future__ import division
+import time
+import queue
+import socket
+import threading
+
+import jsonrpc_ns
+
+
+# JSON-RPC error codes that indicate an overloaded or failing server
+# rather than a bad request: internal error and the "server error" range.
+BACKOFF_ERROR_CODES = frozenset([-32603] + list(range(-32099, -31999)))
+
+# How often (in seconds) the progress line is redrawn.
+PROGRESS_INTERVAL = 0.2
+
+# Weight of the latest call duration in the moving average used to
+# predict whether a call can still finish before the deadline.
+DURATION_EWMA_ALPHA = 0.2
+
+
+def is_backoff_error(error):
+    """Return `True` if `error` signals that we should slow down."""
+    if isinstance(error, socket.timeout):
+        return True
+    if isinstance(error, jsonrpc_ns.JSONRPCResponseError):
+        return error.value.get('code') in BACKOFF_ERROR_CODES
+    return False
+
+
+class TokenBucket(object):
+    """A thread-safe token bucket.
+
+    Tokens are added at `rate` per second up to `burst`. Each call to
+    :meth:`acquire` takes one token, blocking until one is available.
+
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = max(1, burst or int(rate) or 1)
+        self.tokens = self.burst
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill(time.time())
+            self.rate = rate
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                self._refill(time.time())
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class Backoff(object):
+    """Additive-increase/multiplicative-decrease throttle factor.
+
+    The factor is in ``(floor, 1]`` and scales both the call rate and
+    the number of calls in flight. It is halved when the share of
+    backoff errors in the recent `window` of calls exceeds `threshold`,
+    and recovers slowly as calls succeed.
+
+    """
+
+    def __init__(self, window=20, threshold=0.1, floor=1 / 64):
+        self.window = window
+        self.threshold = threshold
+        self.floor = floor
+        self.factor = 1.0
+        self.recent = []
+
+    def record(self, error):
+        """Record the outcome of a call; return `True` if the factor changed.
+
+        """
+        self.recent.append(is_backoff_error(error))
+        if len(self.recent) < self.window:
+            return False
+        bad = sum(self.recent) / len(self.recent)
+        self.recent = []
+        factor = self.factor
+        if bad > self.threshold:
+            self.factor = max(self.floor, self.factor / 2)
+        else:
+            self.factor = min(1.0, self.factor + 0.1)
+        return self.factor != factor
+
+
+class Progress(object):
+    """Live progress and effective call rate written to ``env.stderr``."""
+
+    def __init__(self, env, total=None):
+        self.env = env
+        self.total = total
+        self.started = time.time()
+        self.drawn = 0
+        self.done = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.factor = 1.0
+
+    @property
+    def rate(self):
+        elapsed = time.time() - self.started
+        return self.done / elapsed if elapsed else 0.0
+
+    def summary(self):
+        done = str(self.done)
+        if self.total is not None:
+            done += '/%d' % self.total
+        line = '%s calls  %.1f/s  %d errors  %d in flight' % (
+            done, self.rate, self.errors, self.in_flight)
+        if self.factor < 1:
+            line += '  backoff x%.2f' % self.factor
+        return line
+
+    def update(self, force=False):
+        if not self.env.stderr_isatty:
+            return
+        now = time.time()
+        if force or now - self.drawn >= PROGRESS_INTERVAL:
+            self.drawn = now
+            self.env.stderr.write('\r\x1b[K' + self.summary())
+            self.env.stderr.flush()
+
+    def finish(self):
+        if self.env.stderr_isatty:
+            self.env.stderr.write('\r\x1b[K')
+        self.env.stderr.write(self.summary() + '\n')
+
+
+class Scheduler(object):
+    """Run calls concurrently under a rate limit and an in-flight limit.
+
+    Both limits are scaled down by a :class:`Backoff` when the server
+    starts timing out or responding with server errors.
+
+    With a `deadline` (a :func:`time.time` value), no call is started
+    unless it is expected to finish in time, judging by how long calls
+    have been taking. ``skipped`` tells whether any calls were left out.
+
+    An exception raised by the `jobs` iterator given to :meth:`map`
+    stops the calls and is raised by :meth:`map` once the calls already
+    started are done.
+
+    """
+
+    def __init__(self, rate=None, burst=None, max_in_flight=1,
+                 backoff=True, progress=None, deadline=None):
+        self.rate = rate
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.max_in_flight = max(1, max_in_flight)
+        self.backoff = Backoff() if backoff else None
+        self.progress = progress
+        self.deadline = deadline
+        self.duration = 0.0
+        self.skipped = False
+        # What the jobs iterator raised, if anything.
+        self.error = None
+        self.in_flight = 0
+        self.cond = threading.Condition()
+
+    @property
+    def limit(self):
+        factor = self.backoff.factor if self.backoff else 1.0
+        return max(1, int(self.max_in_flight * factor))
+
+    def _record(self, error, duration):
+        with self.cond:
+            self.in_flight -= 1
+            self.duration += DURATION_EWMA_ALPHA * (duration - self.duration)
+            if self.backoff and self.backoff.record(error):
+                if self.bucket:
+                    self.bucket.set_rate(self.rate * self.backoff.factor)
+            if self.progress:
+                self.progress.done += 1
+                self.progress.errors += error is not None
+                self.progress.in_flight = self.in_flight
+                self.progress.factor = (self.backoff.factor
+                                        if self.backoff else 1.0)
+            self.cond.notify_all()
+
+    def _produce(self, jobs, pending):
+        try:
+            for job in jobs:
+                with self.cond:
+                    while self.in_flight >= self.limit:
+                        self.cond.wait()
+                    self.in_flight += 1
+                if self.bucket:
+                    self.bucket.acquire()
+                if (self.deadline is not None
+                        and time.time() + self.duration > self.deadline):
+                    with self.cond:
+                        self.in_flight -= 1
+                    self.skipped = True
+                    break
+                pending.put(job)
+        except Exception as e:
+            self.error = e
+        finally:
+            for _ in range(self.max_in_flight):
+                pending.put(_DONE)
+
+    def _work(self, func, pending, results):
+        while True:
+            job = pending.get()
+            if job is _DONE:
+                results.put(_DONE)
+                return
+            started = time.time()
+            try:
+                result, error = func(job), None
+            except Exception as e:
+                result, error = None, e
+            self._record(error, time.time() - started)
+            results.put((job, result, error))
+
+    def map(self, func, jobs):
+        """Call ``func(job)`` for every job in `jobs`.
+
+        Yield ``(job, result, error)`` tuples in completion order,
+        where `error` is the exception raised by `func`, if any.
+
+        """
+        # Bounded queues propagate backpressure from a slow consumer
+        # all the way back to the producer.
+        pending = queue.Queue(self.max_in_flight)
+        results = queue.Queue(self.max_in_flight)
+        threads = [threading.Thread(target=self._produce,
+                                    args=(jobs, pending))]
+        threads.extend(threading.Thread(target=self._work,
+                                        args=(func, pending, results))
+                       for _ in range(self.max_in_flight))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        running = self.max_in_flight
+        while running:
+            item = results.get()
+            if item is _DONE:
+                running -= 1
+                continue
+            if self.progress:
+                self.progress.update()
+            yield item
+
+        if self.progress:
+            self.progress.finish()
+        if self.error is not None:
+            raise self.error
+
+
+_DONE = object()
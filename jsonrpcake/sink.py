@@ -0,0 +1,139 @@
+"""Streaming, bounded-memory output of multi-call results.
+
+Every result is written as soon as it is available as one line of
+NDJSON. Nothing is kept around after it has been written, so memory use
+doesn't grow with the number of calls.
+
+"""
+import json
+import threading
+
+
+class RotatingFile(object):
+    """A binary file that moves on to a new segment once it exceeds
+    `max_bytes`.
+
+    Segments are named ``PATH``, ``PATH.1``, ``PATH.2``, etc. Writes
+    are never split across segments.
+
+    """
+
+    def __init__(self, fd, max_bytes):
+        self.fd = fd
+        self.path = fd.name
+        self.max_bytes = max_bytes
+        self.segment = 0
+        self.size = fd.tell()
+
+    def write(self, data):
+        if self.size and self.size + len(data) > self.max_bytes:
+            self.fd.close()
+            self.segment += 1
+            self.fd = open('%s.%d' % (self.path, self.segment), 'wb')
+            self.size = 0
+        self.fd.write(data)
+        self.size += len(data)
+
+    def flush(self):
+        self.fd.flush()
+
+    def close(self):
+        self.fd.close()
+
+
+class ResultSink(object):
+    """Write results as NDJSON records to `outfile`.
+
+    Each record mirrors a JSON-RPC response: ``{"id": N, "result": ...}``
+    or ``{"id": N, "error": {...}}``, where ``N`` is the position of the
+    call in the input.
+
+    With `ordered`, records are written in input order. Out-of-order
+    results are held in a reorder buffer of at most `window` entries;
+    :meth:`gate` keeps the producer from running further ahead than that.
+
+    Records are serialized (and processed) by `processor`, an
+    :class:`output.ParallelProcessor`, if given.
+
+    Writing is synchronous, so a slow `outfile` holds up the consumer,
+    which in turn holds up the scheduler (backpressure).
+
+    """
+
+    def __init__(self, outfile, flush=False, ordered=False, window=1000,
+                 processor=None):
+        # Writing bytes so we use the buffer interface (Python 3).
+        self.outfile = getattr(outfile, 'buffer', outfile)
+        self.flush = flush
+        self.ordered = ordered
+        self.window = window
+        self.processor = processor
+        self.buffer = {}
+        self.next_index = 0
+        self.cond = threading.Condition()
+
+    def gate(self, jobs):
+        """Yield ``(index, job)`` for `jobs`, blocking while the
+        reorder buffer is full.
+
+        """
+        for index, job in enumerate(jobs):
+            if self.ordered:
+                with self.cond:
+                    while index - self.next_index >= self.window:
+                        self.cond.wait()
+            yield index, job
+
+    def add(self, index, result=None, error=None):
+        """Write (or buffer, if ordered) the record for call `index`."""
+        record = {'id': index}
+        if error is not None:
+            record['error'] = error
+        else:
+            record['result'] = result
+        self._put(index, record)
+
+    def skip(self, index):
+        """Mark call `index` as producing no record."""
+        self._put(index, None)
+
+    def _put(self, index, record):
+        if not self.ordered:
+            if record is not None:
+                self._write(record)
+            return
+        with self.cond:
+            self.buffer[index] = record
+            while self.next_index in self.buffer:
+                record = self.buffer.pop(self.next_index)
+                if record is not None:
+                    self._write(record)
+                self.next_index += 1
+            self.cond.notify_all()
+
+    def _write(self, record):
+        if self.processor:
+            lines = self.processor.submit(record)
+        else:
+            lines = [json.dumps(record, ensure_ascii=False).encode('utf8')]
+        self._write_lines(lines)
+
+    def _write_lines(self, lines):
+        for line in lines:
+            self.outfile.write(line + b'\n')
+        if lines and self.flush:
+            self.outfile.flush()
+
+    def close(self):
+        if self.processor:
+            self._write_lines(self.processor.finish())
+        self.outfile.flush()
+        if isinstance(self.outfile, RotatingFile):
+            self.outfile.close()
+
+
+def open_output(args, env):
+    """Return the file multi-call results should be written to."""
+    if args.output_file and args.rotate_size:
+        return RotatingFile(args.output_file, args.rotate_size)
+    return env.stdout
@@ -0,0 +1,396 @@
+"""Querying saved responses (``--open``) without parsing them whole.
+
+The saved JSON is memory-mapped, and scanned once to build an index of
+its objects and arrays: where each starts and ends, how many members it
+has, and where every `CHECKPOINT_INTERVAL`-th member of large ones
+starts. The index is cached on disk, keyed by the file's name, size and
+modification time, so later queries only read the byte ranges on the way
+to the value asked for, and decode just that value.
+
+"""
+from __future__ import division
+import os
+import re
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import tempfile
+from array import array
+from bisect import bisect_left
+
+from .diff import format_path, parse_path
+from .output import build_output_stream, write
+from .utils import humanize_bytes
+from . import ExitStatus
+
+
+# Large containers record where every this many members start, so that
+# a member can be found without scanning the ones before it.
+CHECKPOINT_INTERVAL = 1024
+
+# How many items of an array a summary lists.
+SUMMARY_ITEMS = 10
+
+# Bumped whenever the index layout changes.
+INDEX_VERSION = 1
+
+INDEX_MAGIC = b'JRPCIDX' + str(INDEX_VERSION).encode('ascii')
+
+# The number of containers and of checkpoints, after the magic.
+INDEX_HEADER = struct.Struct('=qq')
+
+_TOKEN_RE = re.compile(br'''
+    ("[^"\\]*(?:\\.[^"\\]*)*")  # 1: a string
+    | ([\[{])                   # 2: an opening bracket
+    | (,)                       # 3: a separator
+    | ([\]}])                   # 4: a closing bracket
+''', re.VERBOSE)
+_STRING, _OPEN, _COMMA, _CLOSE = 1, 2, 3, 4
+
+_STRING_RE = re.compile(br'"[^"\\]*(?:\\.[^"\\]*)*"')
+_SCALAR_RE = re.compile(br'[^ \t\n\r,\]}]+')
+_WHITESPACE_RE = re.compile(br'[ \t\n\r]*')
+
+_BRACKETS = {ord('{'): ord('}'), ord('['): ord(']')}
+
+
+class StoreError(ValueError):
+    """The file isn't a single JSON value, or a path isn't in it."""
+
+
+class Index(object):
+    """The containers of a JSON text, in the order they open.
+
+    ``starts[i]`` and ``ends[i]`` are the offsets of the brackets of
+    container `i` and ``counts[i]`` its number of members. If it has more
+    than `CHECKPOINT_INTERVAL` members, ``checkpoints[marks[i] + j]`` is
+    where member ``(j + 1) * CHECKPOINT_INTERVAL`` starts (``-1`` marks
+    none).
+
+    """
+
+    def __init__(self, starts, ends, counts, marks, checkpoints):
+        self.starts = starts
+        self.ends = ends
+        self.counts = counts
+        self.marks = marks
+        self.checkpoints = checkpoints
+
+    @classmethod
+    def build(cls, data):
+        """Scan the JSON text `data` (e.g., an `mmap`) and index it."""
+        starts, ends = array('q'), array('q')
+        counts, marks = array('q'), array('q')
+        checkpoints = array('q')
+        # [container, separators so far, has a member, checkpoints]
+        stack = []
+        for match in _TOKEN_RE.finditer(data):
+            token = match.lastindex
+            if token == _STRING:
+                if stack:
+                    stack[-1][2] = True
+            elif token == _OPEN:
+                if stack:
+                    stack[-1][2] = True
+                stack.append([len(starts), 0, False, []])
+                starts.append(match.start())
+                ends.append(-1)
+                counts.append(0)
+                marks.append(-1)
+            elif token == _COMMA:
+                if not stack:
+                    raise StoreError('Not a single JSON value')
+                top = stack[-1]
+                top[1] += 1
+                if not top[1] % CHECKPOINT_INTERVAL:
+                    top[3].append(match.end())
+            else:
+                end = match.start()
+                if not stack:
+                    raise StoreError('Unbalanced %r at byte %d'
+                                     % (data[end:end + 1], end))
+                i, separators, nonempty, marked = stack.pop()
+                if _BRACKETS[data[starts[i]]] != data[end]:
+                    raise StoreError('Mismatched %r at byte %d'
+                                     % (data[end:end + 1], end))
+                ends[i] = end
+                if separators or nonempty or data[starts[i] + 1:end].strip():
+                    counts[i] = separators + 1
+                if marked:
+                    marks[i] = len(checkpoints)
+                    checkpoints.extend(marked)
+        if stack:
+            raise StoreError('Truncated JSON: %d unclosed containers'
+                             % len(stack))
+        return cls(starts, ends, counts, marks, checkpoints)
+
+    def dump(self, f):
+        f.write(INDEX_MAGIC)
+        f.write(INDEX_HEADER.pack(len(self.starts), len(self.checkpoints)))
+        for values in (self.starts, self.ends, self.counts, self.marks,
+                       self.checkpoints):
+            values.tofile(f)
+
+    @classmethod
+    def load(cls, f):
+        """Return the index dumped to file `f`, memory-mapped."""
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if data[:len(INDEX_MAGIC)] != INDEX_MAGIC:
+            raise ValueError('Not an index')
+        offset = len(INDEX_MAGIC)
+        containers, checkpoints = INDEX_HEADER.unpack_from(data, offset)
+        offset += INDEX_HEADER.size
+        view = memoryview(data)
+        arrays = []
+        for length in (containers,) * 4 + (checkpoints,):
+            size = length * 8
+            if offset + size > len(data):
+                raise ValueError('Truncated index')
+            arrays.append(view[offset:offset + size].cast('q'))
+            offset += size
+        return cls(*arrays)
+
+    def find(self, start):
+        """Return the container that opens at offset `start`."""
+        i = bisect_left(self.starts, start)
+        if i == len(self.starts) or self.starts[i] != start:
+            raise StoreError('No container at byte %d' % start)
+        return i
+
+
+def load_index(filename, data, cache_dir):
+    """Return the index of `data`, the contents of `filename`, from the
+    cache in `cache_dir` if it is there, building (and caching) it if not.
+
+    """
+    if not cache_dir:
+        return Index.build(data)
+    stat = os.stat(filename)
+    key = '%s\0%d\0%d\0%d\0%s' % (
+        os.path.realpath(filename), stat.st_size, stat.st_mtime_ns,
+        CHECKPOINT_INTERVAL, sys.byteorder)
+    directory = os.path.join(cache_dir, 'indexes')
+    cached = os.path.join(
+        directory, hashlib.sha1(key.encode('utf8')).hexdigest() + '.idx')
+    try:
+        with open(cached, 'rb') as f:
+            return Index.load(f)
+    except (IOError, OSError, ValueError):
+        pass
+    index = Index.build(data)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            index.dump(f)
+        os.replace(tmp, cached)
+    except (IOError, OSError):
+        pass
+    return index
+
+
+class Node(object):
+    """A value in the store: the bytes from `start` to `end`, and its
+    `container` number in the index if it is an object or an array.
+
+    """
+
+    __slots__ = ('start', 'end', 'container')
+
+    def __init__(self, start, end, container=None):
+        self.start = start
+        self.end = end
+        self.container = container
+
+    @property
+    def size(self):
+        return self.end - self.start
+
+
+class Store(object):
+    """A saved JSON value in `filename`, memory-mapped and indexed."""
+
+    def __init__(self, filename, cache_dir=None):
+        self.filename = filename
+        with open(filename, 'rb') as f:
+            try:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise StoreError('%s is empty' % filename)
+        self.index = load_index(filename, self.data, cache_dir)
+        self.root = self._node(self._skip(0))
+        if self._skip(self.root.end) != len(self.data):
+            raise StoreError('%s holds more than a single JSON value'
+                             % filename)
+
+    def _skip(self, pos):
+        return _WHITESPACE_RE.match(self.data, pos).end()
+
+    def _node(self, pos):
+        """Return the value starting at offset `pos`."""
+        data = self.data
+        if pos >= len(data):
+            raise StoreError('Truncated JSON at byte %d' % pos)
+        if data[pos] in _BRACKETS:
+            i = self.index.find(pos)
+            return Node(pos, self.index.ends[i] + 1, i)
+        match = (_STRING_RE if data[pos:pos + 1] == b'"'
+                 else _SCALAR_RE).match(data, pos)
+        if not match:
+            raise StoreError('Invalid JSON at byte %d' % pos)
+        return Node(pos, match.end())
+
+    def _after(self, node):
+        """Return the offset of the member after `node`, or `None` if it
+        was the last one.
+
+        """
+        pos = self._skip(node.end)
+        if self.data[pos:pos + 1] == b',':
+            return self._skip(pos + 1)
+        return None
+
+    def kind(self, node):
+        first = self.data[node.start:node.start + 1]
+        if first == b'{':
+            return 'object'
+        if first == b'[':
+            return 'array'
+        if first == b'"':
+            return 'string'
+        if first in (b't', b'f'):
+            return 'boolean'
+        if first == b'n':
+            return 'null'
+        return 'number'
+
+    def count(self, node):
+        return self.index.counts[node.container]
+
+    def members(self, node):
+        """Yield the ``(key, value node)`` members of the object `node`."""
+        if not self.count(node):
+            return
+        data = self.data
+        pos = self._skip(node.start + 1)
+        while pos is not None:
+            match = _STRING_RE.match(data, pos)
+            if not match:
+                raise StoreError('Invalid object key at byte %d' % pos)
+            key = json.loads(match.group().decode('utf8'))
+            pos = self._skip(match.end())
+            if data[pos:pos + 1] != b':':
+                raise StoreError('Expected ":" at byte %d' % pos)
+            value = self._node(self._skip(pos + 1))
+            yield key, value
+            pos = self._after(value)
+
+    def items(self, node, first=0):
+        """Yield the item nodes of the array `node`, from item `first`."""
+        count = self.count(node)
+        if first >= count:
+            return
+        # Start from the nearest checkpoint.
+        skip = first
+        pos = self._skip(node.start + 1)
+        checkpoint = first // CHECKPOINT_INTERVAL
+        if checkpoint:
+            mark = self.index.marks[node.container]
+            pos = self._skip(self.index.checkpoints[mark + checkpoint - 1])
+            skip -= checkpoint * CHECKPOINT_INTERVAL
+        while pos is not None:
+            item = self._node(pos)
+            if skip:
+                skip -= 1
+            else:
+                yield item
+            pos = self._after(item)
+
+    def find(self, path):
+        """Return the node at `path` (a sequence of keys and indices)."""
+        node = self.root
+        for depth, key in enumerate(path):
+            kind = self.kind(node)
+            found = None
+            if kind == 'object' and not isinstance(key, int):
+                for member, value in self.members(node):
+                    if member == key:
+                        found = value
+                        break
+            elif kind == 'array' and isinstance(key, int):
+                found = next(self.items(node, key), None)
+            if found is None:
+                raise StoreError('No such path: %s'
+                                 % format_path(path[:depth + 1]))
+            node = found
+        return node
+
+    def decode(self, node):
+        """Return the decoded value of `node`."""
+        return json.loads(self.data[node.start:node.end].decode('utf8'))
+
+    def describe(self, node):
+        """Return the kind, the member count (if any) and the size of
+        `node`, as text.
+
+        """
+        kind = self.kind(node)
+        if kind == 'object':
+            count = '%d keys' % self.count(node)
+        elif kind == 'array':
+            count = '%d items' % self.count(node)
+        else:
+            count = ''
+        return '%-8s %-14s %s' % (kind, count, humanize_bytes(node.size, 1))
+
+    def summary(self, path):
+        """Yield lines describing the value at `path` and its members."""
+        node = self.find(path)
+        yield '%s  %s' % (format_path(path), self.describe(node))
+        kind = self.kind(node)
+        if kind == 'object':
+            for key, value in self.members(node):
+                yield '%s  %s' % (format_path(list(path) + [key]),
+                                  self.describe(value))
+        elif kind == 'array':
+            for i, item in enumerate(self.items(node)):
+                if i == SUMMARY_ITEMS:
+                    yield '... %d more' % (self.count(node) - SUMMARY_ITEMS)
+                    break
+                yield '%s  %s' % (format_path(list(path) + [i]),
+                                  self.describe(item))
+
+    def close(self):
+        self.data.close()
+
+
+def run_open(args, env, error):
+    """Write the value at ``args.path`` in the saved response
+    ``args.open`` (the whole of it by default), or with ``--summary``
+    describe it and its members.
+
+    """
+    try:
+        path = parse_path(args.path or '$')
+        store = Store(args.open, env.cache_dir)
+    except (ValueError, IOError, OSError) as e:
+        error('%s', e)
+        return ExitStatus.ERROR
+    try:
+        if args.summary:
+            lines = store.summary(path)
+            write((('%s\n' % line).encode('utf8') for line in lines),
+                  env.stdout, env.stdout_isatty)
+        else:
+            value = store.decode(store.find(path))
+            write(build_output_stream(args, env, None, value),
+                  env.stdout, env.stdout_isatty)
+    except StoreError as e:
+        error('%s', e)
+        return ExitStatus.ERROR
+    finally:
+        store.close()
+    return ExitStatus.OK
@@ -0,0 +1,363 @@
+"""Incremental scanning of JSON-RPC responses as they are received.
+
+A :class:`ResponseScanner` is fed a response in chunks. The JSON text of
+its ``result`` is passed on as soon as it arrives, written as the compact
+output processors write it, so that it can be written out before the
+rest of the response has been received, and without ever holding all of
+it in memory. The other members of the response are small and are
+decoded.
+
+"""
+import re
+import json
+
+import jsonrpc_ns
+
+
+RESULT = 'result'
+
+_WHITESPACE = b' \t\n\r'
+_WHITESPACE_RE = re.compile(br'[ \t\n\r]+')
+# Outside strings, the characters that change the nesting or start one.
+_STRUCTURE_RE = re.compile(br'["\[\]{}]')
+# Inside strings, the characters that end one or escape the next.
+_STRING_RE = re.compile(br'["\\]')
+# What ends a number or literal that isn't inside an array or object.
+_SCALAR_END_RE = re.compile(br'[ \t\n\r,\]}]')
+# Numbers that may be written differently once decoded and encoded again
+# (fractions, exponents and negative zero), and a number that may go on
+# in the next chunk.
+_NUMBER_RE = re.compile(br'-?[0-9]+(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?')
+_NUMBER_TAIL_RE = re.compile(br'[-+.eE0-9]+$')
+
+# Scanner states.
+START, KEY, KEY_STRING, COLON, VALUE, AFTER_VALUE, END = range(7)
+
+# The canonical forms of the escapes seen, up to this many.
+MAX_CACHED_ESCAPES = 4096
+_escapes = {}
+
+
+def bad_response(message):
+    return jsonrpc_ns.JSONRPCBadResponse(
+        'Failed to parse response: %s' % message)
+
+
+def canonical(text):
+    """Return the JSON `text` (`bytes`) of a value as it is written when
+    decoded and encoded again by the compact output processors.
+
+    """
+    try:
+        value = json.loads(text.decode('utf8'))
+    except ValueError as e:
+        raise bad_response(e)
+    return json.dumps(value, ensure_ascii=False).encode(
+        'utf8', 'surrogatepass')
+
+
+def canonical_escape(escape):
+    """Return the canonical form of a string `escape` sequence."""
+    escape = bytes(escape)
+    result = _escapes.get(escape)
+    if result is None:
+        result = canonical(b'"' + escape + b'"')[1:-1]
+        if len(_escapes) < MAX_CACHED_ESCAPES:
+            _escapes[escape] = result
+    return result
+
+
+def canonical_number(match):
+    number = match.group()
+    if b'.' in number or b'e' in number or b'E' in number or (
+            number == b'-0'):
+        return canonical(number)
+    return number
+
+
+def is_high_surrogate(escape):
+    """Whether the ``\\uXXXX`` `escape` is the first half of a pair."""
+    return escape[:2] == b'\\u' and 0xd800 <= int(
+        escape[2:].decode('ascii'), 16) <= 0xdbff
+
+
+class ValueScanner(object):
+    """Finds the end of one JSON value in a stream of chunks, passing
+    its text on in the same form as :class:`output.CompactJSONProcessor`
+    writes it once decoded: without whitespace between tokens, with only
+    the escapes it uses in strings, and with numbers written as Python
+    writes them.
+
+    Only the structure is checked (nesting and strings), and the escapes
+    and numbers that are rewritten.
+
+    """
+
+    def __init__(self, emit):
+        self.emit = emit
+        self.started = False
+        self.done = False
+        self.depth = 0
+        self.in_string = False
+        # The escape sequence being read, if any.
+        self.escape = None
+        self.scalar = None
+        # The end of a number that may go on in the next chunk.
+        self.carry = b''
+
+    def scan(self, data, i):
+        """Scan `data` from index `i`. Return the index after the end
+        of the value, or ``len(data)`` if it continues in the next chunk.
+
+        """
+        emit = self.emit
+        n = len(data)
+        while i < n:
+            if self.escape is not None:
+                i = self._scan_escape(data, i)
+                continue
+
+            if self.in_string:
+                m = _STRING_RE.search(data, i)
+                if not m:
+                    emit(data[i:])
+                    return n
+                j = m.start()
+                if j > i:
+                    emit(data[i:j])
+                if data[j] == 0x5c:  # backslash
+                    self.escape = bytearray(b'\\')
+                    i = j + 1
+                    continue
+                emit(b'"')
+                i = j + 1
+                self.in_string = False
+                if not self.depth:
+                    return self._finish(i)
+                continue
+
+            if self.scalar is not None:
+                m = _SCALAR_END_RE.search(data, i)
+                if not m:
+                    self.scalar.append(bytes(data[i:]))
+                    return n
+                self.scalar.append(bytes(data[i:m.start()]))
+                emit(canonical(b''.join(self.scalar)))
+                return self._finish(m.start())
+
+            if not self.started:
+                c = bytes(data[i:i + 1])
+                if c in b' \t\n\r':
+                    i += 1
+                    continue
+                self.started = True
+                if c not in b'"[{':
+                    self.scalar = []
+                    continue
+
+            m = _STRUCTURE_RE.search(data, i)
+            if not m:
+                self._emit_compact(data[i:], last=True)
+                return n
+            j = m.start()
+            self._emit_compact(data[i:j])
+            c = bytes(data[j:j + 1])
+            emit(c)
+            i = j + 1
+            if c == b'"':
+                self.in_string = True
+            elif c in b'[{':
+                self.depth += 1
+            else:
+                self.depth -= 1
+                if self.depth < 0:
+                    raise bad_response('unbalanced %r' % c)
+                if not self.depth:
+                    return self._finish(i)
+        return n
+
+    def _scan_escape(self, data, i):
+        """Read the escape sequence started in a string; return the index
+        of the first byte it doesn't take.
+
+        A ``\\uXXXX`` escape of the first half of a surrogate pair takes
+        the second half too, if it follows.
+
+        """
+        escape = self.escape
+        c = data[i]
+        if len(escape) == 6:
+            # After the first half of a surrogate pair.
+            if c != 0x5c:
+                return self._end_escape(i)
+        elif len(escape) == 7 and c != 0x75:  # u
+            # Another escape; not the second half.
+            self.emit(canonical_escape(escape[:6]))
+            self.escape = bytearray(b'\\')
+            return i
+        escape.append(c)
+        i += 1
+        if len(escape) == 2 and c != 0x75 or len(escape) == 12 or (
+                len(escape) == 6 and not is_high_surrogate(escape)):
+            return self._end_escape(i)
+        return i
+
+    def _end_escape(self, i):
+        self.emit(canonical_escape(self.escape))
+        self.escape = None
+        return i
+
+    def _emit_compact(self, data, last=False):
+        data = self.carry + _WHITESPACE_RE.sub(b'', bytes(data))
+        self.carry = b''
+        if last:
+            # A number at the end of the chunk may go on in the next.
+            m = _NUMBER_TAIL_RE.search(data)
+            if m:
+                data, self.carry = data[:m.start()], data[m.start():]
+        if data:
+            self.emit(_NUMBER_RE.sub(canonical_number, data))
+
+    def _finish(self, i):
+        self.done = True
+        return i
+
+
+class ResponseScanner(object):
+    """Scans a JSON-RPC response object fed to it in chunks.
+
+    The text of the ``result`` member is passed to `write` in pieces,
+    once per chunk fed. :meth:`close` returns the response with the
+    other members decoded and ``result`` set to `None`.
+
+    If `rpcid` is given, nothing is written unless the response's ``id``
+    is `rpcid`: a result received before the ``id`` is held back until
+    it is known.
+
+    """
+
+    def __init__(self, write, rpcid=None):
+        self.write = write
+        self.rpcid = rpcid
+        # The pieces of a result held back until the ``id`` is known.
+        self.held = None
+        self.state = START
+        self.members = {}
+        self.key = None
+        self.key_parts = []
+        self.key_escape = False
+        self.value = None
+        self.value_parts = None
+        self.out = []
+
+    def feed(self, data):
+        """Scan the next chunk of the response (`bytes` or a buffer)."""
+        i = 0
+        n = len(data)
+        while i < n:
+            state = self.state
+            if state == VALUE:
+                i = self.value.scan(data, i)
+                if self.value.done:
+                    self._end_value()
+                continue
+            if state == KEY_STRING:
+                i = self._scan_key(data, i)
+                continue
+
+            c = bytes(data[i:i + 1])
+            i += 1
+            if c in _WHITESPACE:
+                continue
+            if state == START and c == b'{':
+                self.state = KEY
+            elif state == KEY and c == b'"':
+                self.state = KEY_STRING
+            elif state == KEY and c == b'}' and not self.members:
+                self.state = END
+            elif state == COLON and c == b':':
+                self._start_value()
+            elif state == AFTER_VALUE and c == b',':
+                self.state = KEY
+            elif state == AFTER_VALUE and c == b'}':
+                self.state = END
+            else:
+                raise bad_response('unexpected %r' % bytes(c))
+
+        if self.out:
+            self.write(b''.join(self.out))
+            del self.out[:]
+
+    def _scan_key(self, data, i):
+        n = len(data)
+        while i < n:
+            if self.key_escape:
+                self.key_escape = False
+                self.key_parts.append(bytes(data[i:i + 1]))
+                i += 1
+                continue
+            m = _STRING_RE.search(data, i)
+            if not m:
+                self.key_parts.append(bytes(data[i:]))
+                return n
+            j = m.start()
+            self.key_parts.append(bytes(data[i:j + 1]))
+            i = j + 1
+            if data[j] == 0x5c:
+                self.key_escape = True
+                continue
+            try:
+                self.key = json.loads(
+                    (b'"' + b''.join(self.key_parts)).decode('utf8'))
+            except ValueError as e:
+                raise bad_response(e)
+            self.key_parts = []
+            self.state = COLON
+            return i
+        return n
+
+    def _start_value(self):
+        if self.key == RESULT:
+            if self.rpcid is None or 'id' in self.members:
+                emit = self.out.append
+            else:
+                self.held = []
+                emit = lambda part: self.held.append(bytes(part))
+        else:
+            self.value_parts = []
+            # The buffer may be reused for the next chunk; copy.
+            emit = lambda part: self.value_parts.append(bytes(part))
+        self.value = ValueScanner(emit)
+        self.state = VALUE
+
+    def _end_value(self):
+        if self.key == RESULT:
+            self.members[RESULT] = None
+        else:
+            try:
+                self.members[self.key] = json.loads(
+                    b''.join(self.value_parts).decode('utf8'))
+            except ValueError as e:
+                raise bad_response(e)
+            if self.key == 'id':
+                self._check_id()
+        self.value = self.value_parts = None
+        self.state = AFTER_VALUE
+
+    def _check_id(self):
+        if self.rpcid is None:
+            return
+        if self.members['id'] != self.rpcid:
+            raise jsonrpc_ns.JSONRPCBadResponse(
+                'Unexpected response id: %r' % (self.members['id'],))
+        if self.held is not None:
+            self.out.extend(self.held)
+            self.held = None
+
+    def close(self):
+        """Return the response, with ``result`` (if any) set to `None`."""
+        if self.state != END:
+            raise bad_response('truncated')
+        if self.held is not None:
+            raise bad_response('a result without an id')
+        return self.members
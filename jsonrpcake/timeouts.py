@@ -0,0 +1,153 @@
+"""Read timeouts learned from the latencies of earlier calls.
+
+The latencies of the calls of every method on every address are kept in
+a small sketch in the cache (a count per bucket, the buckets 20% apart).
+Unless a timeout is given, calls wait for a high percentile of the
+latencies seen so far, times a safety factor: fast methods fail fast,
+and slow ones get the time they usually need.
+
+"""
+from __future__ import division
+import math
+import socket
+import threading
+
+import jsonrpc_ns
+
+from .cache import FileCache
+
+
+# The upper bound (in seconds) of the first sketch bucket, and how much
+# larger every bucket's is than the previous one's.
+SKETCH_MIN = 0.0001
+SKETCH_GROWTH = 1.2
+
+# Once a sketch counts this many calls, all counts are halved, so that
+# recent calls weigh more than old ones.
+MAX_SAMPLES = 1000
+
+# The learned timeout is this quantile of the latencies times
+# `SAFETY_FACTOR`, within `MIN_TIMEOUT` and `MAX_TIMEOUT` seconds, and
+# only once `MIN_SAMPLES` calls have been seen.
+TIMEOUT_QUANTILE = 0.99
+SAFETY_FACTOR = 3
+MIN_TIMEOUT = 0.25
+MAX_TIMEOUT = 60
+MIN_SAMPLES = 20
+
+
+class LatencySketch(object):
+    """Counts of latencies per logarithmic bucket."""
+
+    def __init__(self, counts=None):
+        self.counts = dict(counts or {})
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def observe(self, latency):
+        index = 0
+        if latency > SKETCH_MIN:
+            index = int(math.ceil(math.log(latency / SKETCH_MIN)
+                                  / math.log(SKETCH_GROWTH)))
+        self.counts[index] = self.counts.get(index, 0) + 1
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        if self.total > MAX_SAMPLES:
+            self.counts = dict((index, count // 2)
+                               for index, count in self.counts.items()
+                               if count > 1)
+
+    def quantile(self, q):
+        """Return the upper bound of the bucket the `q`-quantile is in."""
+        rank = q * self.total
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= rank:
+                return SKETCH_MIN * SKETCH_GROWTH ** index
+        return 0.0
+
+    def to_json(self):
+        return sorted(self.counts.items())
+
+    @classmethod
+    def from_json(cls, value):
+        try:
+            return cls((int(index), int(count)) for index, count in value)
+        except (TypeError, ValueError):
+            return cls()
+
+
+class LatencyHistory(object):
+    """The latency sketches of calls per address and method, kept under
+    `cache_dir`.
+
+    Latencies are collected in memory by :meth:`observe` (thread-safe)
+    and added to the sketches on disk by :meth:`save`.
+
+    """
+
+    def __init__(self, cache_dir):
+        self.cache = FileCache(cache_dir, 'latency')
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def _key(self, addr, method):
+        return '%s %s' % (addr, method)
+
+    def load(self, addr, method):
+        return LatencySketch.from_json(
+            self.cache.get(self._key(addr, method), []))
+
+    def timeout(self, addr, method):
+        """Return the read timeout learned for `method` on `addr`, or
+        `None` if too few calls have been seen.
+
+        """
+        sketch = self.load(addr, method)
+        if sketch.total < MIN_SAMPLES:
+            return None
+        return min(MAX_TIMEOUT, max(
+            MIN_TIMEOUT, sketch.quantile(TIMEOUT_QUANTILE) * SAFETY_FACTOR))
+
+    def describe(self, addr, method):
+        """Return how the timeout for `method` on `addr` is learned."""
+        sketch = self.load(addr, method)
+        if sketch.total < MIN_SAMPLES:
+            return 'not learned yet (%d of %d calls seen)' % (
+                sketch.total, MIN_SAMPLES)
+        return '%.3f s (p%d %.1f ms x %d, from %d calls)' % (
+            self.timeout(addr, method), TIMEOUT_QUANTILE * 100,
+            sketch.quantile(TIMEOUT_QUANTILE) * 1000, SAFETY_FACTOR,
+            sketch.total)
+
+    def observe(self, addr, method, latency, error=None):
+        """Count a call that took `latency` seconds, unless it failed for
+        reasons that say nothing about how long the method takes.
+
+        A call that timed out counts with the time it waited, so that a
+        timeout that is too short is raised again.
+
+        """
+        if error is not None and not isinstance(
+                error, (socket.timeout, jsonrpc_ns.JSONRPCResponseError)):
+            return
+        with self.lock:
+            key = (addr, method)
+            sketch = self.pending.get(key)
+            if sketch is None:
+                sketch = self.pending[key] = LatencySketch()
+            sketch.observe(latency)
+
+    def save(self):
+        """Add the latencies observed to the sketches on disk."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for (addr, method), sketch in pending.items():
+            saved = self.load(addr, method)
+            saved.merge(sketch)
+            self.cache.set(self._key(addr, method), saved.to_json())
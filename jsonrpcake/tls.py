@@ -0,0 +1,74 @@
+"""TLS for ``tls://HOST:PORT`` addresses.
+
+Connections to the same server resume the TLS session of an earlier one
+(with a session ticket, or by session ID) instead of making a full
+handshake, which saves a round trip and the public key operations.
+
+"""
+import ssl
+import threading
+
+
+TLS_SCHEME = 'tls://'
+
+
+def is_tls(addr):
+    return addr.startswith(TLS_SCHEME)
+
+
+class TLSConfig(object):
+    """How TLS connections are made, and the sessions they can resume.
+
+    `verify` is `True` to check the server's certificate against the
+    system's CA certificates, a CA bundle file to check it against those
+    instead, or `False` not to check it. `cert` (and `cert_key`, unless
+    it is in the same file) is the client certificate, if one is needed.
+
+    """
+
+    def __init__(self, verify=True, cert=None, cert_key=None):
+        if verify is True or verify is False:
+            context = ssl.create_default_context()
+        else:
+            context = ssl.create_default_context(cafile=verify)
+        if verify is False:
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        if cert:
+            context.load_cert_chain(cert, cert_key)
+        self.context = context
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def wrap(self, sock, host, port):
+        """Make the TLS handshake on the connected `sock`; return the
+        wrapped socket.
+
+        """
+        with self.lock:
+            session = self.sessions.get((host, port))
+        return self.context.wrap_socket(sock, server_hostname=host,
+                                        session=session)
+
+    def save_session(self, sock, host, port):
+        """Keep the session of `sock` for the next connection to resume.
+
+        With TLS 1.3 the session ticket only arrives after the handshake,
+        so this is best done once something has been received.
+
+        """
+        session = sock.session
+        if session is not None and (session.has_ticket or session.id):
+            with self.lock:
+                self.sessions[(host, port)] = session
+
+
+default_tls = None
+
+
+def get_default_tls():
+    """Return the shared :class:`TLSConfig` with the default settings."""
+    global default_tls
+    if default_tls is None:
+        default_tls = TLSConfig()
+    return default_tls
@@ -0,0 +1,669 @@
+"""Netstring-framed JSON-RPC 2.0 over TCP, with connection pooling.
+
+Speaks the same protocol as `jsonrpc_ns` and raises its exceptions, but
+keeps connections open so that they can be reused across calls.
+
+"""
+import os
+import json
+import time
+import errno
+import socket
+import selectors
+import threading
+from contextlib import contextmanager
+from itertools import chain, count
+
+import jsonrpc_ns
+
+from .cache import FileCache
+from .models import Environment
+from .stream import ResponseScanner
+from .tls import TLS_SCHEME, is_tls, get_default_tls
+
+
+JSONRPC_VERSION = '2.0'
+
+# The longest netstring length prefix we accept (~1 TB).
+MAX_LENGTH_DIGITS = 12
+
+# Containers with more items than this are encoded piecewise, this many
+# items at a time (see `iterencode`).
+ENCODE_CHUNK_ITEMS = 256
+
+# Requests that encode to at most this many bytes are buffered and sent
+# at once; larger ones are encoded twice rather than held in memory.
+MAX_BUFFERED_REQUEST = 1 << 20
+
+# Outgoing data is coalesced into writes of about this size.
+SEND_BUFFER_SIZE = 64 << 10
+
+# Streamed responses are received in chunks of at most this many bytes,
+# read into one reused buffer.
+RECV_CHUNK_SIZE = 64 << 10
+
+# How long (in seconds) resolved addresses are cached.
+DNS_CACHE_TTL = 60
+
+# How long to wait for a connection attempt before also trying the next
+# address (the "Connection Attempt Delay" of RFC 8305, Happy Eyeballs).
+CONNECT_ATTEMPT_DELAY = 0.25
+
+
+class DeadlineExceeded(Exception):
+    """A call could not be made, or finish, before its deadline."""
+
+
+def parse_addr(addr):
+    """Split ``HOST:PORT`` (or ``tls://HOST:PORT``) into ``(host, port)``.
+
+    >>> parse_addr(':3000')
+    ('localhost', 3000)
+
+    """
+    if is_tls(addr):
+        addr = addr[len(TLS_SCHEME):]
+    host, sep, port = addr.rpartition(':')
+    if not sep:
+        raise ValueError('address must be HOST:PORT, got %r' % addr)
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError('invalid port in address %r' % addr)
+    return host.strip('[]') or 'localhost', port
+
+
+def is_ip_address(host):
+    for family in (socket.AF_INET, socket.AF_INET6):
+        try:
+            socket.inet_pton(family, host)
+            return True
+        except (socket.error, ValueError):
+            pass
+    return False
+
+
+class Resolver(object):
+    """Resolves ``(host, port)`` to ``getaddrinfo()``-style address
+    tuples, caching the results for `ttl` seconds in memory and in the
+    on-disk cache under `cache_dir` (if not `None`).
+
+    """
+
+    def __init__(self, cache_dir=Environment.cache_dir, ttl=DNS_CACHE_TTL):
+        self.ttl = ttl
+        self.cache = FileCache(cache_dir, 'dns', ttl=ttl)
+        self.memory = {}
+
+    def resolve(self, host, port):
+        """Return ``(addrinfos, cached)``, where `cached` tells whether
+        the addresses came from the cache.
+
+        """
+        key = '%s:%d' % (host, port)
+        entry = self.memory.get(key)
+        if entry and entry[0] > time.time():
+            return entry[1], True
+        cached = True
+        infos = None
+        if not is_ip_address(host):
+            infos = self.cache.get(key)
+        if infos:
+            infos = [(family, type_, proto, '', tuple(sockaddr))
+                     for family, type_, proto, sockaddr in infos]
+        else:
+            cached = False
+            infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+            if not is_ip_address(host):
+                self.cache.set(key, [[family, type_, proto, sockaddr]
+                                     for family, type_, proto, _, sockaddr
+                                     in infos])
+        self.memory[key] = (time.time() + self.ttl, infos)
+        return infos, cached
+
+    def forget(self, host, port):
+        key = '%s:%d' % (host, port)
+        self.memory.pop(key, None)
+        self.cache.delete(key)
+
+
+default_resolver = Resolver()
+
+
+def interleave(infos):
+    """Reorder `infos` so that address families alternate, starting with
+    the family of the first address (RFC 8305, section 4).
+
+    """
+    families = []
+    by_family = {}
+    for info in infos:
+        if info[0] not in by_family:
+            families.append(info[0])
+            by_family[info[0]] = []
+        by_family[info[0]].append(info)
+    ordered = []
+    while any(by_family.values()):
+        for family in families:
+            if by_family[family]:
+                ordered.append(by_family[family].pop(0))
+    return ordered
+
+
+def connect(infos, timeout=None, delay=CONNECT_ATTEMPT_DELAY):
+    """Connect to the first of the addresses in `infos` that accepts.
+
+    Attempts are started `delay` seconds apart (or as soon as the
+    previous one fails) and run in parallel, so an unreachable address
+    doesn't hold up the others. The first connected socket wins.
+
+    """
+    infos = interleave(infos)
+    deadline = time.time() + timeout if timeout is not None else None
+    pending = {}
+    errors = []
+    selector = selectors.DefaultSelector()
+    next_attempt = 0
+    try:
+        while infos or pending:
+            now = time.time()
+            if deadline is not None and now >= deadline:
+                raise socket.timeout('timed out')
+            if infos and (not pending or now >= next_attempt):
+                family, type_, proto, _, sockaddr = infos.pop(0)
+                sock = socket.socket(family, type_, proto)
+                sock.setblocking(False)
+                error = sock.connect_ex(sockaddr)
+                if error == 0:
+                    sock.settimeout(timeout)
+                    return sock
+                if error not in (errno.EINPROGRESS, errno.EWOULDBLOCK,
+                                 errno.EAGAIN):
+                    sock.close()
+                    errors.append(socket.error(error, os.strerror(error)))
+                    continue
+                pending[sock] = sockaddr
+                selector.register(sock, selectors.EVENT_WRITE)
+                next_attempt = now + delay
+
+            wait = max(0, next_attempt - now) if infos else None
+            if deadline is not None:
+                wait = (deadline - now if wait is None
+                        else min(wait, deadline - now))
+            for key, _ in selector.select(wait):
+                sock = key.fileobj
+                selector.unregister(sock)
+                del pending[sock]
+                error = sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if error == 0:
+                    sock.settimeout(timeout)
+                    return sock
+                sock.close()
+                errors.append(socket.error(error, os.strerror(error)))
+                # Start the next attempt right away.
+                next_attempt = 0
+    finally:
+        selector.close()
+        for sock in pending:
+            sock.close()
+    if errors:
+        raise errors[0]
+    raise socket.error('no addresses to connect to')
+
+
+_END = object()
+
+
+def _is_large(value):
+    return (isinstance(value, (dict, list, tuple))
+            and len(value) > ENCODE_CHUNK_ITEMS)
+
+
+def iterencode(value, dumps=json.dumps):
+    """Encode `value` like ``json.dumps(value)``, but as a series of
+    `str` chunks, so that large values never exist in memory in full.
+
+    Runs of up to `ENCODE_CHUNK_ITEMS` items are still encoded by a
+    single (C accelerated) ``json.dumps`` call, and only containers with
+    more items than that, or that directly contain such containers, are
+    split. Values nested deeper in small containers are encoded whole.
+
+    """
+    if isinstance(value, dict):
+        items = value.items()
+        if len(value) <= ENCODE_CHUNK_ITEMS and not any(
+                _is_large(item) for _, item in items):
+            yield dumps(value)
+            return
+        opening, closing = '{', '}'
+    elif isinstance(value, (list, tuple)):
+        items = value
+        if len(value) <= ENCODE_CHUNK_ITEMS and not any(
+                _is_large(item) for item in items):
+            yield dumps(value)
+            return
+        opening, closing = '[', ']'
+    else:
+        yield dumps(value)
+        return
+
+    yield opening
+    separator = ''
+    run = []
+    for item in chain(items, [_END]):
+        large = item is not _END and _is_large(
+            item[1] if opening == '{' else item)
+        if run and (item is _END or large
+                    or len(run) == ENCODE_CHUNK_ITEMS):
+            # Encode the run as a whole and strip the brackets.
+            yield separator + dumps(dict(run) if opening == '{'
+                                    else run)[1:-1]
+            separator = ', '
+            run = []
+        if item is _END:
+            break
+        if not large:
+            run.append(item)
+        elif opening == '{':
+            key, item = item
+            # Encode the key the way `json.dumps` does: '{"key": 0}'.
+            yield separator + dumps({key: 0})[1:-4] + ': '
+            for chunk in iterencode(item, dumps):
+                yield chunk
+            separator = ', '
+        else:
+            yield separator
+            for chunk in iterencode(item, dumps):
+                yield chunk
+            separator = ', '
+    yield closing
+
+
+def iter_message(method, params=None, rpcid=None):
+    """Yield the netstring-framed JSON-RPC request as `bytes` chunks.
+
+    Notifications have no `rpcid`.
+
+    The netstring length prefix has to be known before anything can be
+    sent. Requests up to `MAX_BUFFERED_REQUEST` bytes are buffered to
+    find it; for larger ones, the rest of the encoding only counts bytes
+    and the request is then encoded again while it is being sent.
+
+    """
+    message = {
+        'jsonrpc': JSONRPC_VERSION,
+        'method': method,
+        'params': params if params is not None else {},
+    }
+    if rpcid is not None:
+        message['id'] = rpcid
+
+    chunks = (chunk.encode('utf8') for chunk in iterencode(message))
+    buffered = []
+    length = 0
+    for chunk in chunks:
+        length += len(chunk)
+        if length > MAX_BUFFERED_REQUEST:
+            buffered = None
+            length += sum(len(chunk) for chunk in chunks)
+            break
+        buffered.append(chunk)
+
+    yield str(length).encode('ascii') + b':'
+    if buffered is None:
+        buffered = (chunk.encode('utf8') for chunk in iterencode(message))
+    for chunk in buffered:
+        yield chunk
+    yield b','
+
+
+def encode_message(method, params=None, rpcid=None):
+    """Return the netstring-framed JSON-RPC request as `bytes`."""
+    return b''.join(iter_message(method, params, rpcid))
+
+
+def unwrap(response):
+    """Validate a decoded `response` and return its result.
+
+    Raise :class:`jsonrpc_ns.JSONRPCResponseError` for error responses.
+
+    """
+    if response.get('jsonrpc') != JSONRPC_VERSION:
+        raise jsonrpc_ns.JSONRPCBadResponse(
+            'Bad jsonrpc version. Got {actual}, expects {expected}'
+            .format(actual=response.get('jsonrpc'),
+                    expected=JSONRPC_VERSION))
+    if 'result' in response:
+        return response['result']
+    if 'error' in response:
+        error = response['error']
+        if 'code' not in error or 'message' not in error:
+            raise jsonrpc_ns.JSONRPCBadResponse(
+                'Invalid error response: {}'.format(response))
+        raise jsonrpc_ns.JSONRPCResponseError(error)
+    raise jsonrpc_ns.JSONRPCBadResponse(
+        'Invalid response: {}'.format(response))
+
+
+class Connection(object):
+    """A connection to a JSON-RPC server.
+
+    ``tls://`` addresses are connected to with `tls`, a
+    :class:`tls.TLSConfig` (the default settings if not given).
+
+    """
+
+    def __init__(self, addr, connect_timeout=None, resolver=None, tls=None):
+        self.addr = addr
+        resolver = resolver or default_resolver
+        host, port = parse_addr(addr)
+        self.host, self.port = host, port
+        started = time.time()
+        infos, cached = resolver.resolve(host, port)
+        try:
+            self.sock = connect(infos, connect_timeout)
+        except socket.timeout:
+            raise
+        except socket.error:
+            if not cached:
+                raise
+            # The cached addresses may be stale.
+            resolver.forget(host, port)
+            infos, _ = resolver.resolve(host, port)
+            self.sock = connect(infos, connect_timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.tls = None
+        # Whether the TLS handshake resumed an earlier session.
+        self.resumed = False
+        if is_tls(addr):
+            self.tls = tls or get_default_tls()
+            self.sock.settimeout(connect_timeout)
+            try:
+                self.sock = self.tls.wrap(self.sock, host, port)
+            except BaseException:
+                self.sock.close()
+                raise
+            self.resumed = self.sock.session_reused
+        self.session_saved = False
+        # How long resolving, connecting and the handshake took, in
+        # seconds.
+        self.connect_time = time.time() - started
+        self.rfile = self.sock.makefile('rb')
+        self.ids = count(1)
+        # Whether anything was sent yet; a fresh connection that fails
+        # can't be blamed on the server having closed it while idle.
+        self.used = False
+        # Counted for `metrics`. Bytes received are counted as they are
+        # read, so that a call that got part of a response can tell.
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def send(self, data):
+        self.used = True
+        self.sock.sendall(data)
+        self.bytes_sent += len(data)
+
+    def send_chunks(self, chunks):
+        """Send the `bytes` in `chunks`, coalesced into fewer writes."""
+        self.used = True
+        buf = []
+        size = 0
+        for chunk in chunks:
+            buf.append(chunk)
+            size += len(chunk)
+            if size >= SEND_BUFFER_SIZE:
+                self.sock.sendall(b''.join(buf))
+                self.bytes_sent += size
+                buf = []
+                size = 0
+        if buf:
+            self.sock.sendall(b''.join(buf))
+            self.bytes_sent += size
+
+    def _recv_length(self):
+        """Read the length field of a netstring frame; return the length."""
+        digits = b''
+        while True:
+            c = self.rfile.read(1)
+            if not c:
+                if digits:
+                    raise jsonrpc_ns.JSONRPCBadResponse(
+                        'Bad netstring: connection closed in length field')
+                raise jsonrpc_ns.JSONRPCError('Failed to recieve response.')
+            self.bytes_received += 1
+            if c == b':':
+                break
+            if not c.isdigit() or len(digits) >= MAX_LENGTH_DIGITS:
+                raise jsonrpc_ns.JSONRPCBadResponse(
+                    'Bad netstring: invalid length field, {!r}'
+                    .format(digits + c))
+            digits += c
+        return int(digits)
+
+    def _recv_end(self):
+        c = self.rfile.read(1)
+        self.bytes_received += len(c)
+        if c != b',':
+            raise jsonrpc_ns.JSONRPCBadResponse(
+                'Bad netstring: missing comma')
+        if self.tls is not None and not self.session_saved:
+            # Once something has been received, TLS 1.3 tickets have too.
+            self.tls.save_session(self.sock, self.host, self.port)
+            self.session_saved = True
+
+    def recv(self):
+        """Read one netstring frame and return its payload."""
+        length = self._recv_length()
+        payload = self.rfile.read(length)
+        self.bytes_received += len(payload)
+        if len(payload) < length:
+            raise jsonrpc_ns.JSONRPCBadResponse(
+                'Bad netstring: connection closed after %d of %d bytes'
+                % (len(payload), length))
+        self._recv_end()
+        return payload
+
+    def recv_chunks(self, chunk_size=RECV_CHUNK_SIZE):
+        """Read one netstring frame, yielding its payload in chunks of at
+        most `chunk_size` bytes as they arrive.
+
+        The chunks are views of one reused buffer, valid only until the
+        next one is read.
+
+        """
+        length = self._recv_length()
+        buf = memoryview(bytearray(min(length, chunk_size)))
+        received = 0
+        while received < length:
+            n = self.rfile.readinto(buf[:length - received])
+            if not n:
+                raise jsonrpc_ns.JSONRPCBadResponse(
+                    'Bad netstring: connection closed after %d of %d bytes'
+                    % (received, length))
+            received += n
+            self.bytes_received += n
+            yield buf[:n]
+        self._recv_end()
+
+    def recv_response(self):
+        payload = self.recv()
+        try:
+            return json.loads(payload.decode('utf8'))
+        except ValueError:
+            raise jsonrpc_ns.JSONRPCBadResponse(
+                'Failed to parse response: {!r}'.format(payload[:200]))
+
+    def request(self, method, params=None):
+        """Make a call and return the decoded response object."""
+        return self.pipeline([(method, params)])[0]
+
+    def pipeline(self, calls):
+        """Send all `calls` (``(method, params)`` pairs) at once, then
+        return their decoded response objects in the same order.
+
+        """
+        ids = [next(self.ids) for _ in calls]
+        self.send_chunks(chain.from_iterable(
+            iter_message(method, params, rpcid)
+            for rpcid, (method, params) in zip(ids, calls)))
+        responses = {}
+        while len(responses) < len(ids):
+            response = self.recv_response()
+            if isinstance(response, dict) and response.get('id') in ids:
+                responses[response['id']] = response
+            elif isinstance(response, dict) and 'id' not in response:
+                # A server-sent notification; not ours to handle.
+                continue
+            else:
+                raise jsonrpc_ns.JSONRPCBadResponse(
+                    'Unexpected response: {}'.format(response))
+        return [responses[rpcid] for rpcid in ids]
+
+    def request_stream(self, method, params, write):
+        """Make a call, passing the JSON text of the result to `write` in
+        chunks as it is received; return the response with ``result``
+        set to `None`.
+
+        Once anything has been written, a lost connection is reported
+        as a bad response so that the call isn't retried.
+
+        """
+        rpcid = next(self.ids)
+        self.send_chunks(iter_message(method, params, rpcid))
+        written = [False]
+
+        def write_result(data):
+            written[0] = True
+            write(data)
+
+        try:
+            while True:
+                scanner = ResponseScanner(write_result, rpcid)
+                for chunk in self.recv_chunks():
+                    scanner.feed(chunk)
+                response = scanner.close()
+                if 'id' not in response:
+                    # A server-sent notification; it has no result.
+                    continue
+                # The scanner has checked the id.
+                return response
+        except socket.timeout:
+            raise
+        except (socket.error, jsonrpc_ns.JSONRPCError) as e:
+            if not written[0] or isinstance(
+                    e, jsonrpc_ns.JSONRPCBadResponse):
+                raise
+            raise jsonrpc_ns.JSONRPCBadResponse(
+                'Connection lost while receiving the result: %s' % e)
+
+    def notify(self, method, params=None):
+        self.send_chunks(iter_message(method, params))
+
+
+class ConnectionPool(object):
+    """Keeps up to `max_idle` idle connections per address for reuse.
+
+    ``tls://`` connections are made with `tls` (see :class:`Connection`).
+
+    """
+
+    def __init__(self, max_idle=8, tls=None):
+        self.max_idle = max_idle
+        self.tls = tls
+        self.idle = {}
+        self.lock = threading.Lock()
+        # The number of connections made, and the time it took in total.
+        self.connects = 0
+        self.connect_time = 0.0
+        # How many of them resumed a TLS session.
+        self.resumed = 0
+
+    def _get(self, addr, connect_timeout):
+        with self.lock:
+            idle = self.idle.get(addr)
+            if idle:
+                return idle.pop()
+        conn = Connection(addr, connect_timeout=connect_timeout,
+                          tls=self.tls)
+        with self.lock:
+            self.connects += 1
+            self.connect_time += conn.connect_time
+            self.resumed += conn.resumed
+        return conn
+
+    def _put(self, conn):
+        with self.lock:
+            idle = self.idle.setdefault(conn.addr, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    @contextmanager
+    def connection(self, addr, connect_timeout=None, read_timeout=None):
+        """Check out a connection to `addr` for the duration of the block.
+
+        `connect_timeout` applies if a new connection has to be made,
+        `read_timeout` to every send and receive on it.
+
+        It is returned to the pool unless the block raises anything
+        other than a JSON-RPC error response.
+
+        """
+        conn = self._get(addr, connect_timeout)
+        conn.sock.settimeout(read_timeout)
+        try:
+            yield conn
+        except jsonrpc_ns.JSONRPCResponseError:
+            self._put(conn)
+            raise
+        except BaseException:
+            conn.close()
+            raise
+        self._put(conn)
+
+    def run(self, addr, func, connect_timeout=None, read_timeout=None):
+        """Return ``func(conn)`` with a pooled connection to `addr`.
+
+        If a reused connection turns out to have been closed by the
+        server while idle, the idle connections to `addr` are dropped
+        and `func` is tried again with a new one. Not once anything has
+        been received for the call, though: the server got the request
+        and may have acted on it.
+
+        """
+        reused = False
+        try:
+            with self.connection(addr, connect_timeout,
+                                 read_timeout) as conn:
+                reused = conn.used
+                received = conn.bytes_received
+                return func(conn)
+        except (socket.error, jsonrpc_ns.JSONRPCError) as e:
+            if not reused or conn.bytes_received != received:
+                raise
+            if isinstance(e, (socket.timeout,
+                              jsonrpc_ns.JSONRPCResponseError,
+                              jsonrpc_ns.JSONRPCBadResponse)):
+                raise
+        self.discard(addr)
+        with self.connection(addr, connect_timeout, read_timeout) as conn:
+            return func(conn)
+
+    def discard(self, addr):
+        """Close all idle connections to `addr`."""
+        with self.lock:
+            idle = self.idle.pop(addr, [])
+        for conn in idle:
+            conn.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
@@ -0,0 +1,75 @@
+"""Watch mode: poll a method and print only what changed.
+
+"""
+from __future__ import division
+import time
+import math
+
+import jsonrpc_ns
+
+from .client import client_from_args
+from .diff import diff, format_change
+from .output import build_output_stream, get_formatter, write
+from . import ExitStatus
+
+
+def ticks(interval, clock=time.time, sleep=time.sleep):
+    """Yield once every `interval` seconds, on a fixed schedule.
+
+    The schedule doesn't drift with the time spent between ticks. Ticks
+    that were missed because a call took longer than `interval` are
+    skipped rather than made up for.
+
+    """
+    start = clock()
+    tick = 0
+    while True:
+        yield
+        now = clock()
+        tick = max(tick + 1, int(math.floor((now - start) / interval)) + 1)
+        delay = start + tick * interval - now
+        if delay > 0:
+            sleep(delay)
+
+
+def run_watch(args, env, error):
+    """Call ``args.method`` every ``args.watch`` seconds over one
+    connection. Write the first response in full, and afterwards only the
+    paths that changed since the previous response.
+
+    """
+    client = client_from_args(args)
+    flush = True
+    formatter = None
+    if 'colors' in args.prettify and env.colors:
+        formatter = get_formatter(args.style, env.colors, env.cache_dir)
+    previous = failed = None
+
+    for _ in ticks(args.watch):
+        try:
+            response = client.call(args.method, args.data)
+        except jsonrpc_ns.JSONRPCResponseError as e:
+            response = {'error': e.value}
+        except Exception as e:
+            # Keep watching; the server may come back.
+            message = '%s: %s' % (type(e).__name__, str(e))
+            if message != failed:
+                error('%s', message)
+                failed = message
+            continue
+        failed = None
+
+        if previous is None:
+            write(build_output_stream(args, env, None, response),
+                  env.stdout, flush)
+            write([b'\n'], env.stdout, flush)
+        else:
+            changes = [format_change(c, formatter).rstrip('\n')
+                       for c in diff(previous, response)]
+            if changes:
+                lines = [time.strftime('[%H:%M:%S]')] + changes
+                write([('\n'.join(lines) + '\n').encode('utf8')],
+                      env.stdout, flush)
+        previous = response
+
+    return ExitStatus.OK
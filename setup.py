@@ -8,12 +8,6 @@ requirements = [
     'jsonrpc-ns>=0.5',
     'Pygments>=1.5'
 ]
-try:
-    #noinspection PyUnresolvedReferences
-    import argparse  # NOQA
-except ImportError:
-    requirements.append('argparse>=1.2.1')
-
 if 'win32' in str(sys.platform).lower():
     # Terminal colors for Windows
     requirements.append('colorama>=0.2.4')
@@ -37,7 +31,10 @@ setup(
     entry_points={
         'console_scripts': [
             'jsonrpc = jsonrpcake.__main__:main',
+            'jsonrpc-complete = jsonrpcake.completion:main',
         ],
     },
     install_requires=requirements,
+    # `async def` and the lazy `jsonrpcake.Client` (PEP 562).
+    python_requires='>=3.7',
 )
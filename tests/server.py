@@ -0,0 +1,126 @@
+"""A local netstring JSON-RPC server for the tests.
+
+Every connection is served in a thread of its own by a `handler`, which
+reads requests with :meth:`Server.read` and writes whatever it likes.
+
+"""
+import json
+import socket
+import threading
+
+
+def frame(value):
+    """Return `value` (`bytes`, or anything else to encode as JSON) as a
+    netstring.
+
+    """
+    if not isinstance(value, bytes):
+        value = json.dumps(value).encode('utf8')
+    return str(len(value)).encode('ascii') + b':' + value + b','
+
+
+def response(request, result=None):
+    return {'jsonrpc': '2.0', 'id': request['id'], 'result': result}
+
+
+def error_response(request, code, message):
+    return {'jsonrpc': '2.0', 'id': request['id'],
+            'error': {'code': code, 'message': message}}
+
+
+def closed_port():
+    """Return a port of ``127.0.0.1`` that refuses connections."""
+    sock = socket.socket()
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+
+def echo(server, sock, rfile):
+    """Respond to every request with its params."""
+    while True:
+        request = server.read(rfile)
+        if request is None:
+            return
+        if 'id' in request:
+            sock.sendall(frame(response(request, request['params'])))
+
+
+class Server(object):
+    """Serves connections on a free port of ``127.0.0.1`` with
+    ``handler(server, sock, rfile)`` (by default :func:`echo`) until
+    closed.
+
+    The requests read and the number of connections are recorded.
+
+    """
+
+    def __init__(self, handler=echo):
+        self.handler = handler
+        self.requests = []
+        self.connections = 0
+        self.lock = threading.Lock()
+        self.sock = socket.socket()
+        self.sock.bind(('127.0.0.1', 0))
+        self.sock.listen(16)
+        self.port = self.sock.getsockname()[1]
+        self.addr = '127.0.0.1:%d' % self.port
+        self.socks = []
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, _ = self.sock.accept()
+            except (socket.error, ValueError):
+                return
+            with self.lock:
+                self.connections += 1
+                self.socks.append(sock)
+            thread = threading.Thread(target=self._serve, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def _serve(self, sock):
+        rfile = sock.makefile('rb')
+        try:
+            self.handler(self, sock, rfile)
+        except socket.error:
+            pass
+        finally:
+            rfile.close()
+            sock.close()
+
+    def read(self, rfile):
+        """Read and record one request; return `None` at the end."""
+        digits = b''
+        while True:
+            c = rfile.read(1)
+            if not c:
+                return None
+            if c == b':':
+                break
+            digits += c
+        request = json.loads(rfile.read(int(digits)).decode('utf8'))
+        rfile.read(1)
+        with self.lock:
+            self.requests.append(request)
+        return request
+
+    def close(self):
+        with self.lock:
+            for sock in [self.sock] + self.socks:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
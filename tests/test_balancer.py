@@ -0,0 +1,146 @@
+from __future__ import division
+import time
+import socket
+import random
+import unittest
+
+from jsonrpcake import balancer
+from jsonrpcake.balancer import Balancer, LEAST_OUTSTANDING, POWER_OF_TWO
+from jsonrpcake.transport import ConnectionPool
+
+from .server import Server, closed_port
+
+
+# Long enough for any test here, short enough for a hang to fail.
+TIMEOUT = 5
+
+
+def wait_for(condition):
+    deadline = time.time() + TIMEOUT
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('timed out')
+        time.sleep(0.01)
+
+
+class BalancerTest(unittest.TestCase):
+
+    def balancer(self, addrs, **kwargs):
+        pool = ConnectionPool()
+        self.addCleanup(pool.close)
+        return Balancer(addrs, pool=pool, timeout=TIMEOUT, **kwargs)
+
+    def test_least_outstanding(self):
+        lb = self.balancer(['a:1', 'b:1', 'c:1'])
+        a, b, c = lb.replicas
+        a.outstanding, b.outstanding, c.outstanding = 2, 1, 1
+        b.ewma, c.ewma = 0.2, 0.1
+        self.assertIs(lb.pick(), c)
+        self.assertEqual(c.outstanding, 2)
+        # Now b has the fewest calls in flight, however slow it is.
+        self.assertIs(lb.pick(), b)
+        self.assertIs(lb.pick(exclude=[b]), a)
+
+    def test_power_of_two_choices(self):
+        random.seed(1)
+        lb = self.balancer(['r%d:1' % i for i in range(5)],
+                           policy=POWER_OF_TWO)
+        for i, replica in enumerate(lb.replicas):
+            replica.ewma = (i + 1) / 100
+        picked = set()
+        for _ in range(200):
+            replica = lb.pick()
+            replica.outstanding -= 1
+            picked.add(replica.addr)
+        # The better of two random replicas: never the worst, but not
+        # always the best either.
+        self.assertNotIn('r4:1', picked)
+        self.assertGreater(len(picked), 1)
+
+    def test_power_of_two_weighs_outstanding_calls(self):
+        lb = self.balancer(['a:1', 'b:1'], policy=POWER_OF_TWO)
+        a, b = lb.replicas
+        a.ewma, b.ewma = 0.01, 0.03
+        a.outstanding = 3
+        # 0.01 * 4 > 0.03 * 1
+        self.assertIs(lb.pick(), b)
+
+    def test_eject_time_doubles(self):
+        lb = self.balancer(['a:1'], eject_time=10)
+        replica = lb.replicas[0]
+        delays = []
+        for _ in range(8):
+            now = time.time()
+            lb._eject(replica)
+            delays.append(round(replica.probe_at - now))
+        self.assertTrue(replica.ejected)
+        self.assertEqual(replica.ejections, 8)
+        self.assertEqual(delays, [10, 20, 40, 80, 160, 320, 320, 320])
+        self.assertEqual(replica.eject_factor, balancer.MAX_EJECT_FACTOR)
+
+    def test_ejected_replicas_take_no_calls(self):
+        lb = self.balancer(['a:1', 'b:1'], eject_time=60)
+        a, b = lb.replicas
+        lb._eject(a)
+        for _ in range(3):
+            self.assertIs(lb.pick(), b)
+        # Unless everything is ejected.
+        lb._eject(b)
+        self.assertIs(lb.pick(), a)
+
+    def test_back_after_a_successful_probe(self):
+        with Server() as server:
+            lb = self.balancer([server.addr], eject_time=0)
+            replica = lb.replicas[0]
+            lb._eject(replica)
+            lb.pick().outstanding -= 1
+            wait_for(lambda: not replica.probing)
+            self.assertFalse(replica.ejected)
+            self.assertEqual(replica.eject_factor, 2)
+
+    def test_ejected_again_after_a_failed_probe(self):
+        lb = self.balancer(['127.0.0.1:%d' % closed_port()], eject_time=0)
+        replica = lb.replicas[0]
+        lb._eject(replica)
+        lb.pick().outstanding -= 1
+        wait_for(lambda: not replica.probing)
+        self.assertTrue(replica.ejected)
+        self.assertEqual((replica.ejections, replica.eject_factor), (2, 4))
+
+    def test_refused_calls_are_retried_on_another_replica(self):
+        refused = '127.0.0.1:%d' % closed_port()
+        with Server() as server:
+            lb = self.balancer([refused, server.addr],
+                               policy=LEAST_OUTSTANDING, eject_time=60)
+            self.assertEqual(lb.call('m', [1]), [1])
+            down, up = lb.replicas
+            self.assertTrue(down.ejected)
+            self.assertEqual((down.errors, down.outstanding), (1, 0))
+            self.assertEqual((up.calls, up.outstanding), (1, 0))
+            self.assertEqual(len(server.requests), 1)
+
+    def test_all_refused(self):
+        lb = self.balancer(['127.0.0.1:%d' % closed_port()
+                            for _ in range(2)], eject_time=60)
+        with self.assertRaises(socket.error):
+            lb.call('m')
+        self.assertEqual([r.errors for r in lb.replicas], [1, 1])
+
+    def test_errors_after_sending_are_not_retried(self):
+        def handler(server, sock, rfile):
+            server.read(rfile)
+            # Respond too late.
+            time.sleep(0.3)
+
+        with Server(handler) as slow, Server() as fast:
+            pool = ConnectionPool()
+            self.addCleanup(pool.close)
+            lb = Balancer([slow.addr, fast.addr], pool=pool, timeout=0.1)
+            with self.assertRaises(socket.timeout):
+                lb.call('add.user')
+            self.assertTrue(lb.replicas[0].ejected)
+            self.assertEqual(fast.requests, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+from __future__ import division
+import pickle
+import unittest
+from argparse import Namespace
+
+from jsonrpcake import ExitStatus
+from jsonrpcake.batch import BenchStats, share, worker_args
+from jsonrpcake.metrics import BENCH_BUCKETS
+
+
+class BenchStatsTest(unittest.TestCase):
+
+    def stats(self, latencies, errors=None, **kwargs):
+        stats = BenchStats()
+        for latency in latencies:
+            stats.latency.observe(latency)
+        stats.errors = dict(errors or {})
+        for name, value in kwargs.items():
+            setattr(stats, name, value)
+        return stats
+
+    def test_merge(self):
+        stats = self.stats([0.001, 0.002], {'timeout': 1}, connects=2,
+                           connect_time=0.5, coalesce_calls=4, coalesced=1)
+        stats.merge(self.stats([0.003], {'timeout': 2, 'JSONRPC -32000': 1},
+                               connects=1, connect_time=0.25, resumed=1,
+                               skipped=True,
+                               exit_status=ExitStatus.ERROR_TIMEOUT))
+        self.assertEqual(stats.latency.count, 3)
+        self.assertAlmostEqual(stats.latency.sum, 0.006)
+        self.assertEqual(stats.errors, {'timeout': 3, 'JSONRPC -32000': 1})
+        self.assertEqual((stats.connects, stats.connect_time, stats.resumed),
+                         (3, 0.75, 1))
+        self.assertEqual((stats.coalesce_calls, stats.coalesced), (4, 1))
+        self.assertTrue(stats.skipped)
+        self.assertEqual(stats.exit_status, ExitStatus.ERROR_TIMEOUT)
+
+    def test_merged_histogram_equals_one_that_saw_everything(self):
+        latencies = [i / 1000 for i in range(1, 200, 7)] + [100]
+        merged = BenchStats()
+        for part in (latencies[::3], latencies[1::3], latencies[2::3]):
+            merged.merge(self.stats(part))
+        whole = self.stats(latencies)
+        self.assertEqual(merged.latency.counts, whole.latency.counts)
+        self.assertEqual(merged.latency.count, len(latencies))
+        for q in (0.5, 0.9, 0.99):
+            self.assertAlmostEqual(merged.latency.quantile(q),
+                                   whole.latency.quantile(q))
+        self.assertIn('calls:       %d\n' % len(latencies),
+                      merged.report(1.0))
+
+    def test_sent_between_processes(self):
+        stats = pickle.loads(pickle.dumps(self.stats([0.01], {'x': 1})))
+        self.assertEqual(stats.latency.bounds, BENCH_BUCKETS)
+        self.assertEqual(stats.errors, {'x': 1})
+
+
+class WorkersTest(unittest.TestCase):
+
+    def test_share(self):
+        self.assertEqual(share(10, 3), [4, 3, 3])
+        self.assertEqual(share(2, 4), [1, 1, 0, 0])
+
+    def test_worker_args(self):
+        args = Namespace(rate=10, burst=5, output_file=object(),
+                         batch=object(), diff_against=None,
+                         metrics=object(), history=object())
+        copies = [worker_args(args, 2, i) for i in range(2)]
+        self.assertEqual([copy.rate for copy in copies], [5, 5])
+        self.assertEqual([copy.burst for copy in copies], [3, 2])
+        # Sent to spawned workers.
+        pickle.dumps(copies)
+        self.assertIsNotNone(args.metrics)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+from __future__ import division
+import time
+import threading
+import unittest
+
+from jsonrpcake.coalesce import SingleFlight
+from jsonrpcake.transport import DeadlineExceeded
+
+
+class SingleFlightTest(unittest.TestCase):
+
+    def concurrent(self, flight, func, callers=5, method='get_user',
+                   params=None, **kwargs):
+        """Make `callers` identical calls while the first is in flight;
+        return their results (or exceptions).
+
+        """
+        started = threading.Event()
+        release = threading.Event()
+        results = [None] * callers
+
+        def leader():
+            started.set()
+            release.wait(5)
+            return func()
+
+        def call(i):
+            try:
+                results[i] = flight.call('addr', method, params or {'id': 1},
+                                         leader if i == 0 else func, **kwargs)
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=call, args=(0,))]
+        threads[0].start()
+        started.wait(5)
+        threads += [threading.Thread(target=call, args=(i,))
+                    for i in range(1, callers)]
+        for thread in threads[1:]:
+            thread.start()
+        # Let the waiters find the flight before it lands.
+        while flight.coalesced < callers - 1 and flight.allows(method):
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+        return results
+
+    def test_identical_calls_share_one(self):
+        calls = []
+
+        def func():
+            calls.append(1)
+            return {'name': 'x'}
+
+        flight = SingleFlight(['get_*'])
+        results = self.concurrent(flight, func)
+        self.assertEqual(len(calls), 1)
+        self.assertTrue(all(result is results[0] for result in results))
+        self.assertEqual((flight.calls, flight.coalesced), (5, 4))
+        self.assertEqual(flight.flights, {})
+        self.assertEqual(flight.stats(), 'coalesced: 4 of 5 calls (80.0%)\n')
+
+    def test_errors_are_shared(self):
+        def func():
+            raise ValueError('down')
+
+        results = self.concurrent(SingleFlight(['*']), func, callers=3)
+        self.assertTrue(all(isinstance(result, ValueError)
+                            for result in results))
+
+    def test_other_methods_are_not_coalesced(self):
+        calls = []
+        flight = SingleFlight(['get_*'])
+        self.concurrent(flight, lambda: calls.append(1), callers=3,
+                        method='delete_user')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(flight.calls, 0)
+
+    def test_key_canonicalizes_params(self):
+        flight = SingleFlight(['*'])
+        self.assertEqual(flight.key('a', 'm', {'x': 1, 'y': 2}),
+                         flight.key('a', 'm', {'y': 2, 'x': 1}))
+        self.assertNotEqual(flight.key('a', 'm', [1]),
+                            flight.key('b', 'm', [1]))
+        self.assertIsNone(flight.key('a', 'm', {'x': object()}))
+
+    def test_waiter_deadline(self):
+        flight = SingleFlight(['*'])
+        release = threading.Event()
+        thread = threading.Thread(
+            target=flight.call, args=('a', 'm', None, lambda: release.wait(5)))
+        thread.start()
+        while not flight.flights:
+            time.sleep(0.01)
+        try:
+            with self.assertRaises(DeadlineExceeded):
+                flight.call('a', 'm', None, lambda: None, timeout=0.05)
+        finally:
+            release.set()
+            thread.join(5)
+
+
+if __name__ == '__main__':
+    unittest.main()
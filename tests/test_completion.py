@@ -0,0 +1,74 @@
+from __future__ import division
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from jsonrpcake import completion
+from jsonrpcake.models import Environment
+
+from .server import (Server, frame, response, error_response,
+                     closed_port)
+
+
+def methods_server(server, sock, rfile):
+    """Knows ``system.listMethods`` but not ``rpc.discover``."""
+    while True:
+        request = server.read(rfile)
+        if request is None:
+            return
+        if request['method'] == 'system.listMethods':
+            reply = response(request, ['add.user', 'get.user'])
+        else:
+            reply = error_response(request, -32601, 'Method not found')
+        sock.sendall(frame(reply))
+
+
+class CompletionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.env = Environment(cache_dir=self.cache_dir)
+        completion.refresh_options(self.env)
+
+    def refreshing(self, addr):
+        pending = completion.FileCache(self.cache_dir, 'refreshing')
+        return pending.get('--refresh %s' % addr)
+
+    def test_options(self):
+        self.assertIn('--pretty', completion.complete(['--pr'], self.env))
+        # The value of --pretty is left to the shell.
+        self.assertEqual(completion.complete(['--pretty', ''], self.env), [])
+
+    def test_methods_after_refresh(self):
+        with Server(methods_server) as server:
+            completion.refresh(server.addr, self.env)
+        self.assertEqual(completion.complete([server.addr, 'add'], self.env),
+                         ['add.user'])
+        self.assertEqual(completion.complete([''], self.env), [server.addr])
+
+    def test_failed_discovery_is_not_retried_for_a_while(self):
+        addr = '127.0.0.1:%d' % closed_port()
+        completion.refresh(addr, self.env)
+        self.assertIsNone(completion.methods_cache(self.env).get(addr))
+        self.assertEqual(completion.complete([addr, ''], self.env), [])
+        self.assertIsNone(self.refreshing(addr))
+
+        # Once it expires, the server is asked again.
+        failed = completion.failed_discovery_cache(self.env)
+        expired = time.time() - completion.FAILED_DISCOVERY_TTL - 1
+        os.utime(failed._filename(addr), (expired, expired))
+        self.assertIsNone(failed.get(addr))
+
+    def test_success_clears_the_failure(self):
+        with Server(methods_server) as server:
+            completion.failed_discovery_cache(self.env).set(server.addr, True)
+            completion.refresh(server.addr, self.env)
+        self.assertIsNone(
+            completion.failed_discovery_cache(self.env).get(server.addr))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+from __future__ import division
+import io
+import shutil
+import tempfile
+import unittest
+
+from jsonrpcake import ExitStatus
+from jsonrpcake.core import main
+from jsonrpcake.models import Environment
+from jsonrpcake.diff import (diff, format_path, parse_path, format_change,
+                             ADDED, REMOVED, CHANGED)
+
+from .server import Server, frame, response
+
+
+class PathTest(unittest.TestCase):
+
+    def test_format(self):
+        self.assertEqual(format_path([]), '$')
+        self.assertEqual(format_path(['users', 0, 'name']), '$.users[0].name')
+
+    def test_keys_that_need_quoting(self):
+        self.assertEqual(format_path(['a.b', 'c[0]', '', ' x']),
+                         '$["a.b"]["c[0]"][""][" x"]')
+
+    def test_parse(self):
+        self.assertEqual(parse_path('$.users[0].name'), ['users', 0, 'name'])
+        self.assertEqual(parse_path('users[0]'), ['users', 0])
+        self.assertEqual(parse_path('["a.b"].c'), ['a.b', 'c'])
+        self.assertEqual(parse_path('$'), [])
+
+    def test_parse_invalid(self):
+        for text in ('$.a[x]', '$..a', '$.a["b"', '$a'):
+            with self.assertRaises(ValueError):
+                parse_path(text)
+
+    def test_round_trip(self):
+        for path in (['users', 0, 'name'], ['a.b', 1, 'c]'], ['', 'x '],
+                     ['say "hi"', 'é', '0', 'back\\slash', 'new\nline']):
+            self.assertEqual(parse_path(format_path(path)), path)
+
+
+class DiffTest(unittest.TestCase):
+
+    def changes(self, old, new, **kwargs):
+        return sorted(diff(old, new, **kwargs))
+
+    def test_equal(self):
+        self.assertEqual(self.changes({'a': [1, {'b': 2}]},
+                                      {'a': [1, {'b': 2}]}), [])
+
+    def test_objects(self):
+        self.assertEqual(
+            self.changes({'a': 1, 'b': 2, 'c': {'d': 3}},
+                         {'a': 1, 'c': {'d': 4}, 'e': 5}),
+            [(ADDED, ('e',), None, 5),
+             (REMOVED, ('b',), 2, None),
+             (CHANGED, ('c', 'd'), 3, 4)])
+
+    def test_json_types_differ(self):
+        self.assertEqual(self.changes({'a': 1, 'b': True},
+                                      {'a': True, 'b': 1.0}),
+                         [(CHANGED, ('a',), 1, True),
+                          (CHANGED, ('b',), True, 1.0)])
+
+    def test_arrays_by_position(self):
+        self.assertEqual(self.changes([1, 2, 3, 4], [1, 3, 4, 5]),
+                         [(ADDED, (3,), None, 5),
+                          (REMOVED, (1,), 2, None)])
+
+    def test_arrays_by_key(self):
+        old = [{'id': 1, 'v': 'a'}, {'id': 2, 'v': 'b'}]
+        new = [{'id': 2, 'v': 'c'}, {'id': 3, 'v': 'd'}]
+        self.assertEqual(self.changes(old, new),
+                         [(ADDED, (1,), None, {'id': 3, 'v': 'd'}),
+                          (REMOVED, (0,), {'id': 1, 'v': 'a'}, None),
+                          (CHANGED, (0, 'v'), 'b', 'c')])
+
+    def test_format_change(self):
+        self.assertEqual(
+            format_change((CHANGED, ('a.b', 0), 'é', None)),
+            '~ $["a.b"][0]: "é" -> null')
+
+
+def counter(server, sock, rfile):
+    """Respond with the number of requests so far."""
+    while True:
+        request = server.read(rfile)
+        if request is None:
+            return
+        sock.sendall(frame(response(request, len(server.requests))))
+
+
+class RunDiffTest(unittest.TestCase):
+
+    def run_diff(self, *args):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        env = Environment(stdin_isatty=True, stdout_isatty=False,
+                          stdout=io.BytesIO(), stderr=io.StringIO(),
+                          cache_dir=cache_dir)
+        status = main(['--ignore-stdin', '--traceback'] + list(args), env)
+        return status, env.stdout.getvalue()
+
+    def test_same_address_on_both_sides(self):
+        with Server(counter) as server:
+            status, output = self.run_diff(
+                '--diff', server.addr, server.addr, 'count')
+        self.assertEqual(len(server.requests), 2)
+        self.assertEqual(status, ExitStatus.ERROR)
+        self.assertEqual(output.splitlines()[:2],
+                         [b'--- ' + server.addr.encode('ascii'),
+                          b'+++ ' + server.addr.encode('ascii')])
+        self.assertEqual(len(output.splitlines()), 3)
+
+    def test_equal(self):
+        with Server() as a, Server() as b:
+            status, output = self.run_diff('--diff', b.addr, a.addr, 'm',
+                                           'x=1')
+        self.assertEqual(status, ExitStatus.OK)
+        self.assertEqual(output, b'')
+
+
+if __name__ == '__main__':
+    unittest.main()
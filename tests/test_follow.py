@@ -0,0 +1,55 @@
+from __future__ import division
+import io
+import json
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from jsonrpcake import ExitStatus, follow
+from jsonrpcake.core import main
+from jsonrpcake.models import Environment
+
+from .server import Server, frame, response, error_response
+
+
+def publisher(server, sock, rfile):
+    """Push two messages after subscribing, then hang up; refuse the
+    subscription the second time.
+
+    """
+    request = server.read(rfile)
+    if server.connections > 1:
+        sock.sendall(frame(error_response(request, -32000, 'Gone')))
+        return
+    sock.sendall(frame(response(request, 'sub-1')))
+    for i in range(2):
+        sock.sendall(frame({'jsonrpc': '2.0', 'method': 'orders',
+                            'params': [i]}))
+
+
+class FollowTest(unittest.TestCase):
+
+    def test_only_pushed_messages_are_counted(self):
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        env = Environment(stdin_isatty=True, stdout_isatty=False,
+                          stderr_isatty=False, stdout=io.BytesIO(),
+                          stderr=io.StringIO(), cache_dir=cache_dir)
+        with Server(publisher) as server, \
+                mock.patch.object(follow, 'RECONNECT_DELAY', 0):
+            status = main(['--ignore-stdin', '--traceback', '--follow',
+                           '--output-format', 'ndjson', server.addr,
+                           'subscribe'], env)
+        self.assertEqual(status, ExitStatus.ERROR)
+        messages = [json.loads(line)
+                    for line in env.stdout.getvalue().splitlines()]
+        self.assertEqual([m.get('result', m.get('params')) for m in messages],
+                         ['sub-1', [0], [1], None])
+        self.assertEqual(messages[-1]['error']['message'], 'Gone')
+        self.assertIn('2 messages', env.stderr.getvalue())
+        self.assertIn('1 reconnects', env.stderr.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
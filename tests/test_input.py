@@ -0,0 +1,115 @@
+from __future__ import division
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from argparse import ArgumentTypeError
+
+from jsonrpcake import input
+from jsonrpcake.cli import parser
+from jsonrpcake.models import Environment
+
+
+class KeyValueArgTypeTest(unittest.TestCase):
+
+    key_value = input.KeyValueArgType(*input.SEP_GROUP_ALL_ITEMS)
+
+    # (argument, (key, separator, value))
+    items = [
+        ('a=b', ('a', '=', 'b')),
+        ('a:=1', ('a', ':=', '1')),
+        ('a:b', ('a', ':', 'b')),
+        ('a==b', ('a', '==', 'b')),
+        ('a@f', ('a', '@', 'f')),
+        ('a=@f', ('a', '=@', 'f')),
+        ('a:=@f', ('a', ':=@', 'f')),
+        ('=b', ('', '=', 'b')),
+        ('a=', ('a', '=', '')),
+        # The first separator wins, and the longest one at its position.
+        ('a=b:c', ('a', '=', 'b:c')),
+        ('a:b=c', ('a', ':', 'b=c')),
+        ('a:=b=c', ('a', ':=', 'b=c')),
+        ('a==b=c', ('a', '==', 'b=c')),
+        ('a=@b@c', ('a', '=@', 'b@c')),
+        ('a:=@b', ('a', ':=@', 'b')),
+        # Escaped separators, or parts of them, aren't separators.
+        (r'a\=b=c', ('a=b', '=', 'c')),
+        (r'a\:=b:c', ('a:', '=', 'b:c')),
+        (r'a:\=b', ('a', ':', '=b')),
+        (r'a\@b=c', ('a@b', '=', 'c')),
+        (r'a=\=b', ('a', '=', '=b')),
+        (r'a=\@b', ('a', '=', '@b')),
+        (r'a=b\=c', ('a', '=', 'b=c')),
+        # Escaped backslashes.
+        (r'a\\=b', ('a\\', '=', 'b')),
+        (r'a\\\=b=c', ('a\\=b', '=', 'c')),
+        (r'a=b\\c', ('a', '=', 'b\\c')),
+        (r'a=b\\\\', ('a', '=', 'b\\\\')),
+        # Other escaped characters are themselves.
+        (r'\a=b', ('a', '=', 'b')),
+        ('a=b\nc', ('a', '=', 'b\nc')),
+    ]
+
+    def test_items(self):
+        for string, (key, sep, value) in self.items:
+            item = self.key_value(string)
+            self.assertEqual((item.key, item.sep, item.value),
+                             (key, sep, value), string)
+            self.assertEqual(item.orig, string)
+
+    def test_no_separator(self):
+        for string in ('', 'abc', r'a\=b', r'a\:\=b', '\\'):
+            with self.assertRaises(ArgumentTypeError):
+                self.key_value(string)
+
+    def test_separators_given(self):
+        key_value = input.KeyValueArgType(input.SEP_DATA)
+        item = key_value('a:=b')
+        self.assertEqual((item.key, item.sep, item.value), ('a:', '=', 'b'))
+
+
+class ItemsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def write(self, name, text):
+        filename = os.path.join(self.dir, name)
+        with io.open(filename, 'w', encoding='utf8') as f:
+            f.write(text)
+        return filename
+
+    def parse(self, *args):
+        env = Environment(stdin_isatty=True, stdout_isatty=False,
+                          stdout=io.StringIO(), stderr=io.StringIO())
+        return parser.parse_args(
+            env=env, args=['--ignore-stdin', 'localhost:3000', 'm']
+            + list(args))
+
+    def test_items_from_file(self):
+        params = self.write('params.txt', (
+            'name=John Doe\n'
+            '\n'
+            'age:=29\n'
+            'quote=say "hi" & \\=\n'))
+        args = self.parse('@' + params, 'extra=1')
+        self.assertEqual(args.data, {'name': 'John Doe', 'age': 29,
+                                     'quote': 'say "hi" & =',
+                                     'extra': '1'})
+
+    def test_embedded_files(self):
+        text = self.write('text.txt', 'é\n')
+        data = self.write('data.json', '{"a": [1]}')
+        args = self.parse('text=@' + text, 'data:=@' + data)
+        self.assertEqual(args.data, {'text': 'é\n', 'data': {'a': [1]}})
+
+    def test_embedded_file_missing(self):
+        with self.assertRaises(input.ParseError):
+            input.parse_items([input.KeyValueArgType('=@')(
+                'a=@' + os.path.join(self.dir, 'missing'))])
+
+
+if __name__ == '__main__':
+    unittest.main()
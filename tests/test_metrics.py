@@ -0,0 +1,179 @@
+from __future__ import division
+import os
+import json
+import shutil
+import socket
+import tempfile
+import unittest
+from unittest import mock
+
+import jsonrpc_ns
+
+from jsonrpcake import metrics
+from jsonrpcake.metrics import Metrics, MetricsWriter
+
+
+PROMETHEUS = '''\
+# HELP jsonrpc_calls_total Calls made.
+# TYPE jsonrpc_calls_total counter
+jsonrpc_calls_total{method="add.user",host="h:1"} 3
+# HELP jsonrpc_response_errors_total JSON-RPC error responses, by error code.
+# TYPE jsonrpc_response_errors_total counter
+jsonrpc_response_errors_total{method="add.user",host="h:1",code="-32601"} 2
+# HELP jsonrpc_timeouts_total Calls that timed out.
+# TYPE jsonrpc_timeouts_total counter
+jsonrpc_timeouts_total{method="add.user",host="h:1"} 1
+# HELP jsonrpc_failures_total Calls that failed without an error response \
+or a timeout.
+# TYPE jsonrpc_failures_total counter
+jsonrpc_failures_total{method="add.user",host="h:1"} 0
+# HELP jsonrpc_sent_bytes_total Bytes sent.
+# TYPE jsonrpc_sent_bytes_total counter
+jsonrpc_sent_bytes_total{method="add.user",host="h:1"} 15
+# HELP jsonrpc_received_bytes_total Bytes received.
+# TYPE jsonrpc_received_bytes_total counter
+jsonrpc_received_bytes_total{method="add.user",host="h:1"} 50
+# HELP jsonrpc_call_duration_seconds Call latency in seconds.
+# TYPE jsonrpc_call_duration_seconds histogram
+jsonrpc_call_duration_seconds_bucket{method="add.user",host="h:1",le="0.001"} 0
+jsonrpc_call_duration_seconds_bucket{method="add.user",host="h:1",le="0.0025"} 0
+jsonrpc_call_duration_seconds_bucket{method="add.user",host="h:1",le="0.005"} 1
+jsonrpc_call_duration_seconds_bucket{method="add.user",host="h:1",le="0.01"} 1
+jsonrpc_call_duration_seconds_bucket{method="add.user",host="h:1",le="0.025"} 1
+jsonrpc_call_duration_seconds_bucket{method="add.user",host="h:1",le="0.05"} 1
+jsonrpc_call_duration_seconds_bucket{method="add.user",host="h:1",le="0.1"} 1
+jsonrpc_call_duration_seconds_bucket{method="add.user",host="h:1",le="0.25"} 2
+jsonrpc_call_duration_seconds_bucket{method="add.user",host="h:1",le="0.5"} 2
+jsonrpc_call_duration_seconds_bucket{method="add.user",host="h:1",le="1.0"} 2
+jsonrpc_call_duration_seconds_bucket{method="add.user",host="h:1",le="2.5"} 2
+jsonrpc_call_duration_seconds_bucket{method="add.user",host="h:1",le="5.0"} 2
+jsonrpc_call_duration_seconds_bucket{method="add.user",host="h:1",le="10.0"} 3
+jsonrpc_call_duration_seconds_bucket{method="add.user",host="h:1",le="+Inf"} 3
+jsonrpc_call_duration_seconds_sum{method="add.user",host="h:1"} 6.12890625
+jsonrpc_call_duration_seconds_count{method="add.user",host="h:1"} 3
+'''
+
+
+def method_not_found():
+    return jsonrpc_ns.JSONRPCResponseError(
+        {'code': -32601, 'message': 'Method not found'})
+
+
+def recorded():
+    """Metrics of three calls whose latencies add up exactly."""
+    m = Metrics()
+    m.record('add.user', 'h:1', 0.00390625, sent=10, received=20)
+    m.record('add.user', 'h:1', 0.125, error=method_not_found(),
+             sent=5, received=30)
+    m.record('add.user', 'h:1', 6.0, error=socket.timeout())
+    m.record_error('add.user', 'h:1', method_not_found())
+    return m
+
+
+class MetricsTest(unittest.TestCase):
+
+    maxDiff = None
+
+    def test_prometheus(self):
+        self.assertEqual(recorded().to_prometheus(), PROMETHEUS)
+        self.assertEqual(recorded().dump(), PROMETHEUS)
+
+    def test_json(self):
+        summary = json.loads(recorded().dump(metrics.JSON))
+        self.assertEqual(summary, [{
+            'method': 'add.user',
+            'host': 'h:1',
+            'calls': 3,
+            'timeouts': 1,
+            'failures': 0,
+            'error_codes': {'-32601': 2},
+            'bytes_sent': 15,
+            'bytes_received': 50,
+            'latency': {
+                'sum': 6.12890625,
+                'mean': 6.12890625 / 3,
+                'p50': summary[0]['latency']['p50'],
+                'p90': summary[0]['latency']['p90'],
+                'p99': summary[0]['latency']['p99'],
+            },
+        }])
+        latency = summary[0]['latency']
+        self.assertTrue(0.1 <= latency['p50'] <= 0.25)
+        self.assertTrue(5.0 <= latency['p90'] <= latency['p99'] <= 10.0)
+
+    def test_other_failures(self):
+        m = Metrics()
+        m.record('m', 'h:1', 0.01, error=socket.error('refused'))
+        self.assertEqual(m.to_json()[0]['failures'], 1)
+
+    def test_label_escaping(self):
+        self.assertEqual(metrics.quote('a\\b "c"\nd'), r'"a\\b \"c\"\nd"')
+        self.assertEqual(metrics.quote(-32601), '"-32601"')
+        m = Metrics()
+        m.record('say "hi"\n', 'C:\\h', 0.01)
+        self.assertIn(
+            'jsonrpc_calls_total{method="say \\"hi\\"\\n",host="C:\\\\h"} 1\n',
+            m.to_prometheus())
+        self.assertEqual(m.to_json()[0]['method'], 'say "hi"\n')
+
+    def test_empty(self):
+        m = Metrics()
+        self.assertEqual(m.to_json(), [])
+        lines = m.to_prometheus().splitlines()
+        self.assertEqual(len(lines), 2 * len(metrics.PROMETHEUS_FAMILIES))
+        self.assertTrue(all(line.startswith('# ') for line in lines))
+
+
+class MetricsWriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.path = os.path.join(self.dir, 'jsonrpc.prom')
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def test_written_at_start_and_on_close(self):
+        m = Metrics()
+        writer = MetricsWriter(m, self.path)
+        self.assertEqual(self.read(), Metrics().to_prometheus())
+        m.record('m', 'h:1', 0.01)
+        writer.close()
+        self.assertEqual(self.read(), m.to_prometheus())
+        self.assertEqual(os.listdir(self.dir), ['jsonrpc.prom'])
+
+    def test_json(self):
+        writer = MetricsWriter(recorded(), self.path, fmt=metrics.JSON)
+        writer.close()
+        self.assertEqual(json.loads(self.read()), recorded().to_json())
+
+    def test_replaced_atomically(self):
+        with open(self.path, 'w') as f:
+            f.write('old')
+        replaced = []
+        real_replace = os.replace
+
+        def replace(src, dst):
+            # The complete file is written next to the old one, which is
+            # untouched until it's replaced.
+            with open(src) as f:
+                replaced.append((dst, f.read()))
+            self.assertEqual(self.read(), 'old' if len(replaced) == 1
+                             else PROMETHEUS)
+            real_replace(src, dst)
+
+        with mock.patch.object(metrics.os, 'replace', side_effect=replace):
+            MetricsWriter(recorded(), self.path).close()
+        self.assertEqual(replaced, [(self.path, PROMETHEUS)] * 2)
+        self.assertEqual(self.read(), PROMETHEUS)
+        self.assertEqual(os.listdir(self.dir), ['jsonrpc.prom'])
+
+    def test_bad_path(self):
+        with self.assertRaises(IOError):
+            MetricsWriter(Metrics(), os.path.join(self.dir, 'no', 'file'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+from __future__ import division
+import time
+import socket
+import unittest
+
+from jsonrpcake.scheduler import Scheduler, Backoff, TokenBucket
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def test_every_job_is_called(self):
+        scheduler = Scheduler(max_in_flight=4)
+        results = sorted(result for _, result, _
+                         in scheduler.map(lambda n: n * 2, range(100)))
+        self.assertEqual(results, [n * 2 for n in range(100)])
+
+    def test_call_errors_are_yielded(self):
+        def func(n):
+            if n == 3:
+                raise ValueError('three')
+            return n
+
+        errors = [(job, str(error)) for job, _, error
+                  in Scheduler(max_in_flight=2).map(func, range(5))
+                  if error is not None]
+        self.assertEqual(errors, [(3, 'three')])
+
+    def test_jobs_iterator_error_is_raised(self):
+        def jobs():
+            yield 1
+            yield 2
+            raise ValueError('bad line')
+
+        scheduler = Scheduler(max_in_flight=2)
+        done = []
+        with self.assertRaises(ValueError) as cm:
+            for job, _, _ in scheduler.map(lambda n: n, jobs()):
+                done.append(job)
+        self.assertEqual(str(cm.exception), 'bad line')
+        self.assertEqual(sorted(done), [1, 2])
+
+    def test_in_flight_limit(self):
+        scheduler = Scheduler(max_in_flight=3, backoff=False)
+        peak = [0]
+
+        def func(_):
+            peak[0] = max(peak[0], scheduler.in_flight)
+            time.sleep(0.005)
+
+        list(scheduler.map(func, range(30)))
+        self.assertLessEqual(peak[0], 3)
+
+    def test_deadline_skips_calls(self):
+        scheduler = Scheduler(max_in_flight=1, backoff=False,
+                              deadline=time.time() + 0.1)
+        calls = list(scheduler.map(lambda _: time.sleep(0.02), range(100)))
+        self.assertTrue(scheduler.skipped)
+        self.assertLess(len(calls), 100)
+
+
+class BackoffTest(unittest.TestCase):
+
+    def test_halves_on_errors_and_recovers(self):
+        backoff = Backoff(window=10, threshold=0.1)
+        for _ in range(10):
+            backoff.record(socket.timeout())
+        self.assertEqual(backoff.factor, 0.5)
+        for _ in range(10):
+            backoff.record(None)
+        self.assertAlmostEqual(backoff.factor, 0.6)
+
+    def test_floor(self):
+        backoff = Backoff(window=1, floor=1 / 4)
+        for _ in range(10):
+            backoff.record(socket.timeout())
+        self.assertEqual(backoff.factor, 1 / 4)
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(rate=100, burst=5)
+        started = time.time()
+        for _ in range(10):
+            bucket.acquire()
+        elapsed = time.time() - started
+        # 5 at once, then 5 more at 100/s.
+        self.assertGreaterEqual(elapsed, 0.04)
+        self.assertLess(elapsed, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+from __future__ import division
+import io
+import json
+import time
+import threading
+import unittest
+
+from jsonrpcake.sink import ResultSink
+
+
+def records(outfile):
+    return [json.loads(line) for line in outfile.getvalue().splitlines()]
+
+
+class ResultSinkTest(unittest.TestCase):
+
+    def test_unordered_writes_as_added(self):
+        outfile = io.BytesIO()
+        sink = ResultSink(outfile)
+        sink.add(2, result='c')
+        sink.add(0, error={'code': -1, 'message': 'x'})
+        sink.skip(1)
+        sink.close()
+        self.assertEqual(records(outfile), [
+            {'id': 2, 'result': 'c'},
+            {'id': 0, 'error': {'code': -1, 'message': 'x'}}])
+
+    def test_ordered_writes_in_input_order(self):
+        outfile = io.BytesIO()
+        sink = ResultSink(outfile, ordered=True)
+        sink.add(2, result='c')
+        sink.skip(1)
+        self.assertEqual(outfile.getvalue(), b'')
+        sink.add(0, result='a')
+        sink.add(3, result='d')
+        sink.close()
+        self.assertEqual(records(outfile), [{'id': 0, 'result': 'a'},
+                                            {'id': 2, 'result': 'c'},
+                                            {'id': 3, 'result': 'd'}])
+        self.assertEqual(sink.buffer, {})
+
+    def test_gate_blocks_while_the_buffer_is_full(self):
+        outfile = io.BytesIO()
+        sink = ResultSink(outfile, ordered=True, window=4)
+        gated = []
+
+        def produce():
+            for index, _ in sink.gate(range(10)):
+                gated.append(index)
+
+        thread = threading.Thread(target=produce)
+        thread.daemon = True
+        thread.start()
+        time.sleep(0.1)
+        self.assertEqual(gated, [0, 1, 2, 3])
+        for index in (3, 2, 1):
+            sink.add(index, result=index)
+        time.sleep(0.1)
+        self.assertEqual(gated, [0, 1, 2, 3])
+        sink.add(0, result=0)
+        time.sleep(0.1)
+        self.assertEqual(gated, list(range(8)))
+        for index in range(4, 10):
+            sink.add(index, result=index)
+        thread.join(5)
+        sink.close()
+        self.assertEqual([record['id'] for record in records(outfile)],
+                         list(range(10)))
+
+    def test_non_ascii_results(self):
+        outfile = io.BytesIO()
+        sink = ResultSink(outfile)
+        sink.add(0, result='é')
+        sink.close()
+        self.assertEqual(outfile.getvalue(),
+                         '{"id": 0, "result": "é"}\n'.encode('utf8'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+from __future__ import division
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from jsonrpcake import store
+from jsonrpcake.store import Index, Store, StoreError, load_index
+
+
+class IndexTest(unittest.TestCase):
+
+    def test_containers_in_order(self):
+        data = b'{"a": [1, 2, {}], "b": {"c": "[,]"}, "d": []}'
+        index = Index.build(data)
+        self.assertEqual([data[i:i + 1] for i in index.starts],
+                         [b'{', b'[', b'{', b'{', b'['])
+        self.assertEqual([data[i:i + 1] for i in index.ends],
+                         [b'}', b']', b'}', b'}', b']'])
+        self.assertEqual(list(index.counts), [3, 3, 0, 1, 0])
+        self.assertEqual(index.find(data.index(b'[')), 1)
+
+    def test_single_member(self):
+        self.assertEqual(list(Index.build(b'[ 1 ]').counts), [1])
+        self.assertEqual(list(Index.build(b'[ ]').counts), [0])
+
+    def test_checkpoints(self):
+        items = list(range(store.CHECKPOINT_INTERVAL * 2 + 5))
+        data = json.dumps(items).encode()
+        index = Index.build(data)
+        mark = index.marks[0]
+        for j in (0, 1):
+            n = (j + 1) * store.CHECKPOINT_INTERVAL
+            pos = index.checkpoints[mark + j]
+            self.assertEqual(data[pos:].lstrip()[:len(str(n))],
+                             str(n).encode())
+
+    def test_invalid(self):
+        for data in (b'[1, 2', b'[1}', b'1, 2', b']'):
+            with self.assertRaises(StoreError):
+                Index.build(data)
+
+    def test_no_container(self):
+        with self.assertRaises(StoreError):
+            Index.build(b'[1]').find(1)
+
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.value = {'users': [{'name': 'u%d' % i, 'tags': ['a']}
+                                for i in range(3000)],
+                      'a.b': {'': 1}}
+        self.filename = os.path.join(self.dir, 'response.json')
+        with open(self.filename, 'w') as f:
+            json.dump(self.value, f, indent=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_find(self):
+        s = Store(self.filename)
+        try:
+            for path in (['users', 2500, 'name'], ['users', 0], ['a.b', ''],
+                         []):
+                expected = self.value
+                for key in path:
+                    expected = expected[key]
+                self.assertEqual(s.decode(s.find(path)), expected)
+            with self.assertRaises(StoreError):
+                s.find(['users', 3000])
+        finally:
+            s.close()
+
+    def test_index_is_cached(self):
+        cache_dir = os.path.join(self.dir, 'cache')
+        with open(self.filename, 'rb') as f:
+            data = f.read()
+        built = load_index(self.filename, data, cache_dir)
+        self.assertEqual(len(os.listdir(os.path.join(cache_dir, 'indexes'))),
+                         1)
+        loaded = load_index(self.filename, data, cache_dir)
+        self.assertEqual(list(loaded.starts), list(built.starts))
+        self.assertEqual(list(loaded.checkpoints), list(built.checkpoints))
+
+    def test_summary(self):
+        s = Store(self.filename)
+        try:
+            lines = list(s.summary([]))
+        finally:
+            s.close()
+        self.assertTrue(lines[0].startswith('$  object'))
+        self.assertTrue(lines[2].startswith('$["a.b"]  object'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+from __future__ import division
+import json
+import unittest
+
+import jsonrpc_ns
+
+from jsonrpcake.stream import ResponseScanner
+
+
+def scan(data, rpcid=None, size=3):
+    """Feed `data` to a scanner `size` bytes at a time."""
+    out = []
+    scanner = ResponseScanner(out.append, rpcid)
+    for i in range(0, len(data), size):
+        scanner.feed(data[i:i + size])
+    return b''.join(out), scanner.close()
+
+
+class ResponseScannerTest(unittest.TestCase):
+
+    def assertCompact(self, result, text):
+        data = ('{"jsonrpc": "2.0", "result": %s, "id": 1}' % text).encode()
+        for size in (1, 2, 3, 7, len(data)):
+            written, response = scan(data, size=size)
+            self.assertEqual(
+                written.decode('utf8', 'surrogatepass'),
+                json.dumps(result, ensure_ascii=False, separators=(',', ':')))
+            self.assertEqual(response, {'jsonrpc': '2.0', 'result': None,
+                                        'id': 1})
+
+    def test_whitespace_is_removed(self):
+        self.assertCompact({'a': [1, 2, {}]}, '{ "a" : [ 1 ,\n 2, { } ] }')
+
+    def test_escapes_are_written_as_compact_output_does(self):
+        self.assertCompact(['é', '\U0001f600', '"\\\n', '/', '\x01'],
+                           r'["é", "😀", "\"\\\n", "\/",'
+                           r' "\u0001"]')
+
+    def test_lone_surrogate_escape(self):
+        self.assertCompact('\ud83d\n', r'"\ud83d\n"')
+
+    def test_numbers_are_written_as_compact_output_does(self):
+        self.assertCompact([1.5, 0.1, 1e+300, -0, 12],
+                           '[15e-1, 1.0E-1, 1e300, -0, 12]')
+
+    def test_scalar_result(self):
+        self.assertCompact(150.0, '1.5e2')
+        self.assertCompact('é', r'"é"')
+
+    def test_result_of_another_call_is_not_written(self):
+        for data in (b'{"id": 2, "result": [1]}', b'{"result": [1], "id": 2}'):
+            out = []
+            scanner = ResponseScanner(out.append, 1)
+            with self.assertRaises(jsonrpc_ns.JSONRPCBadResponse):
+                scanner.feed(data)
+            self.assertEqual(out, [])
+
+    def test_result_held_until_id(self):
+        written, response = scan(b'{"result": [1, 2], "id": 1}', rpcid=1)
+        self.assertEqual(written, b'[1,2]')
+        self.assertEqual(response['id'], 1)
+
+    def test_truncated(self):
+        with self.assertRaises(jsonrpc_ns.JSONRPCBadResponse):
+            scan(b'{"result": [1, 2')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+from __future__ import division
+import socket
+import shutil
+import tempfile
+import unittest
+
+from jsonrpcake import timeouts
+from jsonrpcake.timeouts import LatencySketch, LatencyHistory
+
+
+class LatencySketchTest(unittest.TestCase):
+
+    def test_quantile_is_a_bucket_bound(self):
+        sketch = LatencySketch()
+        for _ in range(99):
+            sketch.observe(0.01)
+        sketch.observe(1.0)
+        self.assertEqual(sketch.total, 100)
+        # Within one bucket (20%) above the latency.
+        self.assertTrue(0.01 <= sketch.quantile(0.5) < 0.012)
+        self.assertTrue(0.01 <= sketch.quantile(0.99) < 0.012)
+        self.assertTrue(1.0 <= sketch.quantile(1) < 1.2)
+
+    def test_merge_halves_old_counts(self):
+        sketch = LatencySketch()
+        other = LatencySketch()
+        for _ in range(timeouts.MAX_SAMPLES + 1):
+            other.observe(0.5)
+        sketch.merge(other)
+        self.assertEqual(sketch.total, (timeouts.MAX_SAMPLES + 1) // 2)
+
+    def test_json_round_trip(self):
+        sketch = LatencySketch()
+        sketch.observe(0.003)
+        sketch.observe(0)
+        self.assertEqual(LatencySketch.from_json(sketch.to_json()).counts,
+                         sketch.counts)
+        self.assertEqual(LatencySketch.from_json('junk').counts, {})
+
+
+class LatencyHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_timeout_learned_after_enough_calls(self):
+        history = LatencyHistory(self.dir)
+        for _ in range(timeouts.MIN_SAMPLES - 1):
+            history.observe('addr', 'm', 0.2)
+        history.save()
+        self.assertIsNone(history.timeout('addr', 'm'))
+        history.observe('addr', 'm', 0.2)
+        history.save()
+        timeout = LatencyHistory(self.dir).timeout('addr', 'm')
+        self.assertTrue(0.2 * timeouts.SAFETY_FACTOR <= timeout
+                        < 0.24 * timeouts.SAFETY_FACTOR)
+
+    def test_timeout_bounds(self):
+        history = LatencyHistory(self.dir)
+        for _ in range(timeouts.MIN_SAMPLES):
+            history.observe('addr', 'fast', 0.00001)
+            history.observe('addr', 'slow', 1000)
+        history.save()
+        self.assertEqual(history.timeout('addr', 'fast'), timeouts.MIN_TIMEOUT)
+        self.assertEqual(history.timeout('addr', 'slow'), timeouts.MAX_TIMEOUT)
+
+    def test_only_timeouts_count_among_errors(self):
+        history = LatencyHistory(self.dir)
+        history.observe('addr', 'm', 5, error=socket.timeout())
+        history.observe('addr', 'm', 0.1, error=socket.error())
+        history.save()
+        self.assertEqual(history.load('addr', 'm').total, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,422 @@
+from __future__ import division
+import os
+import json
+import time
+import shutil
+import socket
+import tempfile
+import unittest
+from unittest import mock
+
+import jsonrpc_ns
+
+from jsonrpcake.client import Client
+from jsonrpcake import transport
+from jsonrpcake.transport import (Connection, ConnectionPool, Resolver,
+                                  connect, interleave, iterencode,
+                                  iter_message, encode_message)
+
+from .server import Server, frame, response, error_response, closed_port
+
+
+# Long enough for any test here, short enough for a hang to fail.
+TIMEOUT = 5
+
+
+def sends(*parts):
+    """A handler that sends `parts` (`bytes`) a little apart and closes."""
+    def handler(server, sock, rfile):
+        for part in parts:
+            sock.sendall(part)
+            time.sleep(0.01)
+    return handler
+
+
+def parse_netstring(data):
+    length, _, rest = data.partition(b':')
+    if not rest.endswith(b',') or len(rest) - 1 != int(length):
+        raise AssertionError('bad netstring: %r...' % data[:50])
+    return rest[:-1]
+
+
+def addrinfo(host, port, family=socket.AF_INET):
+    return (family, socket.SOCK_STREAM, socket.IPPROTO_TCP, '', (host, port))
+
+
+class ResolverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        patcher = mock.patch.object(
+            transport.socket, 'getaddrinfo',
+            return_value=[addrinfo('10.0.0.1', 3000),
+                          addrinfo('10.0.0.2', 3000)])
+        self.getaddrinfo = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cached_in_memory_and_on_disk(self):
+        resolver = Resolver(self.cache_dir, ttl=60)
+        infos, cached = resolver.resolve('svc.test', 3000)
+        self.assertFalse(cached)
+        self.assertEqual([info[4] for info in infos],
+                         [('10.0.0.1', 3000), ('10.0.0.2', 3000)])
+        self.assertEqual(resolver.resolve('svc.test', 3000), (infos, True))
+        # Another process finds them on disk.
+        self.assertEqual(Resolver(self.cache_dir).resolve('svc.test', 3000),
+                         (infos, True))
+        self.assertEqual(self.getaddrinfo.call_count, 1)
+
+    def test_expiry(self):
+        resolver = Resolver(self.cache_dir, ttl=60)
+        resolver.resolve('svc.test', 3000)
+        with mock.patch('time.time', return_value=time.time() + 61):
+            self.assertFalse(resolver.resolve('svc.test', 3000)[1])
+        self.assertEqual(self.getaddrinfo.call_count, 2)
+        # Expired on disk, for another process.
+        expired = time.time() - 61
+        os.utime(resolver.cache._filename('svc.test:3000'),
+                 (expired, expired))
+        self.assertFalse(
+            Resolver(self.cache_dir, ttl=60).resolve('svc.test', 3000)[1])
+        self.assertEqual(self.getaddrinfo.call_count, 3)
+
+    def test_forget(self):
+        resolver = Resolver(self.cache_dir)
+        resolver.resolve('svc.test', 3000)
+        resolver.forget('svc.test', 3000)
+        self.assertFalse(resolver.resolve('svc.test', 3000)[1])
+        self.assertFalse(Resolver(self.cache_dir).cache.get('other:1'))
+
+    def test_ip_addresses_are_not_cached_on_disk(self):
+        Resolver(self.cache_dir).resolve('10.0.0.1', 3000)
+        Resolver(self.cache_dir).resolve('10.0.0.1', 3000)
+        self.assertEqual(self.getaddrinfo.call_count, 2)
+
+    def test_stale_cached_addresses_are_resolved_again(self):
+        with Server() as server:
+            resolver = Resolver(self.cache_dir)
+            # Cached while the service was elsewhere.
+            self.getaddrinfo.return_value = [
+                addrinfo('127.0.0.1', closed_port())]
+            resolver.resolve('svc.test', server.port)
+            resolver.memory.clear()
+            self.getaddrinfo.return_value = [
+                addrinfo('127.0.0.1', server.port)]
+            conn = Connection('svc.test:%d' % server.port,
+                              connect_timeout=TIMEOUT, resolver=resolver)
+            self.addCleanup(conn.close)
+            self.assertEqual(conn.sock.getpeername()[1], server.port)
+            self.assertEqual(self.getaddrinfo.call_count, 2)
+
+
+class ConnectTest(unittest.TestCase):
+
+    def test_interleave(self):
+        v4 = [addrinfo('10.0.0.%d' % i, 1) for i in range(3)]
+        v6 = [addrinfo('::%d' % i, 1, socket.AF_INET6) for i in range(2)]
+        self.assertEqual(interleave(v6 + v4),
+                         [v6[0], v4[0], v6[1], v4[1], v4[2]])
+        self.assertEqual(interleave([v4[0], v6[0], v4[1], v4[2], v6[1]]),
+                         [v4[0], v6[0], v4[1], v6[1], v4[2]])
+        self.assertEqual(interleave(v4), v4)
+        self.assertEqual(interleave([]), [])
+
+    def test_falls_back_when_the_first_address_fails(self):
+        with Server() as server:
+            sock = connect([addrinfo('127.0.0.1', closed_port()),
+                            addrinfo('127.0.0.1', server.port)],
+                           timeout=TIMEOUT, delay=TIMEOUT)
+            try:
+                self.assertEqual(sock.getpeername()[1], server.port)
+            finally:
+                sock.close()
+
+    def test_falls_back_when_the_first_address_hangs(self):
+        # A listener with a full backlog doesn't accept connections.
+        hanging = socket.socket()
+        hanging.bind(('127.0.0.1', 0))
+        hanging.listen(0)
+        self.addCleanup(hanging.close)
+        backlog = []
+        self.addCleanup(lambda: [sock.close() for sock in backlog])
+        for _ in range(8):
+            sock = socket.socket()
+            sock.setblocking(False)
+            sock.connect_ex(hanging.getsockname())
+            backlog.append(sock)
+        with Server() as server:
+            started = time.time()
+            sock = connect([addrinfo('127.0.0.1', hanging.getsockname()[1]),
+                            addrinfo('127.0.0.1', server.port)],
+                           timeout=TIMEOUT, delay=0.05)
+            try:
+                self.assertLess(time.time() - started, TIMEOUT)
+                self.assertIn(sock.getpeername()[1],
+                              (server.port, hanging.getsockname()[1]))
+            finally:
+                sock.close()
+
+    def test_all_fail(self):
+        port = closed_port()
+        with self.assertRaises(socket.error) as cm:
+            connect([addrinfo('127.0.0.1', port)] * 2, timeout=TIMEOUT)
+        self.assertIsInstance(cm.exception, ConnectionRefusedError)
+        with self.assertRaises(socket.error):
+            connect([], timeout=TIMEOUT)
+
+
+class EncodingTest(unittest.TestCase):
+
+    def test_iterencode_equals_dumps(self):
+        n = transport.ENCODE_CHUNK_ITEMS
+        values = [
+            None, 1, 'é', [], {},
+            list(range(n)),
+            list(range(n + 1)),
+            list(range(3 * n + 7)),
+            dict(('k%d' % i, i) for i in range(2 * n + 1)),
+            {'small': [1], 'large': list(range(n + 1)), 'é': 'ü'},
+            [list(range(n + 1)), 'x', {'a': list(range(2 * n))}],
+            (1, 2, [3]),
+            [{'deep': [list(range(n + 1))]}],
+        ]
+        for value in values:
+            self.assertEqual(''.join(iterencode(value)), json.dumps(value))
+
+    def test_large_containers_are_split(self):
+        value = list(range(10 * transport.ENCODE_CHUNK_ITEMS))
+        chunks = list(iterencode(value))
+        self.assertGreater(len(chunks), 10)
+
+    def message_of_size(self, size):
+        """Return params for a request of exactly `size` bytes of JSON."""
+        message = {'jsonrpc': '2.0', 'method': 'm', 'params': [], 'id': 1}
+        params = ['x' * 7] * ((size - len(json.dumps(message))) // 11 - 1)
+        # Pad the last item to make up the difference.
+        message['params'] = params + ['']
+        params.append('x' * (size - len(json.dumps(message))))
+        message['params'] = params
+        self.assertEqual(len(json.dumps(message)), size)
+        return params
+
+    def test_iter_message_around_the_buffer_limit(self):
+        limit = transport.MAX_BUFFERED_REQUEST
+        for size in (limit - 5, limit, limit + 5, 2 * limit):
+            params = self.message_of_size(size)
+            with mock.patch.object(transport, 'iterencode',
+                                   wraps=transport.iterencode) as encode:
+                chunks = list(iter_message('m', params, 1))
+            # Larger requests are encoded once to count their bytes, and
+            # again while they are sent.
+            encoded = [call for call in encode.call_args_list
+                       if 'jsonrpc' in call[0][0]]
+            self.assertEqual(len(encoded), 1 if size <= limit else 2)
+            self.assertEqual(chunks[0], str(size).encode() + b':')
+            data = b''.join(chunks)
+            self.assertEqual(json.loads(parse_netstring(data).decode()),
+                             {'jsonrpc': '2.0', 'method': 'm',
+                              'params': params, 'id': 1})
+            self.assertEqual(parse_netstring(data).decode(), json.dumps(
+                {'jsonrpc': '2.0', 'method': 'm', 'params': params,
+                 'id': 1}))
+            self.assertTrue(all(len(chunk) < limit for chunk in chunks))
+
+    def test_non_ascii_lengths_are_in_bytes(self):
+        limit = transport.MAX_BUFFERED_REQUEST
+        for params in ({'a': 'é' * 10}, ['€' * 100] * (limit // 200)):
+            data = encode_message('m', params)
+            payload = parse_netstring(data)
+            self.assertEqual(json.loads(payload.decode('utf8'))['params'],
+                             params)
+
+    def test_notification(self):
+        payload = parse_netstring(encode_message('n'))
+        self.assertEqual(json.loads(payload.decode()),
+                         {'jsonrpc': '2.0', 'method': 'n', 'params': {}})
+
+
+class ConnectionTest(unittest.TestCase):
+
+    def connect(self, server):
+        conn = Connection(server.addr, connect_timeout=TIMEOUT)
+        conn.sock.settimeout(TIMEOUT)
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_recv_frames_split_across_packets(self):
+        with Server(sends(b'5:he', b'llo,1', b'3:{"a": [1, 2]},')) as server:
+            conn = self.connect(server)
+            self.assertEqual(conn.recv(), b'hello')
+            self.assertEqual(conn.bytes_received, 8)
+            self.assertEqual(conn.recv(), b'{"a": [1, 2]}')
+            self.assertEqual(conn.bytes_received, 25)
+
+    def test_recv_bad_netstrings(self):
+        for data in (b'5:hel', b'5:hello;', b'x:', b'1' * 13 + b':', b'12'):
+            with Server(sends(data)) as server:
+                conn = self.connect(server)
+                with self.assertRaises(jsonrpc_ns.JSONRPCBadResponse):
+                    conn.recv()
+
+    def test_recv_closed(self):
+        with Server(sends()) as server:
+            conn = self.connect(server)
+            with self.assertRaises(jsonrpc_ns.JSONRPCError):
+                conn.recv()
+            self.assertEqual(conn.bytes_received, 0)
+
+    def test_recv_chunks(self):
+        with Server(sends(b'10:0123', b'456789,')) as server:
+            conn = self.connect(server)
+            chunks = [bytes(chunk) for chunk in conn.recv_chunks(4)]
+            self.assertEqual(b''.join(chunks), b'0123456789')
+            self.assertTrue(all(len(chunk) <= 4 for chunk in chunks))
+            self.assertEqual(conn.bytes_received, 14)
+
+    def test_pipeline_matches_responses_by_id(self):
+        def handler(server, sock, rfile):
+            requests = [server.read(rfile) for _ in range(3)]
+            # Out of order, with a notification in between.
+            sock.sendall(frame(response(requests[2], 'c'))
+                         + frame({'jsonrpc': '2.0', 'method': 'tick'})
+                         + frame(response(requests[0], 'a'))
+                         + frame(error_response(requests[1], -1, 'b')))
+
+        with Server(handler) as server:
+            conn = self.connect(server)
+            responses = conn.pipeline([('a', None), ('b', [1]), ('c', {})])
+            self.assertEqual([r.get('result') for r in responses],
+                             ['a', None, 'c'])
+            self.assertEqual(responses[1]['error']['message'], 'b')
+            self.assertEqual([r['method'] for r in server.requests],
+                             ['a', 'b', 'c'])
+
+    def test_pipeline_unexpected_id(self):
+        def handler(server, sock, rfile):
+            request = server.read(rfile)
+            sock.sendall(frame(response(dict(request, id=99))))
+
+        with Server(handler) as server:
+            with self.assertRaises(jsonrpc_ns.JSONRPCBadResponse):
+                self.connect(server).request('a')
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def run_calls(self, pool, server, *calls):
+        return [pool.run(server.addr, call, TIMEOUT, TIMEOUT)
+                for call in calls]
+
+    def test_connections_are_reused(self):
+        pool = ConnectionPool()
+        self.addCleanup(pool.close)
+        with Server() as server:
+            results = self.run_calls(
+                pool, server, *[lambda conn, i=i: conn.request('m', [i])
+                                for i in range(3)])
+            self.assertEqual([r['result'] for r in results],
+                             [[0], [1], [2]])
+            self.assertEqual(server.connections, 1)
+            self.assertEqual(pool.connects, 1)
+
+    def test_max_idle(self):
+        pool = ConnectionPool(max_idle=1)
+        self.addCleanup(pool.close)
+        with Server() as server:
+            with pool.connection(server.addr, TIMEOUT, TIMEOUT):
+                with pool.connection(server.addr, TIMEOUT, TIMEOUT):
+                    pass
+            self.assertEqual(len(pool.idle[server.addr]), 1)
+            self.assertEqual(pool.connects, 2)
+
+    def test_connection_closed_while_idle_is_retried(self):
+        def handler(server, sock, rfile):
+            # One call per connection, then close it.
+            request = server.read(rfile)
+            sock.sendall(frame(response(request, 'ok')))
+
+        pool = ConnectionPool()
+        self.addCleanup(pool.close)
+        with Server(handler) as server:
+            call = lambda conn: conn.request('m')
+            self.run_calls(pool, server, call)
+            time.sleep(0.05)
+            self.assertEqual(self.run_calls(pool, server, call)[0]['result'],
+                             'ok')
+            self.assertEqual(server.connections, 2)
+            self.assertEqual(len(server.requests), 2)
+
+    def test_no_retry_once_anything_was_received(self):
+        def handler(server, sock, rfile):
+            request = server.read(rfile)
+            sock.sendall(frame(response(request)))
+            # Then respond to the first call of the next batch only.
+            requests = [server.read(rfile) for _ in range(2)]
+            sock.sendall(frame(response(requests[0])))
+
+        pool = ConnectionPool()
+        self.addCleanup(pool.close)
+        with Server(handler) as server:
+            self.run_calls(pool, server, lambda conn: conn.request('m'))
+            with self.assertRaises(jsonrpc_ns.JSONRPCError):
+                self.run_calls(pool, server, lambda conn: conn.pipeline(
+                    [('add.user', None), ('add.user', None)]))
+            self.assertEqual(server.connections, 1)
+            self.assertEqual(len(server.requests), 3)
+
+    def test_no_retry_on_fresh_connections(self):
+        pool = ConnectionPool()
+        self.addCleanup(pool.close)
+        with Server(sends()) as server:
+            # Closed with the request unread, it may be reset.
+            with self.assertRaises((socket.error, jsonrpc_ns.JSONRPCError)):
+                self.run_calls(pool, server, lambda conn: conn.request('m'))
+            self.assertEqual(server.connections, 1)
+
+
+class ClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = Server()
+        self.addCleanup(self.server.close)
+        self.pool = ConnectionPool()
+        self.addCleanup(self.pool.close)
+        self.client = Client(self.server.addr, timeout=TIMEOUT,
+                             pool=self.pool)
+
+    def test_call(self):
+        self.assertEqual(self.client.call('m', {'a': 'é'}), {'a': 'é'})
+        self.assertEqual(self.client.call('m'), {})
+        self.assertEqual(self.server.connections, 1)
+
+    def test_batch(self):
+        self.assertEqual(self.client.batch([('a', [1]), ('b', [2])]),
+                         [[1], [2]])
+
+    def test_stream(self):
+        out = []
+        self.client.stream('m', {'a': [1, 2]}, out.append)
+        self.assertEqual(b''.join(out), b'{"a":[1,2]}')
+
+    def test_notify(self):
+        self.client.notify('n', [1])
+        self.assertEqual(self.client.call('m'), {})
+        self.assertEqual([(r['method'], 'id' in r)
+                          for r in self.server.requests],
+                         [('n', False), ('m', True)])
+
+    def test_error_response(self):
+        def handler(server, sock, rfile):
+            request = server.read(rfile)
+            sock.sendall(frame(error_response(request, -32601, 'nope')))
+
+        with Server(handler) as server:
+            client = Client(server.addr, timeout=TIMEOUT, pool=self.pool)
+            with self.assertRaises(jsonrpc_ns.JSONRPCResponseError) as cm:
+                client.call('m')
+            self.assertEqual(cm.exception.value['code'], -32601)
+
+
+if __name__ == '__main__':
+    unittest.main()